@@ -5,7 +5,8 @@ SCRIPT_DIR = os.path.abspath(os.path.join(SCRIPT_PATH, os.pardir))
 APP_PATH = os.path.join(SCRIPT_DIR, 'src')
 sys.path.append(APP_PATH)
 
-# Load FPSIM file in memory to use with --preload (preload_app=True)
+# Load FPSIM file in memory to use with --preload (preload_app=True), the workers share the fingerprints mapped from
+# FPSIM2_MMAP_PATH
 os.environ.setdefault('LOAD_FPSIM2_FILE', '1')
 
 bind="0.0.0.0:8000"
@@ -2,22 +2,34 @@
 # Author Karol Sikora <karol.sikora@laboratorium.ee>, (c) 2012
 # Author Michal Nowotka <mmmnow@gmail.com>, (c) 2013-2014
 
+import time
 import traceback
 import pickle
+import uuid
 import base64
+import datetime
+import itertools
 import pymongo
 # noinspection PyPackageRequirements ; it is covered by pymongo package
 from bson import Binary
 import re
 from django.core.cache.backends.base import BaseCache
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.utils.module_loading import import_string
+from chembl_core_db.cache.codecs import get_codec
+from chembl_core_db.cache.codecs import NO_COMPRESSION
 import zlib
 import logging
 
 
 # ----------------------------------------------------------------------------------------------------------------------
 
+# Payloads bigger than this are split into chunk documents, keeping each one under the 16MB BSON limit
 MAX_SIZE = 16000000
 
+# Name of the TTL index on 'expires_at', Mongo removes documents once that date has passed
+EXPIRES_INDEX_NAME = 'expires_at_ttl'
+
 
 def camel_case_to_snake_case(name):
     s1 = re.sub('(.)([A-Z][a-z]+)', r'\1_\2', name)
@@ -45,25 +57,76 @@ class MongoDBCache(BaseCache):
         self._max_time_ms = options.get('MAX_TIME_MS', 2000)
         self._compression = options.get('COMPRESSION', True)
         self.compression_level = options.get('COMPRESSION_LEVEL', 0)
+        # BINARY stores the compressed pickle as raw BSON Binary tagged with its codec name, otherwise the legacy
+        # base64 format is written. Both formats can always be read.
+        self._binary = options.get('BINARY', True)
+        self._codec = get_codec(options.get('CODEC', 'zlib') if self._compression else NO_COMPRESSION,
+                                options.get('COMPRESSION_LEVEL'))
+        self._decoders = {self._codec.name: self._codec}
         self._tag_sets = options.get('TAG_SETS', None)
         self._read_preference = options.get("READ_PREFERENCE")
         self._collection_indexes = options.get('INDEXES', None)
         self._collection = location
+        # expired entries are removed by the TTL index, MAX_ENTRIES is only enforced by cull(), run out of the
+        # requests by the cull_chembl_cache command. Each call removes at most CULL_MAX_DOCUMENTS entries.
+        self._cull_max_documents = options.get('CULL_MAX_DOCUMENTS', 100000)
+        self._cull_batch_size = options.get('CULL_BATCH_SIZE', 1000)
+        self._lock_coll = None
+        # NAMESPACE_FUNCTION returns the namespace of the data being cached, e.g. the ChEMBL release. Every namespace
+        # gets its own collection so the ones of previous releases can be dropped in bulk. It is called once per
+        # process, when the cache is first used, and again every NAMESPACE_CHECK_INTERVAL seconds only while it fails.
+        # Processes keep their namespace until they are restarted or resolve_namespace() is called.
+        self._namespace_function = options.get('NAMESPACE_FUNCTION')
+        self._namespace_check_interval = options.get('NAMESPACE_CHECK_INTERVAL', 60)
+        # misses in the current namespace are looked up in the previous one during the first NAMESPACE_FALLBACK_WINDOW
+        # seconds of the current one, see chembl_webservices.core.cache
+        self._namespace_fallback = options.get('NAMESPACE_FALLBACK', True)
+        self._namespace_fallback_window = options.get('NAMESPACE_FALLBACK_WINDOW', 3 * 24 * 3600)
+        self._namespace = None
+        self._namespace_resolved = False
+        self._namespace_checked = 0
+        self._previous_coll = None
+        self._fallback_until = None
         self.log = logging.getLogger(__name__)
+        # the L1 cache keeps the pickles of the entries, every hit is unpickled so callers never share an object
+        self._l1 = None
+        l1_options = options.get('L1')
+        if l1_options:
+            l1_class = l1_options.get('CLASS', 'chembl_core_db.cache.lru.LRUCache')
+            if isinstance(l1_class, str):
+                l1_class = import_string(l1_class)
+            self._l1 = l1_class(l1_options)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    @staticmethod
+    def get_resource_name(key):
+        # raw keys are generated by ChemblModelResource.generate_cache_key as 'api_name:resource_name:...'
+        parts = str(key).split(':')
+        return parts[1] if len(parts) > 2 else None
 
 # ----------------------------------------------------------------------------------------------------------------------
 
-    def add(self, key, value, timeout=None, version=None):
+    def l1_info(self):
+        if not self._l1:
+            return None
+        return self._l1.info()
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        resource_name = self.get_resource_name(key)
         key = self.make_key(key, version)
         self.validate_key(key)
-        self._base_set('add', key, value, timeout)
+        return self._base_set('add', key, value, timeout, resource_name)
 
 # ----------------------------------------------------------------------------------------------------------------------
 
-    def set(self, key, value, timeout=None, version=None):
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        resource_name = self.get_resource_name(key)
         key = self.make_key(key, version)
         self.validate_key(key)
-        self._base_set('set', key, value, timeout)
+        self._base_set('set', key, value, timeout, resource_name)
 
 # ----------------------------------------------------------------------------------------------------------------------
 
@@ -72,7 +135,106 @@ class MongoDBCache(BaseCache):
 
 # ----------------------------------------------------------------------------------------------------------------------
 
-    def _base_set(self, mode, key, value, timeout=None):
+    def _get_expiry_date(self, timeout=DEFAULT_TIMEOUT):
+        expiry = self.get_backend_timeout(timeout)
+        if expiry is None:
+            return None
+        return datetime.datetime.utcfromtimestamp(expiry)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    @staticmethod
+    def _is_expired(document):
+        # the TTL monitor only runs once a minute, expired documents can still be found for a while
+        expires_at = document.get('expires_at')
+        return expires_at is not None and expires_at <= datetime.datetime.utcnow()
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        """
+        Stores all the values with a single bulk write, only chunked entries need extra round trips.
+        Returns the list of keys that could not be stored.
+        """
+        serialized = dict((key, self.serialize(value)) for key, value in data.items())
+        failed_keys = self.set_many_serialized(serialized, timeout, version)
+        if self._l1:
+            for key in data:
+                if key not in failed_keys:
+                    self._after_write(self.make_key(key, version), serialized[key][1], self.get_resource_name(key),
+                                      timeout)
+        return failed_keys
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def serialize(self, value):
+        """
+        Returns the ``(properties, payload)`` pair ``set_many_serialized`` stores: the plain properties of the value
+        stored next to it and its pickle. Once serialized the value can be written from another thread.
+        """
+        return self._get_extra_props(value), pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def set_many_serialized(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        """
+        ``set_many`` for values already serialized by ``serialize``, they are not added to the L1 cache.
+        Returns the list of keys that could not be stored.
+        """
+        if not data:
+            return []
+        requests = []
+        written = []
+        failed = set()
+        try:
+            coll = self._get_collection()
+            for key, (extra_props, payload) in data.items():
+                pkey = self.make_key(key, version)
+                self.validate_key(pkey)
+                document = self._prepare_document(coll, pkey, extra_props, payload, timeout)
+                requests.append(pymongo.ReplaceOne({'_id': pkey}, document, upsert=True))
+                written.append(key)
+            coll.bulk_write(requests, ordered=False)
+        except pymongo.errors.BulkWriteError as e:
+            failed = set(error['index'] for error in e.details.get('writeErrors', []))
+            self.log.error('Cache bulk write failed for {0} keys'.format(len(failed)))
+        except pymongo.errors.PyMongoError:
+            self.log.error('Cache bulk write failed', exc_info=True)
+            return list(data.keys())
+        return [key for idx, key in enumerate(written) if idx in failed]
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _base_set(self, mode, key, value, timeout=DEFAULT_TIMEOUT, resource_name=None):
+        coll = self._get_collection()
+        extra_props, payload = self.serialize(value)
+        document = self._prepare_document(coll, key, extra_props, payload, timeout)
+        if mode == 'add':
+            # only replaces an entry that expired but was not removed by the TTL monitor yet, the insert of the upsert
+            # fails if the key holds a live entry
+            try:
+                coll.replace_one({'_id': key, 'expires_at': {'$lte': datetime.datetime.utcnow()}}, document,
+                                 upsert=True)
+            except pymongo.errors.DuplicateKeyError:
+                if document.get('chunks'):
+                    coll.delete_many({'_id': {'$in': document['chunks']}})
+                return False
+        else:
+            coll.replace_one({'_id': key}, document, upsert=True)
+        self._after_write(key, payload, resource_name, timeout)
+        return True
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _after_write(self, key, payload, resource_name, timeout):
+        if self._l1:
+            l1_timeout = timeout if isinstance(timeout, (int, float)) else None
+            self._l1.set(key, payload, len(payload), resource_name, l1_timeout)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    @staticmethod
+    def _get_extra_props(value):
         extra_props = {}
         if isinstance(value, dict):
             for k, v in value.items():
@@ -85,90 +247,199 @@ class MongoDBCache(BaseCache):
         extra_props.pop('_id', None)
         extra_props.pop('data', None)
         extra_props.pop('chunks', None)
+        extra_props.pop('codec', None)
+        extra_props.pop('size', None)
+        return extra_props
 
-        coll = self._get_collection()
-        encoded = self._encode(value)
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _prepare_document(self, coll, key, extra_props, payload, timeout):
+        """
+        Returns the document to store under ``key`` without its id, from the properties and pickle returned by
+        ``serialize``. Chunks of oversized values are written straight away.
+        """
+        extra_props = dict(extra_props)
+        extra_props['expires_at'] = self._get_expiry_date(timeout)
+
+        encoded, codec = self._encode_payload(payload)
+        if codec:
+            extra_props['codec'] = codec
         document_size = len(encoded)
-        data = coll.find_one({'_id': key}, max_time_ms=self._max_time_ms)
 
-        if data and (mode == 'set' or mode == 'add'):
-            pass
-        if not self._compression or document_size <= MAX_SIZE:
-            extra_props.update({'_id': key, 'data': encoded})
-            coll.insert_one(extra_props)
+        if document_size <= MAX_SIZE:
+            extra_props['data'] = encoded
         else:
-            chunk_keys = []
-            chunks = []
-            for i in range(0, document_size, MAX_SIZE):
-                chunk = encoded[i:i + MAX_SIZE]
-                aux_key = self.make_key(chunk)
-                extra_props.update({'_id': aux_key, 'data': chunk})
-                chunk.append(extra_props)
-                chunk_keys.append(aux_key)
-            coll.insert_many(chunks)
-            extra_props.update({'_id': key, 'chunks': chunk_keys})
-            coll.insert_one(extra_props)
+            # chunk ids are unique per write so a concurrent or repeated set never collides with older chunks,
+            # chunks orphaned by a later write share the expiry date of their parent and are reaped with it
+            generation = uuid.uuid4().hex
+            chunk_keys = ['{0}:{1}:{2}'.format(key, generation, idx)
+                          for idx in range((document_size + MAX_SIZE - 1) // MAX_SIZE)]
+            coll.insert_many(self._iter_chunks(key, encoded, chunk_keys, extra_props['expires_at']), ordered=False)
+            extra_props.update({'chunks': chunk_keys, 'size': document_size})
+
+        return extra_props
 
 # ----------------------------------------------------------------------------------------------------------------------
 
-    def _decode(self, data):
-        if self._compression:
-            return pickle.loads(zlib.decompress(base64.decodebytes(data)))
-        return pickle.loads(data)
+    @staticmethod
+    def _iter_chunks(key, encoded, chunk_keys, expires_at=None):
+        view = memoryview(encoded)
+        for idx, chunk_key in enumerate(chunk_keys):
+            yield {'_id': chunk_key, 'chunk_of': key, 'expires_at': expires_at,
+                   'data': Binary(view[idx * MAX_SIZE:(idx + 1) * MAX_SIZE])}
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _fetch_chunks(self, coll, documents):
+        """
+        Reassembles the payloads of chunked documents fetching all their chunks with a single query.
+        Returns a dictionary from document id to payload, documents with missing chunks are left out.
+        """
+        chunk_keys = [chunk_key for document in documents for chunk_key in document['chunks']]
+        parts = {}
+        for chunk in coll.find({'_id': {'$in': chunk_keys}}).max_time_ms(self._max_time_ms):
+            parts[chunk['_id']] = chunk['data']
+        ret = {}
+        for document in documents:
+            if any(chunk_key not in parts for chunk_key in document['chunks']):
+                self.log.warning('Incomplete chunked cache entry {0}'.format(document['_id']))
+                continue
+            size = document.get('size') or sum(len(parts[chunk_key]) for chunk_key in document['chunks'])
+            raw = bytearray(size)
+            offset = 0
+            for chunk_key in document['chunks']:
+                part = parts[chunk_key]
+                raw[offset:offset + len(part)] = part
+                offset += len(part)
+            ret[document['_id']] = raw
+        return ret
 
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _decode(self, data, codec=None):
+        return pickle.loads(self._decompress(data, codec))
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _decompress(self, data, codec=None):
+        """
+        Returns the pickle stored in ``data``. Documents without codec were written by the legacy base64 encoder.
+        """
+        if codec:
+            decoder = self._decoders.get(codec)
+            if decoder is None:
+                decoder = self._decoders[codec] = get_codec(codec)
+            return decoder.decompress(data)
+        if self._compression:
+            return zlib.decompress(base64.decodebytes(data))
+        return data
 
 # ----------------------------------------------------------------------------------------------------------------------
 
     def _encode(self, data):
+        return self._encode_payload(pickle.dumps(data, pickle.HIGHEST_PROTOCOL))[0]
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _encode_payload(self, payload):
+        """
+        Returns a tuple with the data to store and the name of the codec used, None for the legacy format.
+        """
+        if self._binary:
+            return Binary(self._codec.compress(payload)), self._codec.name
         if self._compression:
-            return base64.encodebytes(zlib.compress(pickle.dumps(data, pickle.HIGHEST_PROTOCOL), self.compression_level))
-        return Binary(pickle.dumps(data, pickle.HIGHEST_PROTOCOL))
+            return base64.encodebytes(zlib.compress(payload, self.compression_level)), None
+        return Binary(payload), None
 
 # ----------------------------------------------------------------------------------------------------------------------
 
     def get(self, key, default=None, version=None):
-        coll = self._get_collection()
+        resource_name = self.get_resource_name(key)
         key = self.make_key(key, version)
         self.validate_key(key)
-        data = coll.find_one({'_id': key}, max_time_ms=self._max_time_ms)
-        if not data:
+        if self._l1:
+            found, payload = self._l1.get(key, resource_name)
+            if found:
+                return pickle.loads(payload)
+        found = self._find_documents([key])
+        if key not in found:
             return default
-        raw = data.get('data')
-        if not raw:
-            chunks = data.get('chunks')
-            if chunks:
-                raw = ''
-                for chunk in chunks:
-                    raw += coll.find_one({'_id': chunk}, max_time_ms=self._max_time_ms)['data']
-            else:
-                return default
-        return self._decode(raw)
+        data, raw = found[key]
+        payload = self._decompress(raw, data.get('codec'))
+        if self._l1:
+            self._l1.set(key, payload, len(payload), resource_name)
+        return pickle.loads(payload)
 
 # ----------------------------------------------------------------------------------------------------------------------
 
     def get_many(self, keys, version=None):
-        coll = self._get_collection()
         out = {}
         parsed_keys = {}
         for key in keys:
             pkey = self.make_key(key, version)
             self.validate_key(pkey)
+            if self._l1:
+                found, payload = self._l1.get(pkey, self.get_resource_name(key))
+                if found:
+                    out[key] = pickle.loads(payload)
+                    continue
             parsed_keys[pkey] = key
-        data = coll.find({'_id': {'$in': list(parsed_keys.keys())}}).max_time_ms(self._max_time_ms)
-        for result in data:
-            raw = result.get('data')
-            chunks = result.get('chunks')
-            if chunks:
-                raw = ''
-                for chunk in chunks:
-                    raw += coll.find_one({'_id': chunk}, max_time_ms=self._max_time_ms)['data']
-            out[parsed_keys[result['_id']]] = self._decode(raw)
+        if not parsed_keys:
+            return out
+        for result, raw in self._find_documents(list(parsed_keys.keys())).values():
+            key = parsed_keys[result['_id']]
+            payload = self._decompress(raw, result.get('codec'))
+            if self._l1:
+                self._l1.set(result['_id'], payload, len(payload), self.get_resource_name(key))
+            out[key] = pickle.loads(payload)
         return out
 
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _find_documents(self, keys):
+        """
+        Returns a dictionary from key to a tuple with the document and its raw payload, missing, expired or
+        incomplete entries are left out. Keys missing in the current namespace are looked up in the previous one.
+        """
+        coll = self._get_collection()
+        ret = self._find_in_collection(coll, keys)
+        if self._previous_coll is not None and len(ret) < len(keys):
+            if self._fallback_until > datetime.datetime.utcnow():
+                ret.update(self._find_in_collection(self._previous_coll, [key for key in keys if key not in ret]))
+            else:
+                self.log.info('Cache fallback to collection {0} is over'.format(self._previous_coll.name))
+                self._previous_coll = None
+        return ret
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _find_in_collection(self, coll, keys):
+        if len(keys) == 1:
+            data = coll.find_one({'_id': keys[0]}, max_time_ms=self._max_time_ms)
+            data = [data] if data else []
+        else:
+            data = list(coll.find({'_id': {'$in': keys}}).max_time_ms(self._max_time_ms))
+        data = [result for result in data if not self._is_expired(result)]
+        chunked = [result for result in data if not result.get('data') and result.get('chunks')]
+        chunked_raw = self._fetch_chunks(coll, chunked) if chunked else {}
+        ret = {}
+        for result in data:
+            raw = result.get('data') or chunked_raw.get(result['_id'])
+            if raw:
+                ret[result['_id']] = (result, raw)
+        return ret
+
 # ----------------------------------------------------------------------------------------------------------------------
 
     def delete(self, key, version=None):
-        pass
+        key = self.make_key(key, version)
+        self.validate_key(key)
+        if self._l1:
+            self._l1.delete(key)
+        coll = self._get_collection()
+        data = coll.find_one({'_id': key}, projection={'chunks': True}, max_time_ms=self._max_time_ms)
+        if data:
+            coll.delete_many({'_id': {'$in': [key] + data.get('chunks', [])}})
 
 # ----------------------------------------------------------------------------------------------------------------------
 
@@ -176,54 +447,160 @@ class MongoDBCache(BaseCache):
         coll = self._get_collection()
         key = self.make_key(key, version)
         self.validate_key(key)
-        data = coll.find_one({'_id': key}, max_time_ms=self._max_time_ms)
-        return data is not None
+        data = coll.find_one({'_id': key}, projection={'expires_at': True}, max_time_ms=self._max_time_ms)
+        return data is not None and not self._is_expired(data)
 
 # ----------------------------------------------------------------------------------------------------------------------
 
     def clear(self):
-        pass
+        if self._l1:
+            self._l1.clear()
+        self._get_collection().drop()
+        # the collection and its indexes are created again on next use
+        self._coll = None
 
 # ----------------------------------------------------------------------------------------------------------------------
 
-    def _cull(self):
-        pass
+    def cull(self, max_documents=None):
+        """
+        Removes 1/CULL_FREQUENCY of the entries, starting with the ones closest to expiry, when the collection holds
+        more than MAX_ENTRIES documents. Entries written before expiry dates were stored sort first and go away first.
+        A call removes at most ``max_documents`` entries, CULL_MAX_DOCUMENTS by default, each entry is deleted in
+        the same statement as its chunks. Returns the number of documents deleted.
+        """
+        coll = self._get_collection()
+        count = coll.estimated_document_count()
+        if count <= self._max_entries:
+            return 0
+        if self._cull_frequency == 0:
+            self.clear()
+            return count
+        limit = min(count // self._cull_frequency, max_documents or self._cull_max_documents)
+        # chunks are found through the entries they belong to, they are not culled on their own
+        cursor = coll.find({'chunk_of': {'$exists': False}}, projection={'chunks': True})\
+            .sort('expires_at', pymongo.ASCENDING).limit(limit)
+        deleted = 0
+        while True:
+            batch = list(itertools.islice(cursor, self._cull_batch_size))
+            if not batch:
+                break
+            ids = [document['_id'] for document in batch]
+            ids.extend(chunk_key for document in batch for chunk_key in document.get('chunks', []))
+            deleted += coll.delete_many({'_id': {'$in': ids}}).deleted_count
+        self.log.info('Culled {0} documents from cache collection {1}'.format(deleted, coll.name))
+        return deleted
 
 # ----------------------------------------------------------------------------------------------------------------------
 
     def _get_collection(self):
-        if not getattr(self, '_coll', None):
+        if self._namespace_function and not self._namespace_resolved and \
+                time.time() - self._namespace_checked > self._namespace_check_interval:
+            self.resolve_namespace()
+        if getattr(self, '_coll', None) is None:
             self._initialize_collection()
         return self._coll
 
 # ----------------------------------------------------------------------------------------------------------------------
 
-    def _initialize_collection(self):
-        self.connection = pymongo.MongoClient(connect=False, host=self._host, replicaset=self._rsname,
-            sockettimeoutms=self._socket_timeout_ms, connecttimeoutms=self._connect_timeout_ms,
-            serverSelectionTimeoutMS=self._server_selection_timeout_ms, read_preference=self._read_preference)
+    def resolve_namespace(self):
+        """
+        Calls NAMESPACE_FUNCTION and switches to the collection of the namespace it returns.
+        """
+        self._namespace_checked = time.time()
+        try:
+            namespace_function = self._namespace_function
+            if isinstance(namespace_function, str):
+                namespace_function = import_string(namespace_function)
+            namespace = namespace_function()
+        except Exception:
+            self.log.error('Could not get the cache namespace, keeping {0}'.format(self._namespace), exc_info=True)
+            return
+        self._namespace_resolved = True
+        if namespace != self._namespace:
+            self.log.info('Cache namespace changed from {0} to {1}'.format(self._namespace, namespace))
+            self._namespace = namespace
+            self._coll = None
+            self._previous_coll = None
+            if self._l1:
+                self._l1.clear()
 
-        self._db = self.connection[self._database]
-        if self._user and self._password:
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def current_namespace(self):
+        self._get_collection()
+        return self._namespace
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def get_collection_name(self, namespace=None):
+        namespace = namespace or self._namespace
+        if not namespace:
+            return self._collection
+        return '{0}_{1}'.format(self._collection, namespace)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def get_namespace_registry(self):
+        """
+        Collection with a document per namespace ever used, with the date it was first used.
+        """
+        self._get_collection()
+        return self._db[self._collection + '_namespaces']
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def namespaces(self):
+        """
+        Returns the registered namespaces, newest first.
+        """
+        return list(self.get_namespace_registry().find().sort('created', pymongo.DESCENDING))
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def drop_namespace(self, namespace):
+        if namespace == self._namespace:
+            self.clear()
+        else:
+            self._db.drop_collection(self.get_collection_name(namespace))
+        self.get_namespace_registry().delete_one({'_id': namespace})
+        if self._previous_coll is not None and self._previous_coll.name == self.get_collection_name(namespace):
+            self._previous_coll = None
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def get_lock_collection(self):
+        """
+        Collection next to the cache one holding the documents of chembl_core_db.cache.locks.MongoLock.
+        """
+        if self._lock_coll is None:
+            lock_coll = self._get_collection().database[self._collection + '_locks']
             try:
-                self._db.authenticate(self._user, self._password, source=self._auth_db)
-            except Exception as ex1:
-                traceback.print_exc()
-                self.log.error(
-                    'It is not possible to authenticate user {0} in auth db {1}'.format(self._user, self._auth_db)
-                )
-                raise ex1
+                if EXPIRES_INDEX_NAME not in lock_coll.index_information():
+                    lock_coll.create_index([('expires_at', pymongo.ASCENDING)], name=EXPIRES_INDEX_NAME,
+                                           expireAfterSeconds=0)
+            except pymongo.errors.PyMongoError:
+                self.log.error('Could not create the expiry index of the lock collection', exc_info=True)
+            self._lock_coll = lock_coll
+        return self._lock_coll
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _initialize_collection(self):
+        # the collection is initialized again after clear() and namespace changes, the client is reused
+        if getattr(self, 'connection', None) is None:
+            self._connect()
+        collection_name = self.get_collection_name()
         if pymongo.version_tuple[0] < 3:
-            self._coll = self._db[self._collection]
+            self._coll = self._db[collection_name]
         else:
-            self._coll = self._db.get_collection(self._collection)
+            self._coll = self._db.get_collection(collection_name)
             if not self._coll:
                 if self._compression:
-                    self._coll = self._db.create_collection(self._collection,
+                    self._coll = self._db.create_collection(collection_name,
                                                             storageEngine={'wiredTiger':
                                                                             {'configString': 'block_compressor=none'}})
                 else:
-                    self._coll = self._db.create_collection(self._collection)
+                    self._coll = self._db.create_collection(collection_name)
 
         # create indexes if they do not exist
         if isinstance(self._collection_indexes, list) and len(self._collection_indexes):
@@ -236,6 +613,56 @@ class MongoDBCache(BaseCache):
                 index_name = index_desc['NAME']
                 index_description = index_desc['INDEX_DESCRIPTION']
                 if index_name not in indexes_info:
-                    self._coll.create_index(index_description)
+                    self._coll.create_index(index_description, name=index_name)
+
+        self._ensure_expiry_index()
+        if self._namespace:
+            self._register_namespace()
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _connect(self):
+        self.connection = pymongo.MongoClient(connect=False, host=self._host, replicaset=self._rsname,
+            sockettimeoutms=self._socket_timeout_ms, connecttimeoutms=self._connect_timeout_ms,
+            serverSelectionTimeoutMS=self._server_selection_timeout_ms, read_preference=self._read_preference)
+
+        self._db = self.connection[self._database]
+        if self._user and self._password:
+            try:
+                self._db.authenticate(self._user, self._password, source=self._auth_db)
+            except Exception as ex1:
+                traceback.print_exc()
+                self.log.error(
+                    'It is not possible to authenticate user {0} in auth db {1}'.format(self._user, self._auth_db)
+                )
+                raise ex1
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _register_namespace(self):
+        registry = self._db[self._collection + '_namespaces']
+        registry.update_one({'_id': self._namespace},
+                            {'$setOnInsert': {'created': datetime.datetime.utcnow(),
+                                              'collection': self.get_collection_name()}}, upsert=True)
+        if not self._namespace_fallback:
+            return
+        created = registry.find_one({'_id': self._namespace})['created']
+        self._fallback_until = created + datetime.timedelta(seconds=self._namespace_fallback_window)
+        if self._fallback_until <= datetime.datetime.utcnow():
+            return
+        previous = list(registry.find({'_id': {'$ne': self._namespace}, 'created': {'$lte': created}})
+                        .sort('created', pymongo.DESCENDING).limit(1))
+        self._previous_coll = self._db[previous[0]['collection']] if previous else None
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _ensure_expiry_index(self):
+        try:
+            if EXPIRES_INDEX_NAME not in self._coll.index_information():
+                self._coll.create_index([('expires_at', pymongo.ASCENDING)], name=EXPIRES_INDEX_NAME,
+                                        expireAfterSeconds=0)
+        except pymongo.errors.PyMongoError:
+            self.log.error('Could not create the expiry index of cache collection {0}'.format(self._coll.name),
+                           exc_info=True)
 
 # ----------------------------------------------------------------------------------------------------------------------
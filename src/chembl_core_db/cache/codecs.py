@@ -0,0 +1,104 @@
+__author__ = 'mnowotka'
+
+import zlib
+from django.core.exceptions import ImproperlyConfigured
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+# Name stored in the 'codec' field of cache documents written as raw BSON Binary. Documents without that field were
+# written by the legacy encoder (base64 encoded zlib when COMPRESSION is on, plain pickle otherwise).
+NO_COMPRESSION = 'none'
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class ZlibCodec(object):
+    name = 'zlib'
+
+    def __init__(self, level=None):
+        self.level = 6 if level is None else level
+
+    def compress(self, payload):
+        return zlib.compress(payload, self.level)
+
+    def decompress(self, data):
+        return zlib.decompress(data)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class Lz4Codec(object):
+    name = 'lz4'
+
+    def __init__(self, level=None):
+        if lz4_frame is None:
+            raise ImproperlyConfigured('The lz4 cache codec requires the lz4 package.')
+        self.level = 0 if level is None else level
+
+    def compress(self, payload):
+        return lz4_frame.compress(payload, compression_level=self.level)
+
+    def decompress(self, data):
+        return lz4_frame.decompress(data)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class ZstdCodec(object):
+    name = 'zstd'
+
+    def __init__(self, level=None):
+        if zstandard is None:
+            raise ImproperlyConfigured('The zstd cache codec requires the zstandard package.')
+        self.level = 3 if level is None else level
+
+    def compress(self, payload):
+        # compressor objects are not thread safe, they are cheap to create
+        return zstandard.ZstdCompressor(level=self.level).compress(payload)
+
+    def decompress(self, data):
+        return zstandard.ZstdDecompressor().decompress(data)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class NoCompressionCodec(object):
+    name = NO_COMPRESSION
+
+    def __init__(self, level=None):
+        pass
+
+    def compress(self, payload):
+        return payload
+
+    def decompress(self, data):
+        return data
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+CODECS = {
+    ZlibCodec.name: ZlibCodec,
+    Lz4Codec.name: Lz4Codec,
+    ZstdCodec.name: ZstdCodec,
+    NoCompressionCodec.name: NoCompressionCodec,
+}
+
+
+def get_codec(name, level=None):
+    try:
+        return CODECS[name](level)
+    except KeyError:
+        raise ImproperlyConfigured('Unknown cache codec {0}, available codecs are: {1}.'
+                                   .format(name, ', '.join(sorted(CODECS.keys()))))
+
+# ----------------------------------------------------------------------------------------------------------------------
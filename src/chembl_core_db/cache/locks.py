@@ -0,0 +1,115 @@
+__author__ = 'mnowotka'
+
+import os
+import uuid
+import fcntl
+import hashlib
+import datetime
+import tempfile
+import pymongo
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def lock_name(key):
+    return hashlib.md5(str(key).encode('utf-8')).hexdigest()
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class FileLock(object):
+    """
+    Non blocking ``flock`` based lock, shared by all processes on the same host. Locks held by a dead process are
+    released by the kernel.
+    """
+
+    def __init__(self, backend=None, params=None):
+        params = params or {}
+        self.directory = params.get('DIRECTORY', os.path.join(tempfile.gettempdir(), 'chembl_ws_locks'))
+        os.makedirs(self.directory, exist_ok=True)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _path(self, key):
+        return os.path.join(self.directory, lock_name(key) + '.lock')
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def acquire(self, key, timeout=None):
+        """
+        Returns a token to be passed to ``release`` or None if the lock is held by someone else.
+        """
+        path = self._path(key)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return None
+        try:
+            # the previous holder may have unlinked the file between our open and flock calls
+            if os.fstat(fd).st_ino != os.stat(path).st_ino:
+                os.close(fd)
+                return None
+        except FileNotFoundError:
+            os.close(fd)
+            return None
+        return path, fd
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def release(self, key, token):
+        path, fd = token
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def locked(self, key):
+        # lock files are removed on release
+        return os.path.exists(self._path(key))
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class MongoLock(object):
+    """
+    Lock stored as a document of the lock collection of a ``MongoDBCache``, so it is shared by all the hosts using
+    the same cache. Locks not released after ``timeout`` seconds, because their holder died, can be taken over.
+    """
+
+    def __init__(self, backend, params=None):
+        self.backend = backend
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def acquire(self, key, timeout=60):
+        coll = self.backend.get_lock_collection()
+        now = datetime.datetime.utcnow()
+        token = uuid.uuid4().hex
+        document = {'_id': lock_name(key), 'token': token, 'expires_at': now + datetime.timedelta(seconds=timeout)}
+        try:
+            coll.insert_one(document)
+            return token
+        except pymongo.errors.DuplicateKeyError:
+            pass
+        # take over an expired lock the TTL monitor did not remove yet
+        result = coll.replace_one({'_id': document['_id'], 'expires_at': {'$lt': now}}, document)
+        return token if result.modified_count else None
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def release(self, key, token):
+        self.backend.get_lock_collection().delete_one({'_id': lock_name(key), 'token': token})
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def locked(self, key):
+        document = self.backend.get_lock_collection().find_one({'_id': lock_name(key)})
+        return document is not None and document['expires_at'] > datetime.datetime.utcnow()
+
+# ----------------------------------------------------------------------------------------------------------------------
@@ -0,0 +1,138 @@
+__author__ = 'mnowotka'
+
+import time
+import threading
+from collections import OrderedDict
+from collections import defaultdict
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class CacheStats(object):
+    """
+    Thread safe hit/miss counters grouped by resource name.
+    """
+
+    COUNTERS = ('hits', 'misses', 'sets', 'evictions')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(lambda: dict.fromkeys(self.COUNTERS, 0))
+
+    def incr(self, resource_name, counter, value=1):
+        with self._lock:
+            self._counters[resource_name or 'unknown'][counter] += value
+
+    def hit(self, resource_name):
+        self.incr(resource_name, 'hits')
+
+    def miss(self, resource_name):
+        self.incr(resource_name, 'misses')
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+
+    def as_dict(self):
+        with self._lock:
+            ret = {}
+            for resource_name, counters in self._counters.items():
+                counters = dict(counters)
+                lookups = counters['hits'] + counters['misses']
+                counters['hit_rate'] = round(float(counters['hits']) / lookups, 4) if lookups else None
+                ret[resource_name] = counters
+            return ret
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class LRUCache(object):
+    """
+    In-process least recently used cache. Values are returned as they were stored, callers storing mutable objects
+    should store a serialized form of them.
+
+    Entries are evicted when the sum of their sizes exceeds ``MAX_BYTES`` or when they are older than ``TIMEOUT``
+    seconds. Sizes are provided by the caller, usually as the length of the pickled payload.
+    """
+
+    def __init__(self, params=None):
+        params = params or {}
+        self.max_bytes = int(params.get('MAX_BYTES', 64 * 1024 * 1024))
+        self.max_item_bytes = int(params.get('MAX_ITEM_BYTES', self.max_bytes // 8))
+        self.timeout = params.get('TIMEOUT', 300)
+        self.stats = CacheStats()
+        self._lock = threading.RLock()
+        self._entries = OrderedDict()
+        self._current_bytes = 0
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def get(self, key, resource_name=None):
+        """
+        Returns a tuple ``(found, value)``, so ``None`` values can be cached too.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, size, expires_at, _ = entry
+                if expires_at is None or expires_at > time.time():
+                    self._entries.move_to_end(key)
+                    self.stats.hit(resource_name)
+                    return True, value
+                self._remove(key)
+            self.stats.miss(resource_name)
+            return False, None
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def set(self, key, value, size, resource_name=None, timeout=None):
+        if size > self.max_item_bytes:
+            self.delete(key)
+            return False
+        if timeout is None or (self.timeout and self.timeout < timeout):
+            timeout = self.timeout
+        expires_at = time.time() + timeout if timeout else None
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, expires_at, resource_name)
+            self._current_bytes += size
+            self.stats.incr(resource_name, 'sets')
+            while self._current_bytes > self.max_bytes and self._entries:
+                _, (_, evicted_size, _, evicted_resource) = self._entries.popitem(last=False)
+                self._current_bytes -= evicted_size
+                self.stats.incr(evicted_resource, 'evictions')
+            return True
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def delete(self, key):
+        with self._lock:
+            self._remove(key)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._current_bytes = 0
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def info(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._current_bytes,
+                'max_bytes': self.max_bytes,
+                'resources': self.stats.as_dict(),
+            }
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._current_bytes -= entry[1]
+
+# ----------------------------------------------------------------------------------------------------------------------
@@ -5,7 +5,25 @@ when you run "manage.py test".
 Replace this with more appropriate tests for your application.
 """
 
+import os
+import datetime
+import shutil
+import tempfile
+import unittest
+from unittest import mock
 from django.test import TestCase
+from django.test import SimpleTestCase
+from django.core.exceptions import ImproperlyConfigured
+from chembl_core_db.cache.lru import LRUCache
+from chembl_core_db.cache.codecs import CODECS
+from chembl_core_db.cache.locks import FileLock
+from chembl_core_db.cache.locks import MongoLock
+from chembl_core_db.cache.backends import MongoDBCache as mongodb_cache
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
 
 
 class SimpleTest(TestCase):
@@ -14,3 +32,355 @@ class SimpleTest(TestCase):
         Tests that 1 + 1 always equals 2.
         """
         self.assertEqual(1 + 1, 2)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class LRUCacheTestCase(SimpleTestCase):
+
+    def test_eviction(self):
+        lru = LRUCache({'MAX_BYTES': 30, 'MAX_ITEM_BYTES': 20})
+        lru.set('a', 'A', 10, 'molecule')
+        lru.set('b', 'B', 10, 'molecule')
+        # a is now the most recently used entry
+        self.assertEqual(lru.get('a', 'molecule'), (True, 'A'))
+        lru.set('c', 'C', 15, 'target')
+        self.assertEqual(lru.get('b'), (False, None))
+        self.assertEqual(lru.get('a'), (True, 'A'))
+        self.assertEqual(lru.get('c'), (True, 'C'))
+        self.assertEqual(lru.info()['bytes'], 25)
+        self.assertEqual(lru.info()['resources']['molecule']['evictions'], 1)
+        # entries bigger than MAX_ITEM_BYTES are not stored, and replace older values
+        self.assertFalse(lru.set('a', 'AA', 21))
+        self.assertEqual(lru.get('a'), (False, None))
+
+    def test_expiry(self):
+        lru = LRUCache({'TIMEOUT': 60})
+        with mock.patch('chembl_core_db.cache.lru.time.time', return_value=1000):
+            lru.set('a', 'A', 1)
+            lru.set('b', 'B', 1, timeout=10)
+            # the TIMEOUT of the cache caps longer timeouts
+            lru.set('c', 'C', 1, timeout=3600)
+        with mock.patch('chembl_core_db.cache.lru.time.time', return_value=1011):
+            self.assertEqual(lru.get('a'), (True, 'A'))
+            self.assertEqual(lru.get('b'), (False, None))
+        with mock.patch('chembl_core_db.cache.lru.time.time', return_value=1061):
+            self.assertEqual(lru.get('a'), (False, None))
+            self.assertEqual(lru.get('c'), (False, None))
+        self.assertEqual(lru.info()['entries'], 0)
+
+    def test_stats(self):
+        lru = LRUCache()
+        lru.set('a', 'A', 1, 'molecule')
+        lru.get('a', 'molecule')
+        lru.get('b', 'molecule')
+        stats = lru.info()['resources']['molecule']
+        self.assertEqual((stats['hits'], stats['misses'], stats['sets']), (1, 1, 1))
+        self.assertEqual(stats['hit_rate'], 0.5)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class MongomockTestCase(SimpleTestCase):
+
+    def setUp(self):
+        # every cache of a test shares the same server
+        self.client = mongomock.MongoClient()
+        patcher = mock.patch.object(mongodb_cache.pymongo, 'MongoClient', return_value=self.client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @staticmethod
+    def get_cache(**options):
+        return mongodb_cache.MongoDBCache('test_cache', {'OPTIONS': options})
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+@unittest.skipIf(mongomock is None, 'the MongoDBCache tests require mongomock')
+class MongoDBCacheTestCase(MongomockTestCase):
+
+    def test_l1_hits(self):
+        cache = self.get_cache(L1={'MAX_BYTES': 1024 * 1024})
+        cache.set('chembl:molecule:CHEMBL25', {'molecule_chembl_id': 'CHEMBL25'})
+        cache._get_collection().delete_many({})
+        # served from the L1 cache
+        self.assertEqual(cache.get('chembl:molecule:CHEMBL25'), {'molecule_chembl_id': 'CHEMBL25'})
+        self.assertEqual(cache.get_many(['chembl:molecule:CHEMBL25']),
+                         {'chembl:molecule:CHEMBL25': {'molecule_chembl_id': 'CHEMBL25'}})
+        self.assertEqual(cache.l1_info()['resources']['molecule']['hits'], 2)
+        cache.delete('chembl:molecule:CHEMBL25')
+        self.assertIsNone(cache.get('chembl:molecule:CHEMBL25'))
+
+    def test_l1_returns_copies(self):
+        cache = self.get_cache(L1={'MAX_BYTES': 1024 * 1024})
+        value = {'molecule_synonyms': ['aspirin']}
+        cache.set('chembl:molecule:CHEMBL25', value)
+        value['molecule_synonyms'].append('set')
+        for i in range(2):
+            cache.get('chembl:molecule:CHEMBL25')['molecule_synonyms'].append('get')
+            cache.get_many(['chembl:molecule:CHEMBL25'])['chembl:molecule:CHEMBL25']['molecule_synonyms']\
+                .append('get_many')
+            self.assertEqual(cache.get('chembl:molecule:CHEMBL25'), {'molecule_synonyms': ['aspirin']})
+            # the second time around the value is put in the L1 cache by a read
+            cache._l1.clear()
+
+    def test_codecs(self):
+        value = {'molecule_chembl_id': 'CHEMBL25', 'canonical_smiles': 'CC(=O)Oc1ccccc1C(=O)O' * 100}
+        for codec in sorted(CODECS.keys()):
+            try:
+                cache = self.get_cache(CODEC=codec)
+            except ImproperlyConfigured:
+                continue
+            cache.set('chembl:molecule:CHEMBL25', value)
+            document = cache._get_collection().find_one({'_id': cache.make_key('chembl:molecule:CHEMBL25')})
+            self.assertEqual(document['codec'], codec)
+            self.assertIsInstance(document['data'], bytes)
+            self.assertEqual(cache.get('chembl:molecule:CHEMBL25'), value)
+            # documents written with any codec can be read whatever the configured one is
+            self.assertEqual(self.get_cache(CODEC='zlib').get('chembl:molecule:CHEMBL25'), value)
+
+    def test_legacy_payloads(self):
+        value = {'molecule_chembl_id': 'CHEMBL25', 'pref_name': 'ASPIRIN'}
+        for compression in (True, False):
+            legacy = self.get_cache(BINARY=False, COMPRESSION=compression)
+            legacy.set('chembl:molecule:CHEMBL25', value)
+            document = legacy._get_collection().find_one({'_id': legacy.make_key('chembl:molecule:CHEMBL25')})
+            self.assertNotIn('codec', document)
+            self.assertEqual(self.get_cache(COMPRESSION=compression).get('chembl:molecule:CHEMBL25'), value)
+        legacy.set('chembl:molecule:CHEMBL25', value)
+        self.assertEqual(legacy.get('chembl:molecule:CHEMBL25'), value)
+        self.assertEqual(legacy.get_many(['chembl:molecule:CHEMBL25']), {'chembl:molecule:CHEMBL25': value})
+
+    def test_add_and_set(self):
+        cache = self.get_cache()
+        self.assertTrue(cache.add('chembl:molecule:CHEMBL25', 1))
+        self.assertFalse(cache.add('chembl:molecule:CHEMBL25', 2))
+        self.assertEqual(cache.get('chembl:molecule:CHEMBL25'), 1)
+        cache.set('chembl:molecule:CHEMBL25', 3)
+        self.assertEqual(cache.get('chembl:molecule:CHEMBL25'), 3)
+        self.assertFalse(cache.add('chembl:molecule:CHEMBL25', 4, timeout=None))
+        cache.set('chembl:molecule:CHEMBL25', 5, timeout=None)
+        self.assertFalse(cache.add('chembl:molecule:CHEMBL25', 6))
+        self.assertEqual(cache.get('chembl:molecule:CHEMBL25'), 5)
+
+    def test_expiry(self):
+        cache = self.get_cache()
+        cache.set('chembl:molecule:CHEMBL25', 1, timeout=60)
+        coll = cache._get_collection()
+        self.assertIn(mongodb_cache.EXPIRES_INDEX_NAME, coll.index_information())
+        # expired but not removed by the TTL monitor yet, mongomock applies TTL indexes when documents are read
+        coll.drop_index(mongodb_cache.EXPIRES_INDEX_NAME)
+        coll.update_one({'_id': cache.make_key('chembl:molecule:CHEMBL25')},
+                        {'$set': {'expires_at': datetime.datetime.utcnow() - datetime.timedelta(seconds=1)}})
+        self.assertIsNone(cache.get('chembl:molecule:CHEMBL25'))
+        self.assertEqual(cache.get_many(['chembl:molecule:CHEMBL25']), {})
+        self.assertFalse(cache.has_key('chembl:molecule:CHEMBL25'))
+        self.assertTrue(cache.add('chembl:molecule:CHEMBL25', 2, timeout=60))
+        self.assertEqual(cache.get('chembl:molecule:CHEMBL25'), 2)
+
+    @mock.patch.object(mongodb_cache, 'MAX_SIZE', 100)
+    def test_add_chunked(self):
+        cache = self.get_cache(CODEC='none')
+        self.assertTrue(cache.add('chembl:molecule:big', os.urandom(1000)))
+        self.assertFalse(cache.add('chembl:molecule:big', os.urandom(1000)))
+        # the chunks of the value that was not added are removed
+        self.assertEqual(cache._get_collection().count_documents({}), 12)
+
+    def test_set_many_errors(self):
+        cache = self.get_cache()
+        with mock.patch.object(cache._get_collection(), 'bulk_write',
+                               side_effect=mongodb_cache.pymongo.errors.AutoReconnect()):
+            with self.assertLogs(mongodb_cache.__name__, 'ERROR'):
+                self.assertEqual(sorted(cache.set_many({'a': 1, 'b': 2})), ['a', 'b'])
+        self.assertEqual(cache.set_many({'a': 1, 'b': 2}), [])
+        self.assertEqual(cache.get_many(['a', 'b']), {'a': 1, 'b': 2})
+
+    def test_cull(self):
+        cache = self.get_cache(MAX_ENTRIES=10, CULL_FREQUENCY=2, CULL_BATCH_SIZE=3)
+        for i in range(20):
+            cache.set('key{0}'.format(i), i, timeout=60 + i)
+        self.assertEqual(cache.cull(max_documents=4), 4)
+        self.assertEqual(cache.get_many(['key{0}'.format(i) for i in range(5)]), {'key4': 4})
+        # 1/CULL_FREQUENCY of the entries
+        self.assertEqual(cache.cull(), 8)
+        self.assertEqual(len(cache.get_many(['key{0}'.format(i) for i in range(20)])), 8)
+        self.assertEqual(cache.cull(), 0)
+
+    @mock.patch.object(mongodb_cache, 'MAX_SIZE', 100)
+    def test_cull_chunks(self):
+        cache = self.get_cache(CODEC='none', MAX_ENTRIES=1, CULL_FREQUENCY=2)
+        cache.set('big', os.urandom(1000), timeout=60)
+        cache.set('small', 1, timeout=120)
+        # chunks count as entries but are deleted with the entry they belong to
+        self.assertEqual(cache.cull(max_documents=1), 12)
+        self.assertEqual(cache._get_collection().count_documents({}), 1)
+        self.assertEqual(cache.get('small'), 1)
+
+    def test_namespace(self):
+        namespace_function = mock.Mock(return_value='chembl_27')
+        cache = self.get_cache(NAMESPACE_FUNCTION=namespace_function)
+        cache.set('chembl:molecule:CHEMBL25', 27)
+        for i in range(3):
+            self.assertEqual(cache.get('chembl:molecule:CHEMBL25'), 27)
+        self.assertEqual(namespace_function.call_count, 1)
+        self.assertEqual(cache._get_collection().name, 'test_cache_chembl_27')
+        self.assertEqual([namespace['_id'] for namespace in cache.namespaces()], ['chembl_27'])
+
+    def test_namespace_errors(self):
+        namespace_function = mock.Mock(side_effect=[Exception('no database'), 'chembl_27'])
+        cache = self.get_cache(NAMESPACE_FUNCTION=namespace_function, NAMESPACE_CHECK_INTERVAL=60)
+        with self.assertLogs(mongodb_cache.__name__, 'ERROR'):
+            self.assertIsNone(cache.get('chembl:molecule:CHEMBL25'))
+        self.assertIsNone(cache.get('chembl:molecule:CHEMBL25'))
+        self.assertEqual(namespace_function.call_count, 1)
+        # retried once NAMESPACE_CHECK_INTERVAL is over
+        cache._namespace_checked -= 61
+        self.assertEqual(cache.current_namespace(), 'chembl_27')
+        self.assertEqual(namespace_function.call_count, 2)
+
+    def test_namespace_fallback(self):
+        old = self.get_cache(NAMESPACE_FUNCTION=lambda: 'chembl_27')
+        old.set_many({'chembl:molecule:CHEMBL25': 27, 'chembl:molecule:CHEMBL1': 27})
+        registry = old.get_namespace_registry()
+        registry.update_one({'_id': 'chembl_27'},
+                            {'$set': {'created': datetime.datetime.utcnow() - datetime.timedelta(days=100)}})
+        cache = self.get_cache(NAMESPACE_FUNCTION=lambda: 'chembl_28', NAMESPACE_FALLBACK_WINDOW=3600)
+        cache.set('chembl:molecule:CHEMBL1', 28)
+        self.assertEqual(cache.get('chembl:molecule:CHEMBL25'), 27)
+        self.assertEqual(cache.get_many(['chembl:molecule:CHEMBL25', 'chembl:molecule:CHEMBL1']),
+                         {'chembl:molecule:CHEMBL25': 27, 'chembl:molecule:CHEMBL1': 28})
+        # the previous namespace is not used once the window is over
+        with mock.patch.object(cache, '_fallback_until', datetime.datetime.utcnow()):
+            self.assertIsNone(cache.get('chembl:molecule:CHEMBL25'))
+        self.assertIsNone(cache._previous_coll)
+        registry.update_one({'_id': 'chembl_28'},
+                            {'$set': {'created': datetime.datetime.utcnow() - datetime.timedelta(hours=2)}})
+        self.assertIsNone(self.get_cache(NAMESPACE_FUNCTION=lambda: 'chembl_28', NAMESPACE_FALLBACK_WINDOW=3600)
+                          .get('chembl:molecule:CHEMBL25'))
+        # a newer namespace is never used
+        cache.set('chembl:molecule:CHEMBL2', 28)
+        self.assertIsNone(self.get_cache(NAMESPACE_FUNCTION=lambda: 'chembl_27', NAMESPACE_FALLBACK_WINDOW=1000 * 86400)
+                          .get('chembl:molecule:CHEMBL2'))
+        self.assertIsNone(self.get_cache(NAMESPACE_FUNCTION=lambda: 'chembl_28', NAMESPACE_FALLBACK=False)
+                          .get('chembl:molecule:CHEMBL25'))
+
+    def test_drop_namespace(self):
+        old = self.get_cache(NAMESPACE_FUNCTION=lambda: 'chembl_27')
+        old.set('chembl:molecule:CHEMBL25', 27)
+        cache = self.get_cache(NAMESPACE_FUNCTION=lambda: 'chembl_28')
+        self.assertEqual(cache.get('chembl:molecule:CHEMBL25'), 27)
+        cache.drop_namespace('chembl_27')
+        self.assertIsNone(cache.get('chembl:molecule:CHEMBL25'))
+        self.assertEqual([namespace['_id'] for namespace in cache.namespaces()], ['chembl_28'])
+        self.assertNotIn('test_cache_chembl_27', self.client['django_cache'].list_collection_names())
+
+    @mock.patch.object(mongodb_cache, 'MAX_SIZE', 100)
+    def test_chunks(self):
+        cache = self.get_cache(CODEC='none')
+        big = os.urandom(1000)
+        cache.set('chembl:molecule:big', big)
+        cache.set_many({'chembl:molecule:big_many': big + b'1', 'chembl:molecule:small': b'1'})
+        coll = cache._get_collection()
+        document = coll.find_one({'_id': cache.make_key('chembl:molecule:big')})
+        self.assertNotIn('data', document)
+        self.assertEqual(len(document['chunks']), 11)
+        self.assertEqual(coll.count_documents({'chunk_of': cache.make_key('chembl:molecule:big')}), 11)
+        self.assertEqual(cache.get('chembl:molecule:big'), big)
+        self.assertEqual(cache.get_many(['chembl:molecule:big', 'chembl:molecule:big_many', 'chembl:molecule:small',
+                                         'chembl:molecule:missing']),
+                         {'chembl:molecule:big': big, 'chembl:molecule:big_many': big + b'1',
+                          'chembl:molecule:small': b'1'})
+        # a new value gets new chunks
+        cache.set('chembl:molecule:big', big[::-1])
+        self.assertEqual(cache.get('chembl:molecule:big'), big[::-1])
+        # an entry missing any of its chunks is a miss
+        coll.delete_one({'_id': coll.find_one({'_id': cache.make_key('chembl:molecule:big')})['chunks'][3]})
+        with self.assertLogs(mongodb_cache.__name__, 'WARNING'):
+            self.assertIsNone(cache.get('chembl:molecule:big'))
+            self.assertEqual(cache.get_many(['chembl:molecule:big', 'chembl:molecule:small']),
+                             {'chembl:molecule:small': b'1'})
+        cache.delete('chembl:molecule:big_many')
+        self.assertEqual(coll.count_documents({'chunk_of': cache.make_key('chembl:molecule:big_many')}), 0)
+
+    @mock.patch.object(mongodb_cache, 'MAX_SIZE', 100)
+    def test_fetch_chunks(self):
+        cache = self.get_cache()
+        coll = cache._get_collection()
+        for size in (100, 101, 250):
+            payload = os.urandom(size)
+            document = cache._prepare_document(coll, 'key{0}'.format(size), {}, payload, 60)
+            document['_id'] = 'key{0}'.format(size)
+            self.assertEqual(len(document['chunks']), (len(cache._encode_payload(payload)[0]) + 99) // 100)
+            raw = cache._fetch_chunks(coll, [document])[document['_id']]
+            self.assertEqual(cache._decompress(raw, document['codec']), payload)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class FileLockTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.lock = FileLock(params={'DIRECTORY': self.directory})
+
+    def test_acquire_and_release(self):
+        token = self.lock.acquire('lock:page')
+        self.assertIsNotNone(token)
+        self.assertTrue(self.lock.locked('lock:page'))
+        self.assertIsNone(self.lock.acquire('lock:page'))
+        self.assertIsNotNone(self.lock.acquire('lock:other_page'))
+        self.lock.release('lock:page', token)
+        self.assertFalse(self.lock.locked('lock:page'))
+        self.lock.release('lock:page', self.lock.acquire('lock:page'))
+
+    def test_takeover(self):
+        path, fd = self.lock.acquire('lock:page')
+        # the kernel releases the flock of a process that dies, leaving its lock file behind
+        os.close(fd)
+        token = self.lock.acquire('lock:page')
+        self.assertIsNotNone(token)
+        self.assertIsNone(self.lock.acquire('lock:page'))
+        self.lock.release('lock:page', token)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+@unittest.skipIf(mongomock is None, 'the MongoLock tests require mongomock')
+class MongoLockTestCase(MongomockTestCase):
+
+    def setUp(self):
+        super(MongoLockTestCase, self).setUp()
+        self.lock = MongoLock(self.get_cache())
+
+    def test_acquire_and_release(self):
+        token = self.lock.acquire('lock:page', timeout=60)
+        self.assertIsNotNone(token)
+        self.assertTrue(self.lock.locked('lock:page'))
+        self.assertIsNone(self.lock.acquire('lock:page', timeout=60))
+        # only the holder releases the lock
+        self.lock.release('lock:page', 'not the token')
+        self.assertTrue(self.lock.locked('lock:page'))
+        self.lock.release('lock:page', token)
+        self.assertFalse(self.lock.locked('lock:page'))
+        self.assertIsNotNone(self.lock.acquire('lock:page', timeout=60))
+
+    def test_takeover(self):
+        coll = self.lock.backend.get_lock_collection()
+        self.assertIn(mongodb_cache.EXPIRES_INDEX_NAME, coll.index_information())
+        # expired but not removed by the TTL monitor yet, mongomock applies TTL indexes when documents are read
+        coll.drop_index(mongodb_cache.EXPIRES_INDEX_NAME)
+        token = self.lock.acquire('lock:page', timeout=60)
+        coll.update_one({'token': token},
+                        {'$set': {'expires_at': datetime.datetime.utcnow() - datetime.timedelta(seconds=1)}})
+        self.assertFalse(self.lock.locked('lock:page'))
+        new_token = self.lock.acquire('lock:page', timeout=60)
+        self.assertIsNotNone(new_token)
+        # the release of the previous holder is ignored
+        self.lock.release('lock:page', token)
+        self.assertTrue(self.lock.locked('lock:page'))
+        self.lock.release('lock:page', new_token)
+        self.assertFalse(self.lock.locked('lock:page'))
+
+# ----------------------------------------------------------------------------------------------------------------------
@@ -0,0 +1,273 @@
+__author__ = 'mnowotka'
+
+import os
+import re
+import time
+import queue
+import logging
+import threading
+from django.db import connections
+from django.utils.module_loading import import_string
+from tastypie.cache import SimpleCache
+from chembl_core_model.models import Version
+from chembl_core_db.cache.lru import CacheStats
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def chembl_release_namespace():
+    """
+    NAMESPACE_FUNCTION of the MongoDBCache, every ChEMBL release is cached in its own collection.
+    """
+    return re.sub(r'\W', '_', Version.objects.all()[0].name).lower()
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class ChemblCache(SimpleCache):
+    """
+    ``SimpleCache`` with batched ``get_many``/``set_many`` and an optional write-behind thread, so responses are not
+    delayed by cache writes. Values are serialized by the request thread, the objects still used to build the
+    response are never read by the write-behind thread, which only writes bytes. When the write-behind queue is full,
+    or the cache backend can not write serialized values, values are written synchronously.
+
+    ``single_flight`` configures the lock used to coalesce concurrent computations of the same missing value:
+    ``CLASS`` (a lock from chembl_core_db.cache.locks), ``TIMEOUT`` (lock lifetime in seconds), ``WAIT`` (maximum
+    seconds a follower waits for the leader) and ``POLL_INTERVAL``.
+
+    Stale-while-revalidate: values are stamped with the ChEMBL release they were computed from and, when
+    ``soft_timeout`` is set, a soft expiry date. Stale values are still served while ``refresh`` recomputes them in
+    a background thread, so a new release replaces the cached data gradually instead of starting from a cold cache.
+    """
+
+    def __init__(self, cache_name='default', timeout=None, public=None, private=None, write_behind=False,
+                 write_behind_queue_size=1000, single_flight=None, soft_timeout=None, max_refresh_threads=2,
+                 version_check_interval=60, *args, **kwargs):
+        super(ChemblCache, self).__init__(cache_name, timeout, public, private, *args, **kwargs)
+        self.write_behind = write_behind
+        self.write_behind_queue_size = write_behind_queue_size
+        self.single_flight = single_flight or {}
+        self.soft_timeout = soft_timeout
+        self.version_check_interval = version_check_interval
+        self._lock = None
+        self._refresh_slots = threading.BoundedSemaphore(max_refresh_threads)
+        self._version = None
+        self._version_checked = 0
+        # per worker hit rate of the detail and list handlers
+        self.stats = CacheStats()
+        self.log = logging.getLogger(__name__)
+        self._queue = None
+        self._queue_pid = None
+        self._queue_lock = threading.Lock()
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def get_many(self, keys):
+        """
+        Returns a dictionary with the values found in the cache, missing keys are left out.
+        """
+        return self.cache.get_many(keys)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def set_many(self, data, timeout=None, write_behind=None, lock=None):
+        """
+        ``lock`` is an optional ``(key, token)`` pair returned by ``lock``, released once the values are written, or
+        straight away if they can not be written.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        if write_behind is None:
+            write_behind = self.write_behind
+        queued = False
+        try:
+            if write_behind and data and hasattr(self.cache, 'set_many_serialized'):
+                try:
+                    serialized = dict((key, self.cache.serialize(value)) for key, value in data.items())
+                    self._get_queue().put_nowait((serialized, timeout, lock))
+                    # the write behind thread releases the lock
+                    queued = True
+                    return
+                except queue.Full:
+                    self.log.warning('Cache write behind queue is full, writing synchronously')
+            if data:
+                self.cache.set_many(data, timeout)
+        finally:
+            if lock and not queued:
+                self.unlock(*lock)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def record(self, resource_name, hit):
+        if hit:
+            self.stats.hit(resource_name)
+        else:
+            self.stats.miss(resource_name)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def flush(self):
+        """
+        Waits until the values queued for write behind are written.
+        """
+        if self._queue is not None and self._queue_pid == os.getpid():
+            self._queue.join()
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def lock(self, key):
+        """
+        Returns a token if the caller should compute the value of ``key`` and release it afterwards with ``unlock``,
+        None if another worker is already computing it. Without single flight, or if the lock backend fails,
+        every caller computes the value.
+        """
+        if not self.single_flight:
+            return True
+        try:
+            if self._lock is None:
+                lock_class = import_string(self.single_flight.get('CLASS', 'chembl_core_db.cache.locks.FileLock'))
+                self._lock = lock_class(self.cache, self.single_flight)
+            return self._lock.acquire(key, self.single_flight.get('TIMEOUT', 60))
+        except Exception:
+            self.log.error('Cache lock exception', exc_info=True, extra={'key': key})
+            return True
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def unlock(self, key, token):
+        if self._lock is None or token is True:
+            return
+        try:
+            self._lock.release(key, token)
+        except Exception:
+            self.log.error('Cache unlock exception', exc_info=True, extra={'key': key})
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def wait_many(self, keys, lock_key):
+        """
+        Polls the cache until all ``keys`` are set, the leader releases ``lock_key`` or the waiting time is over.
+        Returns the values found.
+        """
+        deadline = time.time() + self.single_flight.get('WAIT', 30)
+        interval = self.single_flight.get('POLL_INTERVAL', 0.1)
+        found = {}
+        while time.time() < deadline:
+            time.sleep(interval)
+            try:
+                leader_done = not self._lock.locked(lock_key)
+                found = self.get_many(keys)
+            except Exception:
+                self.log.error('Cache wait exception', exc_info=True, extra={'key': lock_key})
+                break
+            if len(found) == len(keys) or leader_done:
+                break
+        return found
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def chembl_db_version(self):
+        """
+        Name of the ChEMBL release currently served, checked at most every ``version_check_interval`` seconds.
+        """
+        if time.time() - self._version_checked > self.version_check_interval:
+            try:
+                self._version = Version.objects.all()[0].name
+            except Exception:
+                self.log.error('Could not read the ChEMBL version', exc_info=True)
+            self._version_checked = time.time()
+        return self._version
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def stamp(self, data):
+        """
+        Adds the release and soft expiry date to a dictionary about to be cached.
+        """
+        data['chembl_db_version'] = self.chembl_db_version()
+        data['soft_expires'] = time.time() + self.soft_timeout if self.soft_timeout else None
+        return data
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def is_stale(self, data):
+        version = self.chembl_db_version()
+        if version and data.get('chembl_db_version') != version:
+            return True
+        soft_expires = data.get('soft_expires')
+        return soft_expires is not None and soft_expires < time.time()
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def wrap(self, obj, resource_name=None):
+        return self.stamp({'object': obj, 'resource_name': resource_name})
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def unwrap(self, data):
+        """
+        Returns a tuple with the object wrapped by ``wrap`` and whether it is stale. Values cached before they were
+        wrapped are returned as they are and reported stale so they get replaced.
+        """
+        if isinstance(data, dict) and 'object' in data and 'chembl_db_version' in data:
+            return data['object'], self.is_stale(data)
+        return data, True
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def refresh(self, key, recompute):
+        """
+        Runs ``recompute`` in a background thread unless the worker is already running ``max_refresh_threads``
+        refreshes or another worker is refreshing ``key``. Returns whether the refresh was started.
+        """
+        if not self._refresh_slots.acquire(blocking=False):
+            return False
+        lock_key = 'refresh:' + key
+        token = self.lock(lock_key)
+        if not token:
+            self._refresh_slots.release()
+            return False
+
+        def run():
+            try:
+                recompute()
+            except Exception:
+                self.log.error('Cache refresh exception', exc_info=True, extra={'key': key})
+            finally:
+                # the thread has its own database connection
+                connections.close_all()
+                self.unlock(lock_key, token)
+                self._refresh_slots.release()
+
+        threading.Thread(target=run, name='chembl-cache-refresh', daemon=True).start()
+        return True
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _get_queue(self):
+        # gunicorn workers are forked from a preloaded master, threads do not survive the fork
+        if self._queue_pid != os.getpid():
+            with self._queue_lock:
+                if self._queue_pid != os.getpid():
+                    self._queue = queue.Queue(maxsize=self.write_behind_queue_size)
+                    worker = threading.Thread(target=self._write_behind_loop, args=(self._queue,),
+                                              name='chembl-cache-write-behind', daemon=True)
+                    worker.start()
+                    self._queue_pid = os.getpid()
+        return self._queue
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _write_behind_loop(self, pending):
+        while True:
+            data, timeout, lock = pending.get()
+            try:
+                self.cache.set_many_serialized(data, timeout)
+            except Exception:
+                self.log.error('Caching write behind exception', exc_info=True, extra={'keys': list(data.keys())})
+            finally:
+                if lock:
+                    self.unlock(*lock)
+                pending.task_done()
+
+# ----------------------------------------------------------------------------------------------------------------------
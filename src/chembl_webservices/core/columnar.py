@@ -0,0 +1,211 @@
+__author__ = 'mnowotka'
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models.constants import LOOKUP_SEP
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# columnar formats, list pages are written as Apache Arrow record batches
+COLUMNAR_FORMATS = ('arrow', 'parquet')
+
+# number of rows of each record batch, and of each parquet row group
+BATCH_SIZE = 64 * 1024
+
+# values the database returns that pyarrow does not convert by itself (decimals to doubles, integer flags to
+# booleans) are converted like the tastypie fields of the same type do
+CONVERTERS = {
+    'string': str,
+    'integer': int,
+    'float': float,
+    'decimal': float,
+    'boolean': bool,
+}
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def arrow_type(dehydrated_type):
+    """
+    Arrow type of the column of a tastypie field, from its ``dehydrated_type``. Decimals are written as doubles,
+    fields of unknown types as strings.
+    """
+    return {
+        'integer': pyarrow.int64(),
+        'float': pyarrow.float64(),
+        'decimal': pyarrow.float64(),
+        'boolean': pyarrow.bool_(),
+        'date': pyarrow.date32(),
+        'datetime': pyarrow.timestamp('us'),
+        'time': pyarrow.time64('us'),
+    }.get(dehydrated_type, pyarrow.string())
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def resolve_path(model, path):
+    """
+    Returns the model field an ORM lookup path like ``molecule__chembl_id`` points to, None if it is not a database
+    column or if it goes through a relation to many objects, which would repeat the rows.
+    """
+    field = None
+    for name in path.split(LOOKUP_SEP):
+        if model is None:
+            return None
+        try:
+            field = model._meta.pk if name == 'pk' else model._meta.get_field(name)
+        except FieldDoesNotExist:
+            return None
+        if field.many_to_many or field.one_to_many:
+            return None
+        model = field.related_model
+    return field
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def to_array(values, column_type, dehydrated_type):
+    try:
+        return pyarrow.array(values, type=column_type)
+    except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError):
+        convert = CONVERTERS.get(dehydrated_type, str)
+        return pyarrow.array([None if value is None else convert(value) for value in values], type=column_type)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class ColumnarRows(object):
+    """
+    Objects of a list page written in a columnar format: rows of the values of ``columns``, the
+    ``(column, lookup path, dehydrated type)`` returned by ``ChemblModelResource.get_columnar_fields``. The objects
+    are not dehydrated, the values of the whole page are read with a single query on the lookup paths, in the order
+    of the objects. Objects gone from the database since the page was cached get empty rows.
+    """
+
+    def __init__(self, objects, columns, model):
+        self.objects = objects
+        self.columns = columns
+        self.model = model
+
+    def __len__(self):
+        return len(self.objects)
+
+    def __iter__(self):
+        pks = [obj.pk for obj in self.objects]
+        paths = [path for _, path, _ in self.columns]
+        values = {}
+        if pks:
+            for row in self.model._default_manager.filter(pk__in=pks).values_list('pk', *paths):
+                values[row[0]] = row[1:]
+        empty = (None,) * len(paths)
+        for pk in pks:
+            yield values.get(pk, empty)
+
+    @property
+    def schema(self):
+        return pyarrow.schema([(column, arrow_type(dehydrated_type)) for column, _, dehydrated_type in self.columns])
+
+    @property
+    def dehydrated_types(self):
+        return [dehydrated_type for _, _, dehydrated_type in self.columns]
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def iter_record_batches(rows, schema, dehydrated_types, batch_size=BATCH_SIZE):
+    """
+    Yields record batches of ``batch_size`` rows from an iterable of tuples.
+    """
+    columns = [[] for _ in schema]
+    length = 0
+    for row in rows:
+        for column, value in zip(columns, row):
+            column.append(value)
+        length += 1
+        if length == batch_size:
+            yield record_batch(columns, schema, dehydrated_types)
+            columns = [[] for _ in schema]
+            length = 0
+    if length:
+        yield record_batch(columns, schema, dehydrated_types)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def record_batch(columns, schema, dehydrated_types):
+    arrays = [to_array(values, field.type, dehydrated_type)
+              for values, field, dehydrated_type in zip(columns, schema, dehydrated_types)]
+    return pyarrow.RecordBatch.from_arrays(arrays, schema=schema)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class ChunkSink(object):
+    """
+    Write-only file object keeping what was written until it is drained, pyarrow writers write to it while the
+    response is streamed.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def writable(self):
+        return True
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def iter_arrow(batches, schema):
+    """
+    Yields an Arrow IPC stream, one chunk per record batch.
+    """
+    sink = ChunkSink()
+    writer = pyarrow.ipc.new_stream(sink, schema)
+    for batch in batches:
+        writer.write_batch(batch)
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def iter_parquet(batches, schema):
+    """
+    Yields a parquet file, one chunk per row group, the file metadata comes last.
+    """
+    sink = ChunkSink()
+    writer = pyarrow.parquet.ParquetWriter(sink, schema)
+    for batch in batches:
+        writer.write_table(pyarrow.Table.from_batches([batch], schema=schema))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+# ----------------------------------------------------------------------------------------------------------------------
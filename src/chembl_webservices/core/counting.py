@@ -0,0 +1,84 @@
+__author__ = 'mnowotka'
+
+import json
+from django.db import connections
+from django.db.models.query import QuerySet
+
+COUNT_STRATEGIES = ('exact', 'estimate', 'auto')
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def exact_count(objects):
+    return len(objects) if isinstance(objects, list) else objects.count()
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def count_conditions(node):
+    children = getattr(node, 'children', None)
+    if children is None:
+        return 1
+    return sum(count_conditions(child) for child in children)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def table_estimate(queryset):
+    """
+    Number of rows of the table of the queryset model according to the statistics of the last ANALYZE, None if the
+    table was never analyzed.
+    """
+    connection = connections[queryset.db]
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                       [connection.ops.quote_name(queryset.model._meta.db_table)])
+        row = cursor.fetchone()
+    return row[0] if row and row[0] > 0 else None
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def planner_estimate(queryset):
+    """
+    Number of rows the planner expects the queryset to return.
+    """
+    connection = connections[queryset.db]
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def count_objects(objects, strategy='exact', exact_threshold=100000):
+    """
+    Returns the number of objects and whether it is exact.
+
+    ``exact`` runs a ``COUNT(*)``. ``estimate`` reads the row estimate of the PostgreSQL planner, the table
+    statistics in ``pg_class`` when the queryset is not filtered. ``auto`` only estimates whole tables, from the
+    ``pg_class`` statistics, when they hold more than ``exact_threshold`` rows: the planner estimates of filtered
+    querysets can be off by orders of magnitude and clients page through lists with their counts. Lists, search
+    results and other databases are always counted exactly.
+    """
+    if strategy not in COUNT_STRATEGIES:
+        raise ValueError('Unknown count strategy: {0}'.format(strategy))
+    if strategy == 'exact' or not isinstance(objects, QuerySet) or connections[objects.db].vendor != 'postgresql':
+        return exact_count(objects), True
+    queryset = objects.order_by()
+    unfiltered = not count_conditions(queryset.query.where) and not queryset.query.distinct
+    if strategy == 'auto':
+        estimate = table_estimate(queryset) if unfiltered else None
+        if estimate is None or estimate < exact_threshold:
+            return queryset.count(), True
+        return estimate, False
+    estimate = table_estimate(queryset) if unfiltered else None
+    if estimate is None:
+        estimate = planner_estimate(queryset)
+    return estimate, False
+
+# ----------------------------------------------------------------------------------------------------------------------
@@ -1,25 +1,443 @@
 from FPSim2 import FPSim2Engine
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+import tempfile
+import threading
+import logging
+import fcntl
+import numpy as np
 import time
+import sys
+import os
+
+log = logging.getLogger(__name__)
 
 # Variable loaded from the Settings to prevent circular references
 FPSIM2_FILE_PATH = None
 FPSIM_ENGINE = None
 
+# .npy copy of the fingerprints, written by the export_fpsim2_fps command, that every process maps in memory. The
+# fingerprints are copied into each process when it is not set or older than the FPSim2 file
+FPSIM2_MMAP_PATH = None
+
+# Threads a similarity search may use, and the slots of the cores the searches of all the processes share, see
+# configure_parallel_search
+FPSIM2_N_WORKERS = 1
+SEARCH_SLOTS = None
+
+# number of fingerprints compared at once by the top k searches
+TOP_K_CHUNK_SIZE = 64 * 1024
+
+# number of queries and of fingerprints compared at once by the batch searches, the block of the bitwise and of both
+# takes BATCH_QUERY_BLOCK * BATCH_FPS_BLOCK * 8 bytes per fingerprint word
+BATCH_QUERY_BLOCK = 32
+BATCH_FPS_BLOCK = 2048
+
+# molregnos of the fingerprints in ascending order and the rows they are in, to find the fingerprints of the database
+# molecules. Built with the engine, before gunicorn forks the workers with preload_app, see index_molregnos
+SORTED_MOLREGNOS = None
+MOLREGNO_ROWS = None
+
+# bits set in each byte value, to count the bits of the fingerprints with numpy versions without bitwise_count
+BYTE_POPCOUNTS = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+class InvalidQueryError(ValueError):
+    """
+    The structure of a query can not be parsed.
+    """
+
+class QueryCache(object):
+    """
+    Least recently used fingerprints of the queries, by SMILES or by identifier, shared by the threads of a process.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.queries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            query = self.queries.get(key)
+            if query is not None:
+                self.queries.move_to_end(key)
+            return query
+
+    def set(self, key, query):
+        if self.size <= 0:
+            return
+        with self.lock:
+            self.queries[key] = query
+            self.queries.move_to_end(key)
+            while len(self.queries) > self.size:
+                self.queries.popitem(last=False)
+
+QUERY_CACHE = QueryCache(10000)
+
+class MappedFPSim2Engine(FPSim2Engine):
+    """
+    FPSim2Engine searching the fingerprints of a .npy file written by export_fps, mapped in memory instead of read
+    from the FPSim2 file, which only provides the popcount bins and the fingerprint parameters. The pages of the mapped
+    file are shared by the processes, the reference counts live in the array object and never touch them. Copy on
+    write keeps the array writable as the search functions expect.
+    """
+
+    def __init__(self, fp_filename, mmap_path):
+        super(MappedFPSim2Engine, self).__init__(fp_filename, in_memory_fps=False)
+        self.mmap_path = mmap_path
+        self.mapped_fps = np.load(mmap_path, mmap_mode='c')
+
+    @property
+    def fps(self):
+        return self.mapped_fps
+
+def is_exported(fp_filename, mmap_path):
+    return os.path.exists(mmap_path) and os.path.getmtime(mmap_path) >= os.path.getmtime(fp_filename)
+
 def get_fpsim_engine():
     global FPSIM_ENGINE, FPSIM2_FILE_PATH
     if FPSIM_ENGINE is None:
         t_ini = time.time()
-        FPSIM_ENGINE = FPSim2Engine(FPSIM2_FILE_PATH)
+        if FPSIM2_MMAP_PATH and is_exported(FPSIM2_FILE_PATH, FPSIM2_MMAP_PATH):
+            FPSIM_ENGINE = MappedFPSim2Engine(FPSIM2_FILE_PATH, FPSIM2_MMAP_PATH)
+        else:
+            if FPSIM2_MMAP_PATH:
+                print('FPSIM2 MMAP FILE {0} MISSING OR OLDER THAN THE FPSIM2 FILE, RUN export_fpsim2_fps'.format(
+                    FPSIM2_MMAP_PATH), file=sys.stderr)
+            FPSIM_ENGINE = FPSim2Engine(FPSIM2_FILE_PATH)
+        accept_loaded_queries(FPSIM_ENGINE)
+        index_molregnos(FPSIM_ENGINE)
         print('FPSIM2 FILE LOADED IN {0} SECS'.format(time.time()-t_ini))
     return FPSIM_ENGINE
 
-def get_similar_molregnos(query_smiles, similarity=0.7):
+def accept_loaded_queries(engine):
+    """
+    Lets the search methods of the engine take the fingerprints returned by load_query as well as SMILES, they load
+    their query with the load_query method of the engine.
+    """
+    load_smiles = engine.load_query
+
+    def load_engine_query(query):
+        if isinstance(query, np.ndarray):
+            return query
+        return load_smiles(query)
+
+    engine.load_query = load_engine_query
+
+def index_molregnos(engine):
+    global SORTED_MOLREGNOS, MOLREGNO_ROWS
+    fps = engine.fps
+    rows = np.argsort(fps[:, 0], kind='stable').astype(np.uint32)
+    SORTED_MOLREGNOS = fps[rows, 0]
+    MOLREGNO_ROWS = rows
+
+def export_fps(fp_filename, mmap_path, force=False):
+    """
+    Writes the fingerprints of the FPSim2 file to the .npy file mapped by the processes, unless it is newer than the
+    FPSim2 file. The file is replaced atomically, processes mapping the previous one keep reading it.
+    :return: whether the file was written
+    """
+    if not force and is_exported(fp_filename, mmap_path):
+        return False
+    tmp_path = '{0}.{1}.tmp'.format(mmap_path, os.getpid())
+    with open(tmp_path, 'wb') as tmp_file:
+        np.save(tmp_file, FPSim2Engine(fp_filename).fps)
+    os.replace(tmp_path, mmap_path)
+    return True
+
+class SearchSlots(object):
+    """
+    The threads the similarity searches of all the processes of a host share, one ``flock`` locked file per thread in
+    ``directory``. A process killed in the middle of a search, by the gunicorn timeout for instance, can not give its
+    slots back, the kernel releases its locks when it dies. The files are never removed.
+    """
+
+    def __init__(self, directory, size):
+        self.directory = directory
+        self.size = size
+        os.makedirs(directory, exist_ok=True)
+
+    def acquire(self, count):
+        """
+        Takes up to ``count`` free slots without waiting, returns the descriptors to release.
+        """
+        fds = []
+        for slot in range(self.size):
+            if len(fds) == count:
+                break
+            fd = os.open(os.path.join(self.directory, 'slot-{0}.lock'.format(slot)), os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                os.close(fd)
+                continue
+            fds.append(fd)
+        return fds
+
+    def release(self, fds):
+        for fd in fds:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+def configure_parallel_search(n_workers, shared_workers, directory=None):
+    """
+    :param n_workers: the maximum number of threads of a single similarity search
+    :param shared_workers: the number of threads, on top of the one of each request, all the concurrent searches of
+    the processes of the host can use
+    :param directory: where the lock files of the shared threads are, a directory of the temporary directory by
+    default. Deployments sharing the cores of a host should share it
+    """
+    global FPSIM2_N_WORKERS, SEARCH_SLOTS
+    FPSIM2_N_WORKERS = max(n_workers, 1)
+    SEARCH_SLOTS = None
+    if FPSIM2_N_WORKERS > 1 and shared_workers > 0:
+        SEARCH_SLOTS = SearchSlots(directory or os.path.join(tempfile.gettempdir(), 'chembl_ws_search_slots'),
+                                   shared_workers)
+
+@contextmanager
+def search_workers(n_workers):
+    """
+    Admits a search, yields the number of threads it can use: its own plus the free shared ones, up to n_workers.
+    It never waits, a search runs on a single thread while the other searches hold all the shared ones.
     """
-    :param query_smiles: the smiles representation of the query
+    slots = SEARCH_SLOTS
+    fds = []
+    if slots is not None and n_workers > 1:
+        fds = slots.acquire(n_workers - 1)
+        if not fds:
+            log.info('No shared search thread is free, the similarity search runs on a single thread')
+    try:
+        yield len(fds) + 1
+    finally:
+        if fds:
+            slots.release(fds)
+
+def get_similar_molregnos(query_smiles, similarity=0.7, n_workers=None):
+    """
+    :param query_smiles: the smiles representation of the query, or its fingerprint returned by load_query
     :param similarity: the minimum similarity threshold
+    :param n_workers: the maximum number of threads of the search, FPSIM2_N_WORKERS by default
     :return: a list with tuples of (molregno, similarity)
     """
     if similarity < 0.7 or similarity > 1:
         raise ValueError('Similarity should have a value between 0.7 and 1.')
 
-    return get_fpsim_engine().similarity(query_smiles, similarity, n_workers=1)
+    query = load_query(query_smiles)
+    with search_workers(n_workers or FPSIM2_N_WORKERS) as workers:
+        return get_fpsim_engine().similarity(query, similarity, n_workers=workers)
+
+def load_query(query_smiles):
+    """
+    :param query_smiles: the smiles representation of the query, or its fingerprint, returned as it is
+    :return: the fingerprint of the query, laid out like the rows of the fingerprints: 0, fingerprint words, popcount
+    """
+    if isinstance(query_smiles, np.ndarray):
+        return query_smiles
+    query = QUERY_CACHE.get(query_smiles)
+    if query is None:
+        engine = get_fpsim_engine()
+        try:
+            query = engine.load_query(query_smiles)
+        except (TypeError, ValueError):
+            # RDKit returns no molecule for a structure it can not parse, the fingerprint functions then raise a
+            # Boost.Python.ArgumentError, a TypeError
+            raise InvalidQueryError('Invalid structure: {0}'.format(query_smiles))
+        QUERY_CACHE.set(query_smiles, query)
+    return query
+
+def get_molregno_query(molregno):
+    """
+    :param molregno: the molregno of a molecule of the FPSim2 file
+    :return: its fingerprint, laid out like the ones returned by load_query, None if it is not in the file
+    """
+    fps = get_fpsim_engine().fps
+    position = np.searchsorted(SORTED_MOLREGNOS, molregno)
+    if position == len(SORTED_MOLREGNOS) or SORTED_MOLREGNOS[position] != molregno:
+        return None
+    query = np.array(fps[MOLREGNO_ROWS[position]], dtype=np.uint64)
+    query[0] = 0
+    return query
+
+def get_identifier_query(identifier, get_molecule):
+    """
+    :param identifier: the ChEMBL ID or standard InChI Key of a database molecule
+    :param get_molecule: a function returning the (molregno, canonical smiles) of the identifier
+    :return: the fingerprint of the molecule, from the FPSim2 file or from its canonical smiles, None if it has no
+    structure. The fingerprints are cached by identifier, the database is not queried again for them.
+    """
+    query = QUERY_CACHE.get(identifier)
+    if query is None:
+        molregno, smiles = get_molecule(identifier)
+        query = get_molregno_query(molregno) if molregno is not None else None
+        if query is None:
+            if not smiles:
+                return None
+            query = load_query(smiles)
+        QUERY_CACHE.set(identifier, query)
+    return query
+
+def popcount_rows(words):
+    """
+    :param words: an array of uint64, with the words of each fingerprint along the last axis
+    :return: the number of bits set in each fingerprint
+    """
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words).sum(axis=-1, dtype=np.uint32)
+    return BYTE_POPCOUNTS[np.ascontiguousarray(words).view(np.uint8)].sum(axis=-1, dtype=np.uint32)
+
+def tanimoto_bound(query_count, count):
+    # the Tanimoto similarity of fingerprints with these numbers of bits set is at most the ratio of the numbers
+    if not query_count or not count:
+        return 0.0
+    return min(query_count, count) / max(query_count, count)
+
+def select_top_k(molregnos, scores, top_k):
+    """
+    :return: the indexes of the top_k highest scores, the ties of the lowest score kept are broken by molregno
+    """
+    if len(scores) <= top_k:
+        return np.arange(len(scores))
+    kth_score = scores[np.argpartition(-scores, top_k - 1)[top_k - 1]]
+    above = np.nonzero(scores > kth_score)[0]
+    tied = np.nonzero(scores == kth_score)[0]
+    tied = tied[np.argsort(molregnos[tied], kind='stable')[:top_k - len(above)]]
+    return np.concatenate((above, tied))
+
+def get_top_k_molregnos(query_smiles, top_k, similarity=0.0):
+    """
+    :param query_smiles: the smiles representation of the query, or its fingerprint returned by load_query
+    :param top_k: the number of most similar molecules to return
+    :param similarity: the minimum similarity threshold, any value between 0 and 1
+    :return: an array of (molregno, similarity) like get_similar_molregnos, most similar first and, for the same
+    similarity, by molregno
+
+    The popcount bins of the fingerprints are scanned from the ones closest to the popcount of the query, and the
+    scan stops when the bound of the similarity of a bin falls below the k-th best similarity found. The memory used
+    depends on top_k and TOP_K_CHUNK_SIZE, not on the number of hits.
+    """
+    if similarity < 0 or similarity > 1:
+        raise ValueError('Similarity should have a value between 0 and 1.')
+    if top_k < 1:
+        raise ValueError('top_k should be a positive number.')
+
+    engine = get_fpsim_engine()
+    fps = engine.fps
+    query = load_query(query_smiles)
+    # the fingerprints are stored as rows of molregno, fingerprint words and popcount
+    query_words = query[1:-1]
+    query_count = int(query[-1])
+
+    best_molregnos = np.empty(0, dtype=np.uint64)
+    best_scores = np.empty(0, dtype=np.float64)
+    bins = sorted(engine.popcnt_bins, key=lambda popcnt_bin: -tanimoto_bound(query_count, int(popcnt_bin[0])))
+    for count, (start, end) in bins:
+        count = int(count)
+        bound = tanimoto_bound(query_count, count)
+        # a bin reaching the k-th score may still hold a tie with a lower molregno
+        if bound < similarity or (len(best_scores) == top_k and bound < best_scores.min()):
+            break
+        for chunk_start in range(start, end, TOP_K_CHUNK_SIZE):
+            chunk = fps[chunk_start:min(end, chunk_start + TOP_K_CHUNK_SIZE)]
+            common = popcount_rows(chunk[:, 1:-1] & query_words)
+            scores = common / (query_count + count - common).astype(np.float64)
+            floor = max(similarity, best_scores.min()) if len(best_scores) == top_k else similarity
+            hits = np.nonzero(scores >= floor)[0]
+            if not len(hits):
+                continue
+            best_molregnos = np.concatenate((best_molregnos, chunk[hits, 0]))
+            best_scores = np.concatenate((best_scores, scores[hits]))
+            kept = select_top_k(best_molregnos, best_scores, top_k)
+            best_molregnos, best_scores = best_molregnos[kept], best_scores[kept]
+
+    order = np.lexsort((best_molregnos, -best_scores))
+    results = np.empty(len(order), dtype=[('mol_id', '<u4'), ('coeff', '<f4')])
+    results['mol_id'] = best_molregnos[order]
+    results['coeff'] = best_scores[order]
+    return results
+
+def scan_batch(fps, popcnt_bins, query_words, query_counts, similarity, top_k):
+    """
+    :return: the molregnos and the similarities of the hits of each query in the popcount bins, at most top_k of them
+    """
+    found = [[] for _ in query_counts]
+    # the similarity a fingerprint has to reach to be kept, the k-th best one of the queries with top_k hits
+    floors = np.full(len(query_counts), similarity)
+    for count, (start, end) in popcnt_bins:
+        count = int(count)
+        bounds = np.minimum(query_counts, count) / np.maximum(np.maximum(query_counts, count), 1)
+        active = np.nonzero(bounds >= floors)[0]
+        if not len(active):
+            continue
+        for fps_start in range(start, end, BATCH_FPS_BLOCK):
+            block = fps[fps_start:min(end, fps_start + BATCH_FPS_BLOCK)]
+            block_words = block[:, 1:-1]
+            for query_start in range(0, len(active), BATCH_QUERY_BLOCK):
+                block_queries = active[query_start:query_start + BATCH_QUERY_BLOCK]
+                common = popcount_rows(query_words[block_queries, None, :] & block_words[None, :, :]).astype(np.int64)
+                scores = common / (query_counts[block_queries, None] + count - common)
+                hits = scores >= floors[block_queries, None]
+                for row in np.nonzero(hits.any(axis=1))[0]:
+                    query_idx = block_queries[row]
+                    columns = np.nonzero(hits[row])[0]
+                    found[query_idx].append((block[columns, 0], scores[row, columns]))
+                    if top_k:
+                        molregnos, query_scores = merge_hits(found[query_idx], top_k)
+                        found[query_idx] = [(molregnos, query_scores)]
+                        if len(query_scores) == top_k:
+                            floors[query_idx] = max(similarity, query_scores.min())
+    return found
+
+def merge_hits(hits, top_k=None):
+    """
+    :param hits: a list of (molregnos, similarities) arrays
+    :return: the molregnos and similarities of the top_k best hits, or all of them
+    """
+    if not hits:
+        return np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.float64)
+    molregnos = np.concatenate([molregnos for molregnos, _ in hits])
+    scores = np.concatenate([scores for _, scores in hits])
+    if top_k:
+        kept = select_top_k(molregnos, scores, top_k)
+        molregnos, scores = molregnos[kept], scores[kept]
+    return molregnos, scores
+
+def get_batch_similar_molregnos(queries, similarity=0.7, top_k=None, n_workers=None):
+    """
+    :param queries: the fingerprints of the queries, as returned by load_query
+    :param similarity: the minimum similarity threshold
+    :param top_k: the number of most similar molecules kept for each query, all the hits when None
+    :param n_workers: the maximum number of threads of the search, FPSIM2_N_WORKERS by default
+    :return: a list with an array of (molregno, similarity) like get_top_k_molregnos for each query
+
+    The fingerprints are read once for all the queries: each block of fingerprints of a popcount bin is compared to
+    the blocks of the queries whose popcount can reach the threshold in the bin, or the k-th best similarity found for
+    them. The threads of the search scan interleaved popcount bins.
+    """
+    if similarity < 0.7 or similarity > 1:
+        raise ValueError('Similarity should have a value between 0.7 and 1.')
+
+    engine = get_fpsim_engine()
+    fps = engine.fps
+    popcnt_bins = list(engine.popcnt_bins)
+    query_words = np.array([query[1:-1] for query in queries], dtype=np.uint64)
+    query_counts = np.array([query[-1] for query in queries], dtype=np.int64)
+
+    with search_workers(n_workers or FPSIM2_N_WORKERS) as workers:
+        workers = max(min(workers, len(popcnt_bins)), 1)
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                parts = list(executor.map(lambda part: scan_batch(fps, popcnt_bins[part::workers], query_words,
+                                                                  query_counts, similarity, top_k), range(workers)))
+        else:
+            parts = [scan_batch(fps, popcnt_bins, query_words, query_counts, similarity, top_k)]
+
+    results = []
+    for query_idx in range(len(queries)):
+        molregnos, scores = merge_hits([hit for part in parts for hit in part[query_idx]], top_k)
+        order = np.lexsort((molregnos, -scores))
+        query_results = np.empty(len(order), dtype=[('mol_id', '<u4'), ('coeff', '<f4')])
+        query_results['mol_id'] = molregnos[order]
+        query_results['coeff'] = scores[order]
+        results.append(query_results)
+    return results
@@ -3,7 +3,8 @@ __author__ = 'mnowotka'
 from tastypie.authentication import Authentication
 from tastypie.authorization import Authorization
 from tastypie.throttle import BaseThrottle
-from tastypie.cache import SimpleCache
+from django.conf import settings
+from chembl_webservices.core.cache import ChemblCache
 from chembl_webservices.core.pagination import ChEMBLPaginator
 
 # ----------------------------------------------------------------------------------------------------------------------
@@ -21,6 +22,10 @@ class ChemblResourceMeta(object):
     authorization = Authorization()
     throttle = BaseThrottle(throttle_at=100)
     paginator_class = ChEMBLPaginator
-    cache = SimpleCache(timeout=30000000) #TODO:  from Django 1.7 you can set TIMEOUT to None so that, by default, cache keys never expire. So exactly what I'm trying to achieve here.
+    count_strategy = getattr(settings, 'COUNT_STRATEGY', 'exact')
+    exact_count_threshold = getattr(settings, 'EXACT_COUNT_THRESHOLD', 100000)
+    cache = ChemblCache(timeout=30000000, write_behind=getattr(settings, 'CACHE_WRITE_BEHIND', False),
+                        single_flight=getattr(settings, 'CACHE_SINGLE_FLIGHT', None),
+                        soft_timeout=getattr(settings, 'CACHE_SOFT_TIMEOUT', None)) #TODO:  from Django 1.7 you can set TIMEOUT to None so that, by default, cache keys never expire. So exactly what I'm trying to achieve here.
 
 # ----------------------------------------------------------------------------------------------------------------------
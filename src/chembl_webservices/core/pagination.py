@@ -1,7 +1,11 @@
 __author__ = 'mnowotka'
 
+import json
+import base64
+import binascii
 from tastypie.paginator import Paginator
 from tastypie.paginator import urlencode
+from tastypie.exceptions import BadRequest
 from django.db.models.query import QuerySet
 
 #-----------------------------------------------------------------------------------------------------------------------
@@ -18,6 +22,28 @@ def encoded_dict(in_dict):
 
 #-----------------------------------------------------------------------------------------------------------------------
 
+def encode_cursor(value):
+    """
+    Opaque cursor pointing after the row with the given ordering key.
+    """
+    return base64.urlsafe_b64encode(json.dumps([value]).encode('utf-8')).decode('ascii').rstrip('=')
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+def decode_cursor(cursor):
+    """
+    Returns the ordering key encoded in the cursor, None for an empty cursor, which points to the first page.
+    """
+    if not cursor:
+        return None
+    try:
+        value = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8'))
+        return value[0]
+    except (binascii.Error, ValueError, TypeError, IndexError, KeyError):
+        raise BadRequest('Invalid cursor provided: {0}'.format(cursor))
+
+#-----------------------------------------------------------------------------------------------------------------------
+
 class ChEMBLPaginator(Paginator):
 
     def __init__(self, request_data, objects, resource_uri=None, limit=None, offset=0, max_limit=1000,
@@ -57,33 +83,83 @@ class ChEMBLPaginator(Paginator):
 #-----------------------------------------------------------------------------------------------------------------------
 
     def get_slice(self, limit, offset):
+        """
+        Reads the page with a single ordered query, select_related joins included, so the prefetches of the
+        queryset only run for the objects of the page. Querysets using ``distinct``, which the resources add for
+        filters spanning many-to-many relations, first read the primary keys of the page and then its objects.
+        """
         typ = type(self.objects)
+        if typ != QuerySet or not self.objects.query.distinct:
+            return self.objects[offset:offset + limit] if limit else self.objects[offset:]
         if limit == 0:
-            if typ == QuerySet:
-                pks = list(self.objects.only('pk')[offset:].values_list('pk', flat=True).iterator())
-            else:
-                return self.objects[offset:]
+            pks = list(self.objects.only('pk')[offset:].values_list('pk', flat=True).iterator())
         else:
-            if typ == QuerySet:
-                pks = list(self.objects.only('pk')[offset:offset + limit].values_list('pk', flat=True).iterator())
-            else:
-                return self.objects[offset:offset + limit]
+            pks = list(self.objects.only('pk')[offset:offset + limit].values_list('pk', flat=True).iterator())
         return self.objects.filter(pk__in=pks)
 
 # -----------------------------------------------------------------------------------------------------------------------
 
-    def _generate_uri(self, limit, offset):
+    def get_cursor_page(self, limit, after):
+        """
+        Keyset pagination: returns the ``limit`` objects whose primary key follows the one encoded in ``after``,
+        in the order of the queryset, which has to be ordered by primary key.
+        """
+        objects = self.objects
+        if not isinstance(objects, QuerySet):
+            raise BadRequest('Cursor pagination is not available for this resource.')
+        pk_name = objects.model._meta.pk.name
+        ordering = tuple(objects.query.order_by)
+        if ordering in ((), ('pk',), (pk_name,)):
+            lookup = 'pk__gt'
+        elif ordering in (('-pk',), ('-' + pk_name,)):
+            lookup = 'pk__lt'
+        else:
+            raise BadRequest('Cursor pagination is only available when ordering by {0}.'.format(pk_name))
+        if not ordering:
+            objects = objects.order_by('pk')
+        last = decode_cursor(after)
+        if last is not None:
+            objects = objects.filter(**{lookup: last})
+        page = list(objects[:limit])
+        next_cursor = encode_cursor(page[-1].pk) if len(page) == limit else None
+        meta = {
+            'limit': limit,
+            'after': after or None,
+            'total_count': None,
+            'previous': None,
+            'next': self._generate_uri(limit, None, after=next_cursor) if next_cursor else None,
+        }
+        return page, meta
+
+# -----------------------------------------------------------------------------------------------------------------------
+
+    def get_next(self, limit, offset, count, page_length=None):
+        """
+        When the count is estimated or unknown ``count`` is None and a next page is linked if the current one, of
+        ``page_length`` objects, is full.
+        """
+        if count is None:
+            if not limit or page_length is None or page_length < limit:
+                return None
+            return self._generate_uri(limit, offset + limit)
+        return super(ChEMBLPaginator, self).get_next(limit, offset, count)
+
+# -----------------------------------------------------------------------------------------------------------------------
+
+    def _generate_uri(self, limit, offset, after=None):
         if self.resource_uri is None:
             return None
 
         try:
             # QueryDict has a urlencode method that can handle multiple values for the same key
             request_params = self.request_data.copy()
-            if 'limit' in request_params:
-                del request_params['limit']
-            if 'offset' in request_params:
-                del request_params['offset']
-            request_params.update({'limit': limit, 'offset': offset})
+            for name in ('limit', 'offset', 'after'):
+                if name in request_params:
+                    del request_params[name]
+            if after is not None:
+                request_params.update({'limit': limit, 'after': after})
+            else:
+                request_params.update({'limit': limit, 'offset': offset})
             if self.params:
                 request_params.update(self.params)
             encoded_params = request_params.urlencode()
@@ -147,6 +223,48 @@ class ChEMBLPaginator(Paginator):
 
 #-----------------------------------------------------------------------------------------------------------------------
 
+class ScoredList(object):
+    """
+    Objects of a queryset in the order of a score computed outside of the database, like search relevance or
+    similarity. Only the ordered primary keys and scores are kept: slicing reads just the objects of the slice, with
+    their prefetches, and sets their score as ``score_attribute``.
+    """
+
+    def __init__(self, queryset, scored_pks, score_attribute='score'):
+        self.queryset = queryset
+        self.scored_pks = list(scored_pks)
+        self.score_attribute = score_attribute
+
+    def __len__(self):
+        return len(self.scored_pks)
+
+    def count(self):
+        return len(self.scored_pks)
+
+    def __iter__(self):
+        for start in range(0, len(self.scored_pks), 1000):
+            for obj in self[start:start + 1000]:
+                yield obj
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return self.hydrate(self.scored_pks[item])
+        return self.hydrate([self.scored_pks[item]])[0]
+
+    def hydrate(self, scored_pks):
+        if not scored_pks:
+            return []
+        objects = dict((obj.pk, obj) for obj in self.queryset.filter(pk__in=[pk for pk, _ in scored_pks]))
+        ret = []
+        for pk, score in scored_pks:
+            obj = objects.get(pk)
+            if obj is not None:
+                setattr(obj, self.score_attribute, score)
+                ret.append(obj)
+        return ret
+
+#-----------------------------------------------------------------------------------------------------------------------
+
 class DummyPaginator(object):
     def __init__(self, request_data, objects, resource_uri=None,
                  limit=None, offset=0, max_limit=1000,
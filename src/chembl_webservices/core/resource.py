@@ -18,14 +18,17 @@ from tastypie.resources import ModelResource
 from tastypie.resources import convert_post_to_put
 from tastypie.utils import dict_strip_unicode_keys
 from tastypie.utils.mime import build_content_type
+from tastypie.bundle import Bundle
 from tastypie.exceptions import NotFound
 from tastypie import fields
 from django.utils import six
 from django.http import HttpResponse
+from django.http import StreamingHttpResponse
 from django.http import HttpResponseNotFound
 from django.http import Http404
 from django.conf.urls import url
 from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.middleware.gzip import GZipMiddleware
 from django.conf import settings
 from django.core.signals import got_request_exception
 from django.core.exceptions import FieldDoesNotExist
@@ -40,6 +43,20 @@ from chembl_webservices.core.utils import CHAR_FILTERS
 from chembl_webservices.core.utils import represents_int
 from chembl_webservices.core.utils import list_flatten
 from chembl_webservices.core.utils import unpack_request_params
+from chembl_webservices.core.utils import canonical_only
+from chembl_webservices.core.utils import canonical_filter
+from chembl_webservices.core.counting import count_objects
+from chembl_webservices.core.pagination import ScoredList
+from chembl_webservices.core.serialization import StreamedCollection
+from chembl_webservices.core.serialization import FLAT_FORMATS
+from chembl_webservices.core.serialization import JSONPlan
+from chembl_webservices.core.columnar import pyarrow
+from chembl_webservices.core.columnar import COLUMNAR_FORMATS
+from chembl_webservices.core.columnar import ColumnarRows
+from chembl_webservices.core.columnar import resolve_path
+from chembl_webservices.core.columnar import iter_record_batches
+from chembl_webservices.core.columnar import iter_arrow
+from chembl_webservices.core.columnar import iter_parquet
 
 try:
     from haystack.query import SearchQuerySet
@@ -132,6 +149,17 @@ class ChemblModelResource(ModelResource):
         self.authorized_read_detail(self.get_object_list(bundle.request), bundle)
         return self.create_response(request, self.build_columns_info())
 
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def get_schema(self, request, **kwargs):
+        """
+        The schema is nested, the flat and columnar formats, which write rows of objects, are refused.
+        """
+        format_name = self.get_format_name(request)
+        if format_name in FLAT_FORMATS + COLUMNAR_FORMATS:
+            raise BadRequest('The schema is not available in the {0} format.'.format(format_name))
+        return super(ChemblModelResource, self).get_schema(request, **kwargs)
+
 # ----------------------------------------------------------------------------------------------------------------------
 
     def build_columns_info(self):
@@ -270,6 +298,7 @@ class ChemblModelResource(ModelResource):
 
                 callback = getattr(self, view)
                 response = callback(request, *args, **kwargs)
+                response = self.compress_response(request, response)
 
                 # Our response can vary based on a number of factors, use
                 # the cache class to determine what we should ``Vary`` on so
@@ -329,6 +358,17 @@ class ChemblModelResource(ModelResource):
 
         return wrapper
 
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def compress_response(self, request, response):
+        """
+        Compresses the responses in the formats of ``GZIP_FORMATS`` for the clients accepting gzip, streamed responses
+        are compressed while they are streamed.
+        """
+        if self.get_format_name(request) in getattr(settings, 'GZIP_FORMATS', ()):
+            return GZipMiddleware().process_response(request, response)
+        return response
+
 # ----------------------------------------------------------------------------------------------------------------------
 
     def unquote_args(self, args):
@@ -388,11 +428,13 @@ class ChemblModelResource(ModelResource):
 # ----------------------------------------------------------------------------------------------------------------------
     def list_cache_handler(self, data_provider):
 
-        def handle(bundle, cache_key_name, url_name, **kwargs):
+        def handle(bundle, cache_key_name, url_name, _refresh=False, **kwargs):
             """
             A version of ``obj_get_list`` that uses the cache as a means to get
             commonly-accessed data faster.
+            With ``_refresh`` the pages are recomputed and written synchronously, ignoring the cached ones.
             """
+            original_kwargs = kwargs
             kwargs = self.unquote_args(kwargs)
 
             request = bundle.request
@@ -412,6 +454,31 @@ class ChemblModelResource(ModelResource):
             paginator_info = {'limit': limit, 'offset': offset}
             max_limit = self._meta.max_limit
 
+            # total_count=none skips counting, for clients paging through the next links only
+            total_count = kwargs.pop('total_count', None)
+            if isinstance(total_count, list):
+                total_count = total_count[0]
+            if total_count is not None and total_count.lower() != 'none':
+                raise BadRequest("Invalid total_count provided: {0}, only 'none' is supported.".format(total_count))
+
+            # keyset pagination, pages are read straight from the database in linear time whatever their depth
+            after = kwargs.pop('after', None)
+            params = dict(kwargs, total_count='none') if total_count else kwargs
+            if after is not None:
+                if isinstance(after, list):
+                    after = after[0]
+                paginator = self._meta.paginator_class({'limit': limit},
+                                                       data_provider(bundle, **kwargs),
+                                                       resource_uri=self.get_resource_uri(None, url_name),
+                                                       limit=self._meta.limit,
+                                                       max_limit=max_limit,
+                                                       collection_name=self._meta.collection_name,
+                                                       format=request.format,
+                                                       params=params,
+                                                       method=request.method)
+                objs, meta = paginator.get_cursor_page(min(limit, max_limit) or max_limit, after)
+                return {self._meta.collection_name: objs, 'page_meta': meta}, False
+
             try:
                 start_slice = (paginator_info['offset'] // max_limit) * max_limit
                 # start_slice = math.floor(start_slice)
@@ -424,121 +491,173 @@ class ChemblModelResource(ModelResource):
                 pages = [{'offset': start_slice, 'limit': max_limit}, {'offset': end_slice, 'limit': max_limit}]
 
             for page in pages:
-                if get_failed:
-                    page['in_cache'] = False
-                    continue
                 page_kwargs = kwargs.copy()
                 page_kwargs.update(page)
-                cache_key = self.generate_cache_key(cache_key_name, **page_kwargs)
-                page['cache_key'] = cache_key
-                try:
-                    chunk = self._meta.cache.get(cache_key)
+                page['cache_key'] = self.generate_cache_key(cache_key_name, **page_kwargs)
+                page['in_cache'] = False
+            # the count does not depend on the page or the ordering
+            count_key = self.generate_cache_key(cache_key_name, 'count', **{k: v for k, v in kwargs.items()
+                                                                            if k not in ('order_by', 'sort_by', 'only')})
+
+            try:
+                chunks = self._meta.cache.get_many([page['cache_key'] for page in pages]) if not _refresh else {}
+            except Exception as e:
+                chunks = {}
+                get_failed = True
+                self.log.error('Caching get exception', exc_info=True, extra={'bundle': request.path,})
+
+            def fill_pages(chunks):
+                for page in pages:
+                    chunk = chunks.get(page['cache_key'])
                     if chunk:
                         page['slice'] = chunk.get('slice')
                         page['count'] = chunk.get('count')
+                        page['count_exact'] = chunk.get('count_exact', True)
                         page['in_cache'] = True
-                    else:
-                        page['in_cache'] = False
-                except Exception as e:
-                    page['in_cache'] = False
-                    get_failed = True
-                    self.log.error('Caching get exception', exc_info=True, extra={'bundle': request.path,})
-
-            in_cache = all(page.get('in_cache') for page in pages) and \
+                return all(page.get('in_cache') for page in pages) and \
                                                         (len(pages) == 1 or pages[0]['count'] == pages[1]['count'])
-            if not in_cache:
-                sorted_objects = data_provider(bundle, **kwargs)
-                is_sqs = False
-                if isinstance(sorted_objects, SearchQuerySet):
-                    is_sqs = True
-                try:
-                    count = sorted_objects.count() if not isinstance(sorted_objects, list) else len(sorted_objects)
-                except (DatabaseError, NotImplementedError) as e:
-                    self._handle_database_error(e, request, kwargs)
-                if count < max_limit:
-                    len(sorted_objects)
-                objs = []
-                paginator = self._meta.paginator_class(paginator_info,
-                                                       sorted_objects,
-                                                       resource_uri=self.get_resource_uri(None, url_name),
-                                                       limit=self._meta.limit,
-                                                       max_limit=self._meta.max_limit,
-                                                       collection_name=self._meta.collection_name,
-                                                       format=request.format,
-                                                       params=kwargs,
-                                                       method=request.method)
-                meta = paginator.get_meta(False)
-                meta['total_count'] = count
-                if request.method.upper() == 'GET':
-                    meta['previous'] = paginator.get_previous(paginator.get_limit(), paginator.get_offset())
-                    meta['next'] = paginator.get_next(paginator.get_limit(), paginator.get_offset(),
-                                                      meta['total_count'])
-                for page in pages:
-                    if page.get('in_cache') and page.get('count') == meta.get('total_count'):
-                        objs.extend(page.get('slice'))
-                    else:
-                        paginator = self._meta.paginator_class(page,
-                                                               sorted_objects,
-                                                               resource_uri=self.get_resource_uri(None, url_name),
-                                                               limit=self._meta.limit,
-                                                               max_limit=self._meta.max_limit,
-                                                               collection_name=self._meta.collection_name,
-                                                               format=request.format,
-                                                               params=kwargs,
-                                                               method=request.method)
-                        slice = paginator.get_slice(paginator.get_limit(), paginator.get_offset())
-                        if is_sqs:
-                            slice = self.extract_models(slice)
-                        len(slice)
-                        objs.extend(slice)
-                        if not get_failed:
-                            try:
+
+            in_cache = fill_pages(chunks)
+            if in_cache and any(self._meta.cache.is_stale(chunks[page['cache_key']]) for page in pages):
+                # serve the stale pages, they are replaced in the background
+                self._meta.cache.refresh(pages[0]['cache_key'],
+                                         lambda: handle(bundle, cache_key_name, url_name, True, **original_kwargs))
+
+            # single flight: only one worker computes a missing list, the others wait for it to reach the cache
+            lock_key = 'lock:' + '|'.join(page['cache_key'] for page in pages)
+            lock_token = None
+            if not in_cache and not get_failed and not _refresh:
+                lock_token = self._meta.cache.lock(lock_key)
+                if not lock_token:
+                    in_cache = fill_pages(self._meta.cache.wait_many([page['cache_key'] for page in pages], lock_key))
+            paginator = self._meta.paginator_class(paginator_info,
+                                                   [],
+                                                   resource_uri=self.get_resource_uri(None, url_name),
+                                                   limit=self._meta.limit,
+                                                   max_limit=self._meta.max_limit,
+                                                   collection_name=self._meta.collection_name,
+                                                   format=request.format,
+                                                   params=params,
+                                                   method=request.method)
+            meta = paginator.get_meta(False)
+            try:
+                if not in_cache:
+                    sorted_objects = data_provider(bundle, **kwargs)
+                    is_sqs = False
+                    if isinstance(sorted_objects, SearchQuerySet):
+                        is_sqs = True
+                    count, count_exact = None, False
+                    if not total_count:
+                        try:
+                            count, count_exact = self.get_list_count(count_key, lambda: sorted_objects, _refresh)
+                        except (DatabaseError, NotImplementedError) as e:
+                            self._handle_database_error(e, request, kwargs)
+                    if count is not None and count < max_limit:
+                        len(sorted_objects)
+                    objs = []
+                    meta['total_count'] = count
+                    to_cache = {}
+                    for page in pages:
+                        if page.get('in_cache') and page.get('count') == count:
+                            objs.extend(page.get('slice'))
+                        else:
+                            page_paginator = self._meta.paginator_class(page,
+                                                                        sorted_objects,
+                                                                        limit=self._meta.limit,
+                                                                        max_limit=self._meta.max_limit,
+                                                                        collection_name=self._meta.collection_name,
+                                                                        method=request.method)
+                            slice = page_paginator.get_slice(page_paginator.get_limit(), page_paginator.get_offset())
+                            if is_sqs:
+                                slice = self.extract_models(slice)
+                            len(slice)
+                            objs.extend(slice)
+                            if not get_failed:
                                 slice = list(slice)
                                 if slice:
                                     cache_data = self._get_cache_args()
                                     # overwrite the default ones
                                     cache_data.update({
                                         'slice': slice,
-                                        'count': meta.get('total_count'),
+                                        'count': count,
+                                        'count_exact': count_exact,
                                         'offset': offset,
                                         'url': request.path,
                                         'slice_length': len(slice)
                                     })
-                                    self._meta.cache.set(
-                                        page.get('cache_key'), cache_data
-                                    )
-                            except Exception:
-                                self.log.error('Caching set exception', exc_info=True, extra={'bundle': request.path, })
-                                get_failed = False
-
-            else:
-                objs = list(itertools.chain.from_iterable([page.get('slice') for page in pages]))
-                paginator = self._meta.paginator_class(paginator_info,
-                                                       [],
-                                                       resource_uri=self.get_resource_uri(None, url_name),
-                                                       limit=self._meta.limit,
-                                                       max_limit=self._meta.max_limit,
-                                                       collection_name=self._meta.collection_name,
-                                                       format=request.format,
-                                                       params=kwargs,
-                                                       method=request.method)
-                meta = paginator.get_meta(False)
-                meta['total_count'] = pages[0]['count']
-                if request.method.upper() == 'GET':
-                    meta['previous'] = paginator.get_previous(paginator.get_limit(), paginator.get_offset())
-                    meta['next'] = paginator.get_next(paginator.get_limit(), paginator.get_offset(),
-                                                      meta['total_count'])
+                                    to_cache[page.get('cache_key')] = self._meta.cache.stamp(cache_data)
+                    if to_cache or lock_token:
+                        # the lock is released once the pages are written
+                        lock = (lock_key, lock_token) if lock_token else None
+                        lock_token = None
+                        try:
+                            self._meta.cache.set_many(to_cache, write_behind=False if _refresh else None, lock=lock)
+                        except Exception:
+                            self.log.error('Caching set exception', exc_info=True, extra={'bundle': request.path, })
 
+                else:
+                    objs = list(itertools.chain.from_iterable([page.get('slice') for page in pages]))
+                    count, count_exact = pages[0]['count'], pages[0]['count_exact']
+                    if total_count:
+                        count, count_exact = None, False
+                    elif count is None:
+                        # the pages were cached by a total_count=none request
+                        try:
+                            count, count_exact = self.get_list_count(count_key,
+                                                                     lambda: data_provider(bundle, **kwargs))
+                        except (DatabaseError, NotImplementedError) as e:
+                            self._handle_database_error(e, request, kwargs)
+                    meta['total_count'] = count
+            finally:
+                if lock_token:
+                    self._meta.cache.unlock(lock_key, lock_token)
+
+            # estimated counts are flagged, clients should not drive their paging with them
+            meta['total_count_is_estimate'] = count is not None and not count_exact
             offset = meta.get('offset') - start_slice
             obj_list = {
                 self._meta.collection_name: objs[offset:offset + meta.get('limit')],
                 'page_meta': meta,
             }
-
+            if request.method.upper() == 'GET':
+                limit, offset = paginator.get_limit(), paginator.get_offset()
+                meta['previous'] = paginator.get_previous(limit, offset)
+                meta['next'] = paginator.get_next(limit, offset, count if count_exact else None,
+                                                  len(obj_list[self._meta.collection_name]))
+
+            if not _refresh:
+                self._meta.cache.record(self._meta.resource_name, in_cache)
             return obj_list, in_cache
 
         return handle
 
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def get_list_count(self, count_key, objects, _refresh=False):
+        """
+        Returns the total count of a list and whether it is exact, following the ``count_strategy`` of the resource.
+        ``objects`` is a callable returning the list, only called if the count is not cached. Counts are cached apart
+        from the pages, keyed by the filters, so all the pages and orderings of a list share them.
+        """
+        cache = self._meta.cache
+        if not _refresh:
+            try:
+                cached = cache.get(count_key)
+            except Exception:
+                cached = None
+                self.log.error('Caching get exception', exc_info=True, extra={'key': count_key, })
+            if isinstance(cached, dict) and 'count' in cached:
+                if cache.is_stale(cached):
+                    cache.refresh(count_key, lambda: self.get_list_count(count_key, objects, True))
+                return cached['count'], cached.get('exact', True)
+        count, exact = count_objects(objects(), self._meta.count_strategy, self._meta.exact_count_threshold)
+        try:
+            cache.set_many({count_key: cache.stamp({'count': count, 'exact': exact})},
+                           write_behind=False if _refresh else None)
+        except Exception:
+            self.log.error('Caching set exception', exc_info=True, extra={'key': count_key, })
+        return count, exact
+
 # ----------------------------------------------------------------------------------------------------------------------
 
     def get_search_results(self, user_query):
@@ -609,13 +728,15 @@ class ChemblModelResource(ModelResource):
                 objects = objects.defer(*to_defer).distinct()
             objects = self.authorized_read_list(objects, bundle)
             objects = self.prefetch_related(objects, **kwargs)
-            if list(res.keys()) and isinstance(list(res.keys())[0], int):
-                for obj in objects:
-                    obj.score = float(int(res[obj.pk]))
-            else:
-                for obj in objects:
-                    obj.score = float(res[str(obj.pk)])
-            return sorted(objects, key=lambda obj: obj.score, reverse=True)
+            # only the ids are sorted by score, the objects are read a page at a time
+            int_keys = bool(res) and isinstance(next(iter(res.keys())), int)
+            scored = []
+            seen = set()
+            for pk in objects.values_list('pk', flat=True):
+                if pk not in seen:
+                    seen.add(pk)
+                    scored.append((pk, float(int(res[pk])) if int_keys else float(res[str(pk)])))
+            return ScoredList(objects, sorted(scored, key=lambda x: x[1], reverse=True), 'score')
 
         except TypeError as e:
             if 'invalid lookup' in e.message:
@@ -653,17 +774,24 @@ class ChemblModelResource(ModelResource):
 
     def detail_cache_handler(self, f):
 
-        def handle(bundle, cache_key, **kwargs):
+        def handle(bundle, cache_key_name, _refresh=False, **kwargs):
             """
             A version of ``obj_get`` that uses the cache as a means to get
             commonly-accessed data faster.
+            With ``_refresh`` the object is recomputed and cached, ignoring the cached one.
             """
-            cache_key = self.generate_cache_key(cache_key, **kwargs)
+            cache_key = self.generate_cache_key(cache_key_name, **kwargs)
             get_failed = False
             in_cache = True
+            cached_bundle = None
 
             try:
-                cached_bundle = self._meta.cache.get(cache_key)
+                cached = self._meta.cache.get(cache_key) if not _refresh else None
+                if cached is not None:
+                    cached_bundle, stale = self._meta.cache.unwrap(cached)
+                    if stale:
+                        # serve the stale object, it is replaced in the background
+                        self._meta.cache.refresh(cache_key, lambda: handle(bundle, cache_key_name, True, **kwargs))
             except Exception:
                 cached_bundle = None
                 get_failed = True
@@ -674,10 +802,12 @@ class ChemblModelResource(ModelResource):
                 cached_bundle = f(bundle=bundle, **kwargs)
                 if not get_failed:
                     try:
-                        self._meta.cache.set(cache_key, cached_bundle)
+                        self._meta.cache.set(cache_key, self._meta.cache.wrap(cached_bundle, self._meta.resource_name))
                     except Exception:
                         self.log.error('Caching set exception', exc_info=True, extra={'bundle': bundle.request.path, })
 
+            if not _refresh:
+                self._meta.cache.record(self._meta.resource_name, in_cache)
             return cached_bundle, in_cache
         return handle
 
@@ -705,7 +835,23 @@ class ChemblModelResource(ModelResource):
             else:
                 return ret
 
-            res = self.create_response(request, bundle)
+            if isinstance(bundle, dict) and isinstance(bundle.get(self._meta.collection_name), StreamedCollection):
+                res = self.create_streaming_response(request, bundle)
+            elif isinstance(bundle, dict) and isinstance(bundle.get(self._meta.collection_name), ColumnarRows):
+                res = self.create_columnar_response(request, bundle)
+            else:
+                res = self.create_response(request, bundle)
+            page_meta = bundle.get('page_meta') if isinstance(bundle, dict) else None
+            if page_meta and self.get_format_name(request) in FLAT_FORMATS + COLUMNAR_FORMATS:
+                # the flat and columnar formats have no envelope, the page meta data goes to the headers
+                if page_meta.get('total_count') is not None:
+                    res['X-Total-Count'] = page_meta['total_count']
+                    if page_meta.get('total_count_is_estimate'):
+                        res['X-Total-Count-Is-Estimate'] = 'true'
+                links = ['<{0}>; rel="{1}"'.format(page_meta[rel], rel) for rel in ('next', 'previous')
+                         if page_meta.get(rel)]
+                if links:
+                    res['Link'] = ', '.join(links)
             if WS_DEBUG:
                 end = time.time()
                 # Prevent the download of sdf/mol files on the browser
@@ -771,20 +917,140 @@ class ChemblModelResource(ModelResource):
             to_be_serialized, in_cache = f(bundle=base_bundle,
                                            **self.remove_api_resource_names(kwargs))
 
-            # Dehydrate the bundles in preparation for serialization.
-            bundles = []
-
-            for obj in to_be_serialized[self._meta.collection_name]:
+            def dehydrate(obj):
                 bundle = self.build_bundle(obj=obj, request=request)
-                bundles.append(self.full_dehydrate(bundle, for_list=for_list, for_search=for_search, **kwargs))
-
-            to_be_serialized[self._meta.collection_name] = bundles
+                bundle = self.full_dehydrate(bundle, for_list=for_list, for_search=for_search, **kwargs)
+                return self.alter_list_bundle_to_serialize(request, bundle)
+
+            # Dehydrate the bundles in preparation for serialization, or while streaming the response.
+            objects = to_be_serialized[self._meta.collection_name]
+            if self.get_streaming_format(request, objects):
+                collection = StreamedCollection(objects, dehydrate)
+                collection.prime()
+                to_be_serialized[self._meta.collection_name] = collection
+            else:
+                to_be_serialized[self._meta.collection_name] = [dehydrate(obj) for obj in objects]
             to_be_serialized = self.alter_list_data_to_serialize(request, to_be_serialized)
 
             return to_be_serialized, in_cache
 
         return handler
 
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def alter_list_bundle_to_serialize(self, request, bundle):
+        """
+        A hook to alter each bundle of a list page just before it gets serialized, the list may be streamed.
+        """
+        return bundle
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def get_streaming_format(self, request, objects=None):
+        """
+        Returns the format a list page of ``objects`` is streamed in, None if it should be serialized at once: pages
+        smaller than ``STREAMING_MIN_OBJECTS`` and formats the serializer can not stream are not.
+        """
+        min_objects = getattr(settings, 'STREAMING_MIN_OBJECTS', 0)
+        if not min_objects or (objects is not None and len(objects) < min_objects):
+            return None
+        format_name = self.get_format_name(request)
+        return format_name if hasattr(self._meta.serializer, 'iter_%s' % format_name) else None
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def get_format_name(self, request):
+        """
+        Short name of the format of the response, like ``json``.
+        """
+        desired_format = self.determine_format(request)
+        for short_format, long_format in self._meta.serializer.content_types.items():
+            if long_format == desired_format:
+                return short_format
+        return None
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def get_flat_columns(self, request):
+        """
+        Dotted names of the columns of the csv and tsv formats, from ``build_columns_info``, restricted to the fields
+        requested with ``only``.
+        """
+        columns = [column['data'] for column in self.build_columns_info()['columns']]
+        only = request.GET.get('only') if request else None
+        if only:
+            requested = set(field.strip() for field in only.split(','))
+            columns = [column for column in columns if column in requested or column.split('.')[0] in requested]
+        return columns
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def get_json_plan(self, plans=None):
+        """
+        Compiles the ``JSONPlan`` of the bundles of the resource, with the plans of its full related resources, once.
+        """
+        if plans is None:
+            if getattr(self, '_json_plan', None) is None:
+                self._json_plan = self.get_json_plan({})
+            return self._json_plan
+        plan = plans[type(self)] = JSONPlan(self._meta.serializer)
+        for field_name, field_object in list(self.fields.items()):
+            if not getattr(field_object, 'is_related', False):
+                plan.add_field(field_name, field_object.dehydrated_type)
+            elif field_object.full:
+                related_resource = field_object.get_related_resource(None)
+                related_plan = plans.get(type(related_resource)) or related_resource.get_json_plan(plans)
+                plan.add_related(field_name, related_plan)
+        return plan
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def get_serialization_options(self, request, data=None):
+        """
+        Options of the serializer for the resources: the columns of the csv, tsv and columnar formats and the
+        ``JSONPlan`` of the JSON based formats. Error responses are serialized without them.
+        """
+        if data is not None and not (isinstance(data, Bundle) or (isinstance(data, dict) and 'page_meta' in data)):
+            return {}
+        format_name = self.get_format_name(request)
+        if format_name in ('csv', 'tsv') + COLUMNAR_FORMATS:
+            return {'columns': self.get_flat_columns(request)}
+        if format_name in ('json', 'jsonp', 'ndjson'):
+            return {'json_plan': self.get_json_plan()}
+        return {}
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def serialize(self, request, data, format, options=None):
+        options = options or {}
+        options.update(self.get_serialization_options(request, data))
+        return super(ChemblModelResource, self).serialize(request, data, format, options)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def create_streaming_response(self, request, data):
+        """
+        Streams the serialized list page, its objects are dehydrated and serialized one at a time.
+        """
+        desired_format = self.determine_format(request)
+        format_name = self.get_streaming_format(request)
+        options = self.get_serialization_options(request)
+        serialize = getattr(self._meta.serializer, 'iter_%s' % format_name)
+        return StreamingHttpResponse(serialize(data, options), content_type=build_content_type(desired_format))
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def create_columnar_response(self, request, data):
+        """
+        Streams the rows of a list page as an Arrow IPC stream or a parquet file, one record batch at a time.
+        """
+        rows = data[self._meta.collection_name]
+        schema = rows.schema
+        batches = iter_record_batches(rows, schema, rows.dehydrated_types)
+        write = iter_arrow if self.get_format_name(request) == 'arrow' else iter_parquet
+        return StreamingHttpResponse(write(batches, schema),
+                                     content_type=build_content_type(self.determine_format(request)))
+
 # ----------------------------------------------------------------------------------------------------------------------
 
     def get_list_impl(self, request, base_bundle, **kwargs):
@@ -794,8 +1060,63 @@ class ChemblModelResource(ModelResource):
 # ----------------------------------------------------------------------------------------------------------------------
 
     def get_list(self, request, **kwargs):
+        if self.get_format_name(request) in COLUMNAR_FORMATS:
+            return self.response(self.get_columnar_list_impl)(request, **kwargs)
         return self.response(self.get_list_impl)(request, **kwargs)
 
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def get_columnar_fields(self, only=None):
+        """
+        Returns ``(column, lookup path, dehydrated type)`` of the fields stored in database columns, the fields of the
+        full related resources named with dots like ``build_columns_info`` does. Fields computed by a
+        ``dehydrate_<field>`` method or reached through a relation to many objects are left out.
+        """
+        columns = []
+        model = self._meta.object_class
+        core_fields = set([k for k, v in list(self.fields.items()) if not getattr(v, 'is_related', False)])
+        for field_name, field_object in list(self.fields.items()):
+            attribute = field_object.attribute
+            if not isinstance(attribute, str) or hasattr(self, 'dehydrate_%s' % field_name):
+                continue
+            if resolve_path(model, attribute) is None:
+                continue
+            if not getattr(field_object, 'is_related', False):
+                if field_object.use_in in ('all', 'list'):
+                    columns.append((field_name, attribute, field_object.dehydrated_type))
+            elif not getattr(field_object, 'is_m2m', False) and field_object.full:
+                related_resource = field_object.get_related_resource(None)
+                for column, path, dehydrated_type in related_resource.get_columnar_fields():
+                    if column in core_fields:
+                        continue
+                    columns.append((field_name + '.' + column, attribute + LOOKUP_SEP + path, dehydrated_type))
+        if only:
+            if isinstance(only, str):
+                only = only.split(',')
+            requested = set(field.strip() for field in list_flatten(only))
+            columns = [c for c in columns if c[0] in requested or c[0].split('.')[0] in requested]
+        return columns
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def get_columnar_list_impl(self, request, base_bundle, **kwargs):
+        """
+        List page in the arrow or parquet format. The page is read, cached and limited like the other formats, its
+        objects are written as record batches of the values of their database columns instead of being dehydrated.
+        """
+        format_name = self.get_format_name(request)
+        if pyarrow is None:
+            raise BadRequest('The {0} format is not available, pyarrow is not installed.'.format(format_name))
+        kwargs = self.remove_api_resource_names(kwargs)
+        columns = self.get_columnar_fields(kwargs.get('only'))
+        if not columns:
+            # resources without database columns go through the serializer
+            return self.get_list_impl(request, base_bundle, **kwargs)
+        to_be_serialized, in_cache = self.cached_obj_get_list(bundle=base_bundle, **kwargs)
+        objects = to_be_serialized[self._meta.collection_name]
+        to_be_serialized[self._meta.collection_name] = ColumnarRows(objects, columns, self._meta.object_class)
+        return to_be_serialized, in_cache
+
 # ----------------------------------------------------------------------------------------------------------------------
 
     def get_search_impl(self, request, base_bundle, **kwargs):
@@ -1237,13 +1558,36 @@ class ChemblModelResource(ModelResource):
 
         return self.error_response(request, data, response_class=response_class)
 
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def canonical_filters(self, filters):
+        return '|'.join(sorted(set(canonical_filter(key, value) for key, value in filters.items() if key != 'only')))
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def canonical_order(self, order_bits):
+        """
+        Drops repeated fields and maps an ascending ordering by the primary key to the default one.
+        """
+        bits = []
+        for bit in order_bits:
+            if bit and bit not in bits:
+                bits.append(bit)
+        model_meta = getattr(self._meta.object_class, '_meta', None)
+        if len(bits) == 1 and model_meta and bits[0] in self.fields and \
+                self.fields[bits[0]].attribute == model_meta.pk.name:
+            return []
+        return bits
+
 # ----------------------------------------------------------------------------------------------------------------------
 
     def _get_cache_args(self, *args, **kwargs):
+        """
+        Canonical request fingerprint, equivalent requests must give the same cache key.
+        """
         from collections import OrderedDict
 
         cache_ordered_dict = OrderedDict()
-        smooshed = []
 
         filters, _ = self.build_filters(kwargs)
 
@@ -1259,20 +1603,17 @@ class ChemblModelResource(ModelResource):
         limit = kwargs.get('limit', '') if ('list' in args or 'search' in args) else ''
         offset = kwargs.get('offset', '') if ('list' in args or 'search' in args) else ''
         query = kwargs.get('q', '') if 'search' in args else ''
-        only = kwargs.get('only', '')
-
-        for key, value in list(filters.items()):
-            smooshed.append("%s=%s" % (key, value))
+        only = canonical_only(kwargs.get('only', ''))
 
         cache_ordered_dict['api_name'] = self._meta.api_name
         cache_ordered_dict['resource_name'] = self._meta.resource_name
         cache_ordered_dict['args'] = '|'.join(args)
         cache_ordered_dict['limit'] = str(limit)
         cache_ordered_dict['offset'] = str(offset)
-        cache_ordered_dict['only'] = str(only)
-        cache_ordered_dict['query'] = query
-        cache_ordered_dict['order'] = '|'.join(order_bits)
-        cache_ordered_dict['filters'] = '|'.join(sorted(smooshed))
+        cache_ordered_dict['only'] = only
+        cache_ordered_dict['query'] = query.strip() if isinstance(query, str) else query
+        cache_ordered_dict['order'] = '|'.join(self.canonical_order(order_bits))
+        cache_ordered_dict['filters'] = self.canonical_filters(filters)
 
         return cache_ordered_dict
 
@@ -8,9 +8,125 @@ from simplejson import JSONDecodeError
 from tastypie.exceptions import BadRequest
 import urllib.parse
 import logging
+import csv
 import json
+import datetime
+from decimal import Decimal
+from json.encoder import encode_basestring
+from django.core.serializers.json import DjangoJSONEncoder
+from io import BytesIO
+from io import StringIO
 from lxml.etree import Element
+from lxml.etree import tostring
+from lxml.etree import xmlfile
+from chembl_webservices.core.columnar import pyarrow
 
+# size of the chunks yielded by the iter_<format> methods
+CHUNK_SIZE = 64 * 1024
+
+# formats writing one object per line, without the page_meta envelope
+FLAT_FORMATS = ('ndjson', 'csv', 'tsv')
+
+# written at the end of a streamed response when an error stops it
+STREAMING_ERROR = 'An error occurred while streaming the response, the list is incomplete.'
+
+log = logging.getLogger(__name__)
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+class StreamedCollection(object):
+    """
+    Objects of a list page that are dehydrated one at a time while the response is streamed, instead of all of them
+    before it is serialized.
+
+    The first object is dehydrated by ``prime``, before the response is started, so the errors common to the whole
+    page still get an error response. Once the status line is sent an error stops the iteration and is kept in
+    ``error_message``, the serializers write it at the end of the body.
+    """
+
+    def __init__(self, objects, dehydrate):
+        self.objects = objects
+        self.dehydrate = dehydrate
+        self.first = None
+        self.error_message = None
+
+    def __len__(self):
+        return len(self.objects)
+
+    def prime(self):
+        # reads the page once, a sliced queryset would run a query for the first object and another for the rest
+        self.objects = list(self.objects)
+        if self.objects and self.first is None:
+            self.first = self.dehydrate(self.objects[0])
+
+    def __iter__(self):
+        try:
+            for idx, obj in enumerate(self.objects):
+                yield self.first if idx == 0 and self.first is not None else self.dehydrate(obj)
+        except Exception:
+            log.error('Error while streaming a list page', exc_info=True)
+            self.error_message = STREAMING_ERROR
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+def encode_float(value):
+    # like the json module, which writes the special values the way JavaScript does
+    if value != value:
+        return 'NaN'
+    if value in (float('inf'), float('-inf')):
+        return 'Infinity' if value > 0 else '-Infinity'
+    return float.__repr__(value)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class JSONPlan(object):
+    """
+    What the JSON encoder knows about the bundles of a resource before it sees them. Each field has its encoded key
+    and, from the type it is dehydrated to, the type of its values and their encoder. Values of another type go
+    through ``to_simple`` like in ``to_json``, the values of the full related resources through their own plans.
+    """
+
+    def __init__(self, serializer):
+        self.encoders = {
+            'string': (str, encode_basestring),
+            'integer': (int, int.__repr__),
+            'float': (float, encode_float),
+            'decimal': (Decimal, lambda value: encode_basestring(str(value))),
+            'boolean': (bool, lambda value: 'true' if value else 'false'),
+            'datetime': (datetime.datetime, lambda value: encode_basestring(serializer.format_datetime(value))),
+            'date': (datetime.date, lambda value: encode_basestring(serializer.format_date(value))),
+            'time': (datetime.time, lambda value: encode_basestring(serializer.format_time(value))),
+        }
+        self.fields = {}
+        self.related = {}
+
+    def add_field(self, name, dehydrated_type):
+        value_type, encode = self.encoders.get(dehydrated_type, (None, None))
+        self.fields[name] = (encode_basestring(name) + ': ', value_type, encode)
+
+    def add_related(self, name, plan):
+        self.fields[name] = (encode_basestring(name) + ': ', None, None)
+        self.related[name] = plan
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+def buffered(chunks, size=CHUNK_SIZE):
+    """
+    Joins small text chunks into chunks of about ``size`` characters.
+    """
+    buf = []
+    length = 0
+    for chunk in chunks:
+        buf.append(chunk)
+        length += len(chunk)
+        if length >= size:
+            yield ''.join(buf)
+            buf = []
+            length = 0
+    if length:
+        yield ''.join(buf)
 
 # ----------------------------------------------------------------------------------------------------------------------
 
@@ -28,7 +144,7 @@ def valid_xml_char_ordinal(c):
 
 class ChEMBLApiSerializer(Serializer):
 
-    formats = ['xml', 'json', 'jsonp', 'yaml']
+    formats = ['xml', 'json', 'jsonp', 'yaml', 'ndjson', 'csv', 'tsv', 'arrow', 'parquet']
 
     content_types = {
         'json': 'application/json',
@@ -36,12 +152,18 @@ class ChEMBLApiSerializer(Serializer):
         'xml': 'application/xml',
         'yaml': 'text/yaml',
         'urlencode': 'application/x-www-form-urlencoded',
+        'ndjson': 'application/x-ndjson',
+        'csv': 'text/csv',
+        'tsv': 'text/tab-separated-values',
+        'arrow': 'application/vnd.apache.arrow.stream',
+        'parquet': 'application/vnd.apache.parquet',
     }
 
     def __init__(self, name=None, names=None):
         self.objName = name
         self.objNames = names
         self.log = logging.getLogger(__name__)
+        self.json_encoder = DjangoJSONEncoder(sort_keys=True, ensure_ascii=False)
         super(ChEMBLApiSerializer, self).__init__()
 
 # ----------------------------------------------------------------------------------------------------------------------
@@ -138,20 +260,20 @@ class ChEMBLApiSerializer(Serializer):
                 element = Element('objects')
             for item in data:
                 element.append(self.to_etree(item, options, name=new_name, depth=depth+1))
-                element[:] = sorted(element, key=lambda x: x.tag)
+            # items share the same tag, the stable sort only reorders lists mixing types
+            element[:] = sorted(element, key=lambda x: x.tag)
         elif isinstance(data, dict):
             if depth == 0:
                 element = Element(name or 'response')
             else:
                 element = Element(name or self.objName)
-            for (key, value) in list(data.items()):
-                element.append(self.to_etree(value, options, name=key, depth=depth+1))
-                element[:] = sorted(element, key=lambda x: x.tag)
+            # children are tagged with their keys, appending them in key order keeps the elements sorted
+            for key in sorted(data):
+                element.append(self.to_etree(data[key], options, name=key, depth=depth+1))
         elif isinstance(data, Bundle):
             element = Element(name or self.objName)
-            for field_name, field_object in list(data.data.items()):
-                element.append(self.to_etree(field_object, options, name=field_name, depth=depth+1))
-                element[:] = sorted(element, key=lambda x: x.tag)
+            for field_name in sorted(data.data):
+                element.append(self.to_etree(data.data[field_name], options, name=field_name, depth=depth+1))
         elif hasattr(data, 'dehydrated_type'):
             if getattr(data, 'dehydrated_type', None) == 'related' and data.is_m2m == False:
                 if data.full:
@@ -183,4 +305,268 @@ class ChEMBLApiSerializer(Serializer):
 
         return element
 
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def to_xml(self, data, options=None):
+        """
+        Given some Python data, produces XML output.
+        """
+        return b''.join(self.iter_xml(data, options or {}))
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def iter_xml(self, data, options=None):
+        """
+        Yields the XML document in chunks. The objects of the collections of a response are converted and written
+        one at a time, so the element tree of the whole page is never built.
+        """
+        if not isinstance(data, dict):
+            yield tostring(self.to_etree(data, options), xml_declaration=True, encoding='utf-8')
+            return
+        # the root element is the one to_etree gives a response
+        root = self.to_etree({}, options).tag
+        buf = BytesIO()
+        with xmlfile(buf, encoding='utf-8') as xf:
+            xf.write_declaration()
+            with xf.element(root):
+                for key in sorted(data):
+                    value = data[key]
+                    if not isinstance(value, (list, tuple, StreamedCollection)) or not len(value):
+                        xf.write(self.to_etree(value if not isinstance(value, StreamedCollection) else [], options,
+                                               name=key, depth=1))
+                        continue
+                    item_name = self.objNames.get(key) if self.objNames else key
+                    with xf.element(key):
+                        for item in value:
+                            xf.write(self.to_etree(item, options, name=item_name, depth=2))
+                            if buf.tell() > CHUNK_SIZE:
+                                xf.flush()
+                                yield buf.getvalue()
+                                buf.seek(0)
+                                buf.truncate()
+                    if getattr(value, 'error_message', None):
+                        xf.write(self.to_etree(value.error_message, options, name='error_message', depth=1))
+        yield buf.getvalue()
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def iter_json(self, data, options=None):
+        """
+        Yields the JSON document in chunks, the objects of streamed collections are converted one at a time.
+        """
+        options = options or {}
+        if not isinstance(data, dict):
+            yield self.to_json(data, options)
+            return
+        yield from buffered(self._json_chunks(data, options))
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _json_chunks(self, data, options):
+        # same separators and key order as to_json
+        yield '{'
+        for idx, key in enumerate(sorted(data)):
+            value = data[key]
+            yield '{0}{1}: '.format(', ' if idx else '', json.dumps(key, ensure_ascii=False))
+            if isinstance(value, StreamedCollection):
+                yield '['
+                for item_idx, item in enumerate(value):
+                    yield '{0}{1}'.format(', ' if item_idx else '', self.to_json(item, options))
+                yield ']'
+                if value.error_message:
+                    yield ', "error_message": {0}'.format(json.dumps(value.error_message, ensure_ascii=False))
+            else:
+                yield self.to_json(value, options)
+        yield '}'
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def to_json(self, data, options=None):
+        """
+        With the ``JSONPlan`` of the resource in ``options['json_plan']`` the bundles are encoded field by field,
+        without converting them with ``to_simple`` first. The output is the same.
+        """
+        options = options or {}
+        plan = options.get('json_plan')
+        if plan is None:
+            return super(ChEMBLApiSerializer, self).to_json(data, options)
+        return self.encode_json(data, plan, options)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def encode_json(self, data, plan, options):
+        data_type = type(data)
+        if plan is not None:
+            if data_type is Bundle:
+                return self.encode_bundle(data, plan, options)
+            if data_type in (list, tuple, StreamedCollection):
+                return '[' + ', '.join([self.encode_json(item, plan, options) for item in data]) + ']'
+            if data_type is dict and all(type(key) is str for key in data):
+                return '{' + ', '.join([encode_basestring(key) + ': ' + self.encode_json(data[key], plan, options)
+                                        for key in sorted(data)]) + '}'
+        return self.json_encoder.encode(self.to_simple(data, options))
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def encode_bundle(self, bundle, plan, options):
+        fields = plan.fields
+        parts = []
+        data = bundle.data
+        for key in sorted(data):
+            value = data[key]
+            field = fields.get(key)
+            if field is None:
+                parts.append(encode_basestring(key) + ': ' + self.encode_json(value, None, options))
+            elif value is None:
+                parts.append(field[0] + 'null')
+            elif type(value) is field[1]:
+                parts.append(field[0] + field[2](value))
+            else:
+                parts.append(field[0] + self.encode_json(value, plan.related.get(key), options))
+        return '{' + ', '.join(parts) + '}'
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def get_rows(self, data):
+        """
+        Returns the objects of a list response, or the object of a detail or error response, written one per line by
+        the flat formats.
+        """
+        if isinstance(data, dict):
+            for key, value in data.items():
+                if key != 'page_meta' and isinstance(value, (list, tuple, StreamedCollection)):
+                    return value
+        return [data]
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def flatten(self, data, prefix=''):
+        """
+        Flattens nested bundles and dictionaries into a dictionary with dotted keys, like ``build_columns_info``
+        names the columns of the related resources.
+        """
+        ret = {}
+        items = data.data.items() if isinstance(data, Bundle) else data.items()
+        for key, value in items:
+            if isinstance(value, (Bundle, dict)):
+                ret.update(self.flatten(value, prefix + key + '.'))
+            else:
+                ret[prefix + key] = value
+        return ret
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def to_cell(self, value, options=None):
+        value = self.to_simple(value, options)
+        if value is None:
+            return ''
+        if isinstance(value, (list, dict)):
+            return json.dumps(value, sort_keys=True, ensure_ascii=False)
+        return value
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def iter_ndjson(self, data, options=None):
+        """
+        Yields one JSON object per line.
+        """
+        options = options or {}
+        rows = self.get_rows(data)
+        yield from buffered(self.to_json(row, options) + '\n' for row in rows)
+        if getattr(rows, 'error_message', None):
+            yield self.to_json({'error_message': rows.error_message}, options) + '\n'
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def to_ndjson(self, data, options=None):
+        return ''.join(self.iter_ndjson(data, options))
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def iter_csv(self, data, options=None, delimiter=','):
+        """
+        Yields a header line and one line per object. ``options['columns']`` lists the dotted names of the columns,
+        by default the flattened fields of the first object.
+        """
+        options = options or {}
+        yield from buffered(self._csv_lines(data, options, delimiter))
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _csv_lines(self, data, options, delimiter):
+        out = StringIO()
+        writer = csv.writer(out, delimiter=delimiter)
+        columns = options.get('columns')
+        if columns is not None:
+            writer.writerow(columns)
+        rows = self.get_rows(data)
+        for row in rows:
+            flat = self.flatten(row) if isinstance(row, (Bundle, dict)) else {'value': row}
+            if columns is None:
+                columns = sorted(flat.keys())
+                writer.writerow(columns)
+            writer.writerow([self.to_cell(flat.get(column), options) for column in columns])
+            yield out.getvalue()
+            out.seek(0)
+            out.truncate()
+        if getattr(rows, 'error_message', None):
+            writer.writerow(['# ' + rows.error_message])
+        yield out.getvalue()
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def to_csv(self, data, options=None):
+        return ''.join(self.iter_csv(data, options))
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def iter_tsv(self, data, options=None):
+        return self.iter_csv(data, options, delimiter='\t')
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def to_tsv(self, data, options=None):
+        return ''.join(self.iter_tsv(data, options))
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def to_table(self, data, options=None):
+        """
+        Arrow table of the flattened rows written by the flat formats, with the column types pyarrow infers. List
+        endpoints write the columns of their objects instead, see ``ChemblModelResource.get_columnar_list_impl``.
+        """
+        if pyarrow is None:
+            raise BadRequest('The arrow and parquet formats are not available, pyarrow is not installed.')
+        options = options or {}
+        rows = [self.flatten(row) if isinstance(row, (Bundle, dict)) else {'value': row} for row in self.get_rows(data)]
+        columns = options.get('columns') or sorted(set(key for row in rows for key in row))
+        arrays = []
+        for column in columns:
+            values = [self.to_simple(row.get(column), options) for row in rows]
+            values = [json.dumps(value, sort_keys=True, ensure_ascii=False) if isinstance(value, (list, dict))
+                      else value for value in values]
+            try:
+                arrays.append(pyarrow.array(values))
+            except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError):
+                arrays.append(pyarrow.array([None if value is None else str(value) for value in values],
+                                            type=pyarrow.string()))
+        return pyarrow.Table.from_arrays(arrays, names=columns)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def to_arrow(self, data, options=None):
+        table = self.to_table(data, options)
+        sink = pyarrow.BufferOutputStream()
+        with pyarrow.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes()
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def to_parquet(self, data, options=None):
+        table = self.to_table(data, options)
+        sink = pyarrow.BufferOutputStream()
+        pyarrow.parquet.write_table(table, sink)
+        return sink.getvalue().to_pybytes()
+
 # ----------------------------------------------------------------------------------------------------------------------
@@ -1,5 +1,7 @@
 __author__ = 'mnowotka'
 
+import json
+
 # ----------------------------------------------------------------------------------------------------------------------
 
 NUMBER_FILTERS = ['exact', 'range', 'gt', 'gte', 'lt', 'lte', 'in', 'isnull']
@@ -46,4 +48,42 @@ def unpack_request_params(params):
             ret.append(x)
     return ret
 
-# ----------------------------------------------------------------------------------------------------------------------
\ No newline at end of file
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def canonical_only(only):
+    """
+    Sorted, deduplicated comma separated list of the fields requested with the ``only`` parameter.
+    """
+    if isinstance(only, str):
+        only = only.split(',')
+    fields = set(str(field).strip() for field in list_flatten(list(only or [])))
+    return ','.join(sorted(field for field in fields if field))
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+CASE_INSENSITIVE_LOOKUPS = ('__iexact', '__icontains', '__istartswith', '__iendswith')
+
+
+def canonical_filter(lookup, value):
+    """
+    Returns a ``lookup=value`` string that is the same for filters the query treats the same: ``__exact`` is implied,
+    ``__in`` values are split on commas like ``filter_value_to_python`` does, then sorted and deduplicated, and ASCII
+    values of case insensitive lookups are upper cased, as the database does. Values are otherwise kept as they are
+    and JSON encoded, so different values never share a key. Exact lookups stay case sensitive, even on ChEMBL ids.
+    """
+    if lookup.endswith('__exact'):
+        lookup = lookup[:-len('__exact')]
+    if lookup.endswith(CASE_INSENSITIVE_LOOKUPS) and isinstance(value, str) and value.isascii():
+        value = value.upper()
+    if lookup.endswith('__in'):
+        if isinstance(value, str):
+            value = value.split(',')
+        elif isinstance(value, (list, tuple)) and len(value) == 1 and isinstance(value[0], str):
+            value = value[0].split(',')
+        if isinstance(value, (list, tuple)):
+            value = sorted(set(str(x) for x in value))
+    return '{0}={1}'.format(lookup, json.dumps(value, sort_keys=True, default=str))
+
+# ----------------------------------------------------------------------------------------------------------------------
@@ -0,0 +1,122 @@
+# encoding: utf-8
+
+import copy
+import time
+import types
+from lxml.etree import Element
+from lxml.etree import tostring
+from tastypie.bundle import Bundle
+from tastypie.serializers import Serializer
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from django.test import RequestFactory
+from chembl_webservices.api_config import api
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def legacy_to_etree(self, data, options=None, name=None, depth=0):
+    """
+    XML conversion as it was before the children of an element were sorted once, kept to benchmark against.
+    """
+    if isinstance(data, (list, tuple)):
+        new_name = None
+        if name:
+            element = Element(name)
+            new_name = self.objNames.get(name) if self.objNames else name
+        else:
+            element = Element('objects')
+        for item in data:
+            element.append(self.to_etree(item, options, name=new_name, depth=depth + 1))
+            element[:] = sorted(element, key=lambda x: x.tag)
+    elif isinstance(data, dict):
+        element = Element(name or ('response' if depth == 0 else self.objName))
+        for (key, value) in list(data.items()):
+            element.append(self.to_etree(value, options, name=key, depth=depth + 1))
+            element[:] = sorted(element, key=lambda x: x.tag)
+    elif isinstance(data, Bundle):
+        element = Element(name or self.objName)
+        for field_name, field_object in list(data.data.items()):
+            element.append(self.to_etree(field_object, options, name=field_name, depth=depth + 1))
+            element[:] = sorted(element, key=lambda x: x.tag)
+    else:
+        return type(self).to_etree(self, data, options, name, depth)
+    return element
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class Command(BaseCommand):
+    help = "Measures the CPU time spent serializing list pages to XML or JSON, compared to the previous serializers."
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'resources', nargs='*', default=['molecule', 'activity'],
+            help='Names of the resources whose first list page is serialized.'
+        )
+        parser.add_argument(
+            '-l', '--limit', type=int, default=1000,
+            help='Number of objects in the page.'
+        )
+        parser.add_argument(
+            '-f', '--format', choices=['xml', 'json'], default='xml',
+            help='Format the pages are serialized to, JSON is compared to the generic tastypie encoder.'
+        )
+        parser.add_argument(
+            '-r', '--repeat', type=int, default=5,
+            help='Number of times each page is serialized, the fastest run is reported.'
+        )
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def handle(self, **options):
+        self.stdout.write('{0:<30} {1:>7} {2:>12} {3:>12} {4:>8}  {5}'.format(
+            'resource', 'objects', 'before ms', 'after ms', 'speedup', 'output'))
+        for resource_name in options['resources']:
+            try:
+                resource = api.canonical_resource_for(resource_name)
+            except Exception:
+                raise CommandError('Unknown resource: {0}'.format(resource_name))
+            data = self.get_page(resource, options['limit'])
+            serializer = resource._meta.serializer
+            if options['format'] == 'json':
+                json_plan = resource.get_json_plan()
+                legacy_serialize = lambda: Serializer.to_json(serializer, data, {})
+                serialize = lambda: serializer.to_json(data, {'json_plan': json_plan})
+            else:
+                legacy = copy.copy(serializer)
+                legacy.to_etree = types.MethodType(legacy_to_etree, legacy)
+                legacy_serialize = lambda: tostring(legacy.to_etree(data, {}), xml_declaration=True, encoding='utf-8')
+                serialize = lambda: serializer.to_xml(data, {})
+
+            before, legacy_output = self.measure(legacy_serialize, options['repeat'])
+            after, output = self.measure(serialize, options['repeat'])
+            self.stdout.write('{0:<30} {1:>7} {2:>12.1f} {3:>12.1f} {4:>7.1f}x  {5}'.format(
+                resource_name, len(data.get(resource._meta.collection_name, [])), before * 1000, after * 1000,
+                before / after if after else 0, 'identical' if output == legacy_output else 'DIFFERENT'))
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def get_page(self, resource, limit):
+        request = RequestFactory().get('/', {'limit': limit})
+        request.format = 'json'
+        data, _ = resource.get_list_impl(request, resource.build_bundle(request=request), limit=str(limit))
+        # large pages are dehydrated while streamed, the benchmark serializes the dehydrated bundles
+        data[resource._meta.collection_name] = list(data[resource._meta.collection_name])
+        return data
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def measure(self, serialize, repeat):
+        best = None
+        output = None
+        for _ in range(max(repeat, 1)):
+            start = time.process_time()
+            output = serialize()
+            elapsed = time.process_time() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best, output
+
+# ----------------------------------------------------------------------------------------------------------------------
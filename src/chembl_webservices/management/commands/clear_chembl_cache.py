@@ -0,0 +1,64 @@
+# encoding: utf-8
+
+from django.core.cache import caches
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class Command(BaseCommand):
+    help = "Drops the cache collections of previous ChEMBL releases, or the whole cache."
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '-c', '--cache', dest='cache_name', default='default',
+            help='Name of the cache in the CACHES setting.'
+        )
+        parser.add_argument(
+            '-k', '--keep', type=int, default=2,
+            help='Number of most recent namespaces to keep, the previous one serves stale values while the current '
+                 'one is warmed up.'
+        )
+        parser.add_argument(
+            '--all', action='store_true', dest='clear_all', default=False,
+            help='Clear the whole cache, including the current namespace.'
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true', dest='dry_run', default=False,
+            help='Only print what would be dropped.'
+        )
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def handle(self, **options):
+        cache = caches[options['cache_name']]
+        verbosity = int(options.get('verbosity', 1))
+        dry_run = options['dry_run']
+
+        if not hasattr(cache, 'namespaces'):
+            if not options['clear_all']:
+                raise CommandError('Cache {0} has no namespaces, use --all to clear it.'.format(options['cache_name']))
+            if not dry_run:
+                cache.clear()
+            return
+
+        namespaces = cache.namespaces()
+        to_drop = namespaces if options['clear_all'] else namespaces[max(options['keep'], 1):]
+        if not options['clear_all']:
+            current = cache.current_namespace()
+            to_drop = [namespace for namespace in to_drop if namespace['_id'] != current]
+        for namespace in to_drop:
+            if verbosity >= 1:
+                self.stdout.write('Dropping namespace {0} (collection {1}, created {2})'.format(
+                    namespace['_id'], namespace.get('collection'), namespace.get('created')))
+            if not dry_run:
+                cache.drop_namespace(namespace['_id'])
+        if options['clear_all'] and not dry_run:
+            cache.clear()
+        if verbosity >= 1:
+            self.stdout.write('Dropped {0} of {1} namespaces.'.format(len(to_drop), len(namespaces)))
+
+# ----------------------------------------------------------------------------------------------------------------------
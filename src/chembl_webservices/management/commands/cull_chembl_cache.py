@@ -0,0 +1,50 @@
+# encoding: utf-8
+
+from django.core.cache import caches
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class Command(BaseCommand):
+    help = "Removes the cache entries closest to expiry while the cache holds more than MAX_ENTRIES documents. " \
+           "Meant to run periodically from a single job, expired entries are removed by Mongo itself."
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '-c', '--cache', dest='cache_name', default='default',
+            help='Name of the cache in the CACHES setting.'
+        )
+        parser.add_argument(
+            '-m', '--max-documents', type=int, default=None,
+            help='Maximum number of entries removed by each pass, CULL_MAX_DOCUMENTS of the cache by default.'
+        )
+        parser.add_argument(
+            '-p', '--passes', type=int, default=1,
+            help='Maximum number of passes, the command stops earlier once the cache is under MAX_ENTRIES.'
+        )
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def handle(self, **options):
+        cache = caches[options['cache_name']]
+        verbosity = int(options.get('verbosity', 1))
+
+        if not hasattr(cache, 'cull'):
+            raise CommandError('Cache {0} can not be culled.'.format(options['cache_name']))
+
+        total = 0
+        for _ in range(max(options['passes'], 1)):
+            deleted = cache.cull(options['max_documents'])
+            total += deleted
+            if verbosity >= 2:
+                self.stdout.write('Removed {0} documents'.format(deleted))
+            if not deleted:
+                break
+        if verbosity >= 1:
+            self.stdout.write('Removed {0} documents from the cache.'.format(total))
+
+# ----------------------------------------------------------------------------------------------------------------------
@@ -0,0 +1,43 @@
+# encoding: utf-8
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from chembl_webservices.core.fpsim2_helper import export_fps
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class Command(BaseCommand):
+    help = "Writes the fingerprints of FPSIM2_FILE_PATH to the .npy file FPSIM2_MMAP_PATH, mapped in memory and shared " \
+           "by the web service workers. Meant to run on deployment, once the FPSim2 file is downloaded."
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '-o', '--output', dest='mmap_path', default=None,
+            help='Path of the .npy file, FPSIM2_MMAP_PATH by default.'
+        )
+        parser.add_argument(
+            '-f', '--force', action='store_true', default=False,
+            help='Writes the file even if it is newer than the FPSim2 file.'
+        )
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def handle(self, **options):
+        mmap_path = options['mmap_path'] or getattr(settings, 'FPSIM2_MMAP_PATH', None)
+        verbosity = int(options.get('verbosity', 1))
+
+        if not mmap_path:
+            raise CommandError('No output file, set FPSIM2_MMAP_PATH or use --output.')
+
+        written = export_fps(settings.FPSIM2_FILE_PATH, mmap_path, force=options['force'])
+        if verbosity >= 1:
+            if written:
+                self.stdout.write('Fingerprints written to {0}.'.format(mmap_path))
+            else:
+                self.stdout.write('{0} is up to date.'.format(mmap_path))
+
+# ----------------------------------------------------------------------------------------------------------------------
@@ -0,0 +1,217 @@
+# encoding: utf-8
+
+import re
+import sys
+import json
+import time
+import queue
+import threading
+from collections import Counter
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.db import connections
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from django.test import RequestFactory
+from django.urls import resolve
+from django.urls import Resolver404
+from chembl_webservices.core.meta import ChemblResourceMeta
+
+# request line of the gunicorn (common/combined) access log format
+LOG_LINE_PATTERN = re.compile(r'"(?:GET|HEAD) (\S+) HTTP/[\d.]+"')
+URL_KEYS = ('url', 'path', 'request')
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def parse_url(line):
+    """
+    Returns the path and query of the URL in a line of a URL list, a gunicorn access log or a JSON lines file with
+    an 'url', 'path' or 'request' field, None if there is none.
+    """
+    line = line.strip()
+    if not line or line.startswith('#'):
+        return None
+    if line.startswith('{'):
+        try:
+            record = json.loads(line)
+        except ValueError:
+            return None
+        line = next((record[key] for key in URL_KEYS if isinstance(record.get(key), str)), None)
+        if not line:
+            return None
+        if ' ' in line:
+            line = '"{0}"'.format(line)
+    match = LOG_LINE_PATTERN.search(line)
+    if match:
+        line = match.group(1)
+    elif ' ' in line:
+        return None
+    url = urlsplit(line)
+    if not url.path.startswith(settings.SERVER_BASE_PATH):
+        return None
+    return url.path + ('?' + url.query if url.query else '')
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def default_host():
+    """
+    First host of ALLOWED_HOSTS without wildcards, the replayed requests are checked against it like real ones.
+    """
+    hosts = settings.ALLOWED_HOSTS
+    if isinstance(hosts, str):
+        hosts = [hosts]
+    for host in hosts:
+        if host and '*' not in host:
+            return host.lstrip('.')
+    return 'localhost'
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    idx = min(len(sorted_values) - 1, max(0, int(round(pct / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[idx]
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class Command(BaseCommand):
+    help = "Warms up the detail, list and image caches replaying URLs from URL lists or access logs through the " \
+           "resources, without HTTP."
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'files', nargs='+',
+            help='URL lists, gunicorn access logs or JSON lines files with an url field, "-" reads stdin.'
+        )
+        parser.add_argument(
+            '-t', '--threads', type=int, default=4,
+            help='Number of requests replayed in parallel.'
+        )
+        parser.add_argument(
+            '--top', type=int, default=None,
+            help='Only replay the N most requested URLs.'
+        )
+        parser.add_argument(
+            '--keep-duplicates', action='store_true', dest='keep_duplicates', default=False,
+            help='Replay every occurrence of a URL instead of the distinct URLs.'
+        )
+        parser.add_argument(
+            '--host', default=None,
+            help='Host of the replayed requests, the first host of ALLOWED_HOSTS without wildcards by default.'
+        )
+        parser.add_argument(
+            '--report-every', type=int, default=500, dest='report_every',
+            help='Print progress every N requests.'
+        )
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def handle(self, **options):
+        urls = self.read_urls(options['files'])
+        if not urls:
+            raise CommandError('No URLs under {0} found.'.format(settings.SERVER_BASE_PATH))
+        counts = Counter(urls)
+        if options['top']:
+            urls = [url for url, _ in counts.most_common(options['top'])]
+        elif not options['keep_duplicates']:
+            urls = [url for url, _ in counts.most_common()]
+        self.stdout.write('Replaying {0} requests ({1} distinct URLs) with {2} threads'.format(
+            len(urls), len(counts), options['threads']))
+
+        factory = RequestFactory(HTTP_HOST=options['host'] or default_host())
+        pending = queue.Queue()
+        for url in urls:
+            pending.put(url)
+        results = queue.Queue()
+        workers = [threading.Thread(target=self.replay_pending, args=(factory, pending, results), daemon=True)
+                   for _ in range(max(options['threads'], 1))]
+        latencies = defaultdict(list)
+        statuses = defaultdict(Counter)
+        start = time.time()
+        for worker in workers:
+            worker.start()
+        for done in range(1, len(urls) + 1):
+            endpoint, status, elapsed = results.get()
+            latencies[endpoint].append(elapsed)
+            statuses[endpoint][status] += 1
+            if options['report_every'] and done % options['report_every'] == 0:
+                self.stdout.write('{0}/{1} requests, {2:.1f} req/s'.format(
+                    done, len(urls), done / (time.time() - start)))
+        for worker in workers:
+            worker.join()
+        done = len(urls)
+        # pages queued by the write-behind thread would be lost when the command exits
+        ChemblResourceMeta.cache.flush()
+
+        total_time = time.time() - start
+        self.stdout.write('Replayed {0} requests in {1:.1f}s, {2:.1f} req/s'.format(
+            done, total_time, done / total_time if total_time else 0))
+        self.stdout.write('{0:<40} {1:>7} {2:>9} {3:>9} {4:>9} {5:>9}  {6}'.format(
+            'endpoint', 'count', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms', 'statuses'))
+        for endpoint in sorted(latencies, key=lambda x: -len(latencies[x])):
+            values = sorted(latencies[endpoint])
+            self.stdout.write('{0:<40} {1:>7} {2:>9.1f} {3:>9.1f} {4:>9.1f} {5:>9.1f}  {6}'.format(
+                endpoint, len(values), percentile(values, 50) * 1000, percentile(values, 90) * 1000,
+                percentile(values, 99) * 1000, values[-1] * 1000,
+                ' '.join('{0}:{1}'.format(k, v) for k, v in sorted(statuses[endpoint].items(), key=str))))
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def read_urls(self, files):
+        urls = []
+        for file_name in files:
+            lines = sys.stdin if file_name == '-' else open(file_name, encoding='utf-8', errors='replace')
+            for line in lines:
+                url = parse_url(line)
+                if url:
+                    urls.append(url)
+            if lines is not sys.stdin:
+                lines.close()
+        return urls
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def replay_pending(self, factory, pending, results):
+        try:
+            while True:
+                try:
+                    url = pending.get_nowait()
+                except queue.Empty:
+                    return
+                results.put(self.replay(factory, url))
+        finally:
+            # every thread opens its own database connections
+            connections.close_all()
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def replay(self, factory, url):
+        path = url.split('?', 1)[0]
+        try:
+            match = resolve(path)
+        except Resolver404:
+            return 'unresolved', 404, 0.0
+        endpoint = '{0}:{1}'.format(match.kwargs.get('resource_name', ''), match.url_name)
+        start = time.time()
+        try:
+            response = match.func(factory.get(url), *match.args, **match.kwargs)
+            status = response.status_code
+            # streamed pages are only computed, and cached, while their content is read
+            if response.streaming:
+                for _ in response.streaming_content:
+                    pass
+        except Exception as e:
+            self.stderr.write('{0}: {1}'.format(url, e))
+            status = 'error'
+        return endpoint, status, time.time() - start
+
+# ----------------------------------------------------------------------------------------------------------------------
@@ -57,20 +57,8 @@ class ChemblIdLookupResource(ChemblModelResource):
 
 # ----------------------------------------------------------------------------------------------------------------------
 
-    def alter_list_data_to_serialize(self, request, data):
-        """
-        A hook to alter list data just before it gets serialized & sent to the user.
-
-        Useful for restructuring/renaming aspects of the what's going to be
-        sent.
-
-        Should accommodate for a list of objects, generally also including
-        meta data.
-        """
-        bundles = data['chembl_id_lookups']
-        for idx, bundle in enumerate(bundles):
-            bundles[idx] = self.alter_detail_data_to_serialize(request, bundle)
-        return data
+    def alter_list_bundle_to_serialize(self, request, bundle):
+        return self.alter_detail_data_to_serialize(request, bundle)
 
 # ----------------------------------------------------------------------------------------------------------------------
 
@@ -146,7 +134,7 @@ class ChemblIdLookupResource(ChemblModelResource):
         """
         return [
             url(r"^(?P<resource_name>%s)/search%s$" % (self._meta.resource_name, trailing_slash()), self.wrap_view('get_search'), name="api_get_search"),
-            url(r"^(?P<resource_name>%s)/search\.(?P<format>xml|json|jsonp|yaml)$" % self._meta.resource_name, self.wrap_view('get_search'), name="api_get_search"),
+            url(r"^(?P<resource_name>%s)/search\.(?P<format>xml|json|jsonp|yaml|ndjson|csv|tsv|arrow|parquet)$" % self._meta.resource_name, self.wrap_view('get_search'), name="api_get_search"),
             url(r"^(?P<resource_name>%s)\.(?P<format>\w+)$" % self._meta.resource_name, self.wrap_view('dispatch_list'), name="api_dispatch_list"),
             url(r"^(?P<resource_name>%s)/schema\.(?P<format>\w+)$" % self._meta.resource_name, self.wrap_view('get_schema'), name="api_get_schema"),
             url(r"^(?P<resource_name>%s)/datatables\.(?P<format>\w+)$" % self._meta.resource_name, self.wrap_view('get_datatables'), name="api_get_datatables"),
@@ -85,20 +85,8 @@ class DrugsResource(ChemblModelResource):
 # ----------------------------------------------------------------------------------------------------------------------
 
 
-    def alter_list_data_to_serialize(self, request, data):
-        """
-        A hook to alter list data just before it gets serialized & sent to the user.
-
-        Useful for restructuring/renaming aspects of the what's going to be
-        sent.
-
-        Should accommodate for a list of objects, generally also including
-        meta data.
-        """
-        bundles = data['drugs']
-        for idx, bundle in enumerate(bundles):
-            bundles[idx] = self.alter_detail_data_to_serialize(request, bundle)
-        return data
+    def alter_list_bundle_to_serialize(self, request, bundle):
+        return self.alter_detail_data_to_serialize(request, bundle)
 
 # ----------------------------------------------------------------------------------------------------------------------
 
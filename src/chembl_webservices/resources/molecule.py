@@ -8,6 +8,8 @@ from django.conf.urls import url
 from chembl_webservices.core.utils import NUMBER_FILTERS, CHAR_FILTERS, FLAG_FILTERS
 from chembl_webservices.core.resource import ChemblModelResource
 from chembl_webservices.core.serialization import ChEMBLApiSerializer
+from chembl_webservices.core.serialization import StreamedCollection
+from chembl_webservices.core.serialization import buffered
 from chembl_webservices.core.meta import ChemblResourceMeta
 from django.core.exceptions import ObjectDoesNotExist
 from tastypie.exceptions import Unauthorized
@@ -42,12 +44,17 @@ monkeypatch_tastypie_field()
 
 available_fields = [f.name for f in MoleculeDictionary._meta.fields]
 
+NO_STRUCTURE_ERROR = 'Molecule has no structure records.'
+
+# related resources whose fields can be written as SD tags of the SDF records, with sdf_tags=molecule_properties
+SDF_TAG_FIELDS = ('molecule_properties',)
+
 # ----------------------------------------------------------------------------------------------------------------------
 
 
 class MoleculeSerializer(ChEMBLApiSerializer):
 
-    formats = ['xml', 'json', 'jsonp', 'yaml', 'mol', 'sdf']
+    formats = ['xml', 'json', 'jsonp', 'yaml', 'ndjson', 'csv', 'tsv', 'arrow', 'parquet', 'mol', 'sdf']
 
     content_types = {
         'json': 'application/json',
@@ -55,6 +62,11 @@ class MoleculeSerializer(ChEMBLApiSerializer):
         'xml': 'application/xml',
         'yaml': 'text/yaml',
         'urlencode': 'application/x-www-form-urlencoded',
+        'ndjson': 'application/x-ndjson',
+        'csv': 'text/csv',
+        'tsv': 'text/tab-separated-values',
+        'arrow': 'application/vnd.apache.arrow.stream',
+        'parquet': 'application/vnd.apache.parquet',
         'mol': 'chemical/x-mdl-molfile',
         'sdf': 'chemical/x-mdl-sdfile',
     }
@@ -62,47 +74,81 @@ class MoleculeSerializer(ChEMBLApiSerializer):
 # ----------------------------------------------------------------------------------------------------------------------
 
     def to_sdf(self, bundle_or_dict, options=None, sdf_properties=True):
-        no_struct_error_msg = 'Molecule has no structure records.'
+        return ''.join(self.iter_sdf(bundle_or_dict, options, sdf_properties))
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def to_mol(self, bundle_or_dict, options=None):
+        return self.to_sdf(bundle_or_dict, options, sdf_properties=False)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def iter_sdf(self, bundle_or_dict, options=None, sdf_properties=True):
+        """
+        Yields the records of a list page or of a set of molecules followed by ``$$$$``, or the record of a single
+        molecule. ``options['sdf_tags']`` lists the related fields whose values are written as SD tags too.
+        """
         if isinstance(bundle_or_dict, dict):
             data_dict = bundle_or_dict
             # if the dict include error_message data is an exception raised and should only return its text
-            if 'error_message' in data_dict and data_dict['error_message'] == no_struct_error_msg:
-                return no_struct_error_msg
-            if 'page_meta' in data_dict and 'molecules' in data_dict:
-                ret_text = ''
-                for molecule_bundle in data_dict['molecules']:
-                    ret_text += self.to_sdf(molecule_bundle, options, sdf_properties)+ '$$$$\n'
-                return ret_text
+            if 'error_message' in data_dict and data_dict['error_message'] == NO_STRUCTURE_ERROR:
+                yield NO_STRUCTURE_ERROR
+            elif isinstance(data_dict.get('molecules'), StreamedCollection):
+                # the response is already started, errors are written in place of the records
+                molecules = data_dict['molecules']
+                yield from buffered(self.streamed_sdf_record(molecule_bundle, options, sdf_properties)
+                                    for molecule_bundle in molecules)
+                if molecules.error_message:
+                    yield molecules.error_message
+            elif 'molecules' in data_dict:
+                yield from buffered(self.sdf_record(molecule_bundle, options, sdf_properties) + '$$$$\n'
+                                    for molecule_bundle in data_dict['molecules'])
             else:
                 raise Exception('Error, unexpected dictionary received with keys: {0}'.format(data_dict.keys()))
         elif isinstance(bundle_or_dict, Bundle):
-            data_bundle = bundle_or_dict
-            molecule_structures = data_bundle.data.get('molecule_structures')
-            if not molecule_structures:
-                raise NotFound(no_struct_error_msg)
-            molecule_sdf = molecule_structures.data.get('molfile', None)
-            if not molecule_sdf:
-                raise NotFound(no_struct_error_msg)
-            ret = molecule_sdf.rstrip() + '\n'
-            if sdf_properties:
-                if not options or not 'no_chembl_id' in options:
-                    ret += '> <chembl_id>\n{0}\n\n'.format(data_bundle.data.get('molecule_chembl_id'))
-                if options and 'chebi_par_id' in options:
-                    chebi_par_id = data_bundle.data.get('chebi_par_id')
-                    chebi_id = 'CHEBI:{0}'
-                    if chebi_par_id:
-                        chebi_id = chebi_id.format(chebi_par_id)
-                    else:
-                        chebi_id = 'Unknown'
-                    ret += '> <chebi_id>\n{0}\n\n'.format(chebi_id)
-            return ret
+            yield self.sdf_record(bundle_or_dict, options, sdf_properties)
         else:
             raise Exception('Error, unexpected type received: {0}'.format(type(bundle_or_dict)))
 
 # ----------------------------------------------------------------------------------------------------------------------
 
-    def to_mol(self, bundle_or_dict, options=None):
-        return self.to_sdf(bundle_or_dict, options, sdf_properties=False)
+    def iter_mol(self, data, options=None):
+        return self.iter_sdf(data, options, sdf_properties=False)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def streamed_sdf_record(self, data_bundle, options=None, sdf_properties=True):
+        try:
+            return self.sdf_record(data_bundle, options, sdf_properties) + '$$$$\n'
+        except NotFound as e:
+            return '{0}\n$$$$\n'.format(e)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def sdf_record(self, data_bundle, options=None, sdf_properties=True):
+        options = options or {}
+        molecule_structures = data_bundle.data.get('molecule_structures')
+        if not molecule_structures:
+            raise NotFound(NO_STRUCTURE_ERROR)
+        molecule_sdf = molecule_structures.data.get('molfile', None)
+        if not molecule_sdf:
+            raise NotFound(NO_STRUCTURE_ERROR)
+        parts = [molecule_sdf.rstrip(), '\n']
+        if sdf_properties:
+            if 'no_chembl_id' not in options:
+                parts.append('> <chembl_id>\n{0}\n\n'.format(data_bundle.data.get('molecule_chembl_id')))
+            if 'chebi_par_id' in options:
+                chebi_par_id = data_bundle.data.get('chebi_par_id')
+                chebi_id = 'CHEBI:{0}'.format(chebi_par_id) if chebi_par_id else 'Unknown'
+                parts.append('> <chebi_id>\n{0}\n\n'.format(chebi_id))
+            for field_name in options.get('sdf_tags', ()):
+                # the related objects are part of the bundle already
+                related = data_bundle.data.get(field_name)
+                if isinstance(related, Bundle):
+                    for tag, value in related.data.items():
+                        if value is not None and tag != 'resource_uri':
+                            parts.append('> <{0}>\n{1}\n\n'.format(tag, self.to_simple(value, options)))
+        return ''.join(parts)
 
 # ----------------------------------------------------------------------------------------------------------------------
 
@@ -430,23 +476,23 @@ _SMILES_.
 
         return [
             url(r"^(?P<resource_name>%s)/search%s$" % (self._meta.resource_name, trailing_slash()), self.wrap_view('get_search'), name="api_get_search"),
-            url(r"^(?P<resource_name>%s)/search\.(?P<format>xml|json|jsonp|yaml|sdf|mol)$" % self._meta.resource_name, self.wrap_view('get_search'), name="api_get_search"),
+            url(r"^(?P<resource_name>%s)/search\.(?P<format>xml|json|jsonp|yaml|ndjson|csv|tsv|arrow|parquet|sdf|mol)$" % self._meta.resource_name, self.wrap_view('get_search'), name="api_get_search"),
             url(r"^(?P<resource_name>%s)%s$" % (self._meta.resource_name, trailing_slash()), self.wrap_view('dispatch_list'), name="api_dispatch_list"),
-            url(r"^(?P<resource_name>%s)\.(?P<format>xml|json|jsonp|yaml|sdf|mol)$" % self._meta.resource_name, self.wrap_view('dispatch_list'), name="api_dispatch_list"),
+            url(r"^(?P<resource_name>%s)\.(?P<format>xml|json|jsonp|yaml|ndjson|csv|tsv|arrow|parquet|sdf|mol)$" % self._meta.resource_name, self.wrap_view('dispatch_list'), name="api_dispatch_list"),
             url(r"^(?P<resource_name>%s)/schema%s$" % (self._meta.resource_name, trailing_slash()), self.wrap_view('get_schema'), name="api_get_schema"),
-            url(r"^(?P<resource_name>%s)/schema\.(?P<format>xml|json|jsonp|yaml|sdf|mol)$" % self._meta.resource_name, self.wrap_view('get_schema'), name="api_get_schema"),
+            url(r"^(?P<resource_name>%s)/schema\.(?P<format>xml|json|jsonp|yaml|ndjson|csv|tsv|arrow|parquet|sdf|mol)$" % self._meta.resource_name, self.wrap_view('get_schema'), name="api_get_schema"),
             url(r"^(?P<resource_name>%s)/datatables\.(?P<format>\w+)$" % self._meta.resource_name, self.wrap_view('get_datatables'), name="api_get_datatables"),
             url(r"^(?P<resource_name>%s)/set/(?P<chembl_id_list>[Cc][Hh][Ee][Mm][Bb][Ll]\d[\d]*(;[Cc][Hh][Ee][Mm][Bb][Ll]\d[\d]*)*)%s$" % (self._meta.resource_name, trailing_slash()), self.wrap_view('get_multiple'), name="api_get_multiple"),
-            url(r"^(?P<resource_name>%s)/set/(?P<chembl_id_list>[Cc][Hh][Ee][Mm][Bb][Ll]\d[\d]*(;[Cc][Hh][Ee][Mm][Bb][Ll]\d[\d]*)*)\.(?P<format>xml|json|jsonp|yaml|sdf|mol)$" % self._meta.resource_name, self.wrap_view('get_multiple'), name="api_get_multiple"),
+            url(r"^(?P<resource_name>%s)/set/(?P<chembl_id_list>[Cc][Hh][Ee][Mm][Bb][Ll]\d[\d]*(;[Cc][Hh][Ee][Mm][Bb][Ll]\d[\d]*)*)\.(?P<format>xml|json|jsonp|yaml|ndjson|csv|tsv|arrow|parquet|sdf|mol)$" % self._meta.resource_name, self.wrap_view('get_multiple'), name="api_get_multiple"),
             url(r"^(?P<resource_name>%s)/set/(?P<molecule_structures__standard_inchi_key_list>[A-Z]{14}-[A-Z]{10}-[A-Z](;[A-Z]{14}-[A-Z]{10}-[A-Z])*)%s$" % (self._meta.resource_name, trailing_slash()), self.wrap_view('get_multiple'), name="api_get_multiple"),
-            url(r"^(?P<resource_name>%s)/set/(?P<molecule_structures__standard_inchi_key_list>[A-Z]{14}-[A-Z]{10}-[A-Z](;[A-Z]{14}-[A-Z]{10}-[A-Z])*)\.(?P<format>xml|json|jsonp|yaml|sdf|mol)$" % self._meta.resource_name, self.wrap_view('get_multiple'), name="api_get_multiple"),
+            url(r"^(?P<resource_name>%s)/set/(?P<molecule_structures__standard_inchi_key_list>[A-Z]{14}-[A-Z]{10}-[A-Z](;[A-Z]{14}-[A-Z]{10}-[A-Z])*)\.(?P<format>xml|json|jsonp|yaml|ndjson|csv|tsv|arrow|parquet|sdf|mol)$" % self._meta.resource_name, self.wrap_view('get_multiple'), name="api_get_multiple"),
             url(r"^(?P<resource_name>%s)/set/(?P<molecule_structures__canonical_smiles_list>[^jx]+(;[^jx]+)*)%s$" % (self._meta.resource_name, trailing_slash()), self.wrap_view('get_multiple'), name="api_get_multiple"),
-            url(r"^(?P<resource_name>%s)/set/(?P<molecule_structures__canonical_smiles_list>[^jx]+(;[^jx]+)*)\.(?P<format>xml|json|jsonp|yaml|sdf|mol)$" % self._meta.resource_name, self.wrap_view('get_multiple'), name="api_get_multiple"),
-            url(r"^(?P<resource_name>%s)/(?P<chembl_id>[Cc][Hh][Ee][Mm][Bb][Ll]\d[\d]*)\.(?P<format>xml|json|jsonp|yaml|sdf|mol)$" % self._meta.resource_name, self.wrap_view('dispatch_detail'), name="api_dispatch_detail"),
+            url(r"^(?P<resource_name>%s)/set/(?P<molecule_structures__canonical_smiles_list>[^jx]+(;[^jx]+)*)\.(?P<format>xml|json|jsonp|yaml|ndjson|csv|tsv|arrow|parquet|sdf|mol)$" % self._meta.resource_name, self.wrap_view('get_multiple'), name="api_get_multiple"),
+            url(r"^(?P<resource_name>%s)/(?P<chembl_id>[Cc][Hh][Ee][Mm][Bb][Ll]\d[\d]*)\.(?P<format>xml|json|jsonp|yaml|ndjson|csv|tsv|arrow|parquet|sdf|mol)$" % self._meta.resource_name, self.wrap_view('dispatch_detail'), name="api_dispatch_detail"),
             url(r"^(?P<resource_name>%s)/(?P<chembl_id>[Cc][Hh][Ee][Mm][Bb][Ll]\d[\d]*)%s$" % (self._meta.resource_name, trailing_slash()), self.wrap_view('dispatch_detail'), name="api_dispatch_detail"),
-            url(r"^(?P<resource_name>%s)/(?P<molecule_structures__standard_inchi_key>[A-Z]{14}-[A-Z]{10}-[A-Z])\.(?P<format>xml|json|jsonp|yaml|sdf|mol)$" % self._meta.resource_name, self.wrap_view('dispatch_detail'), name="api_dispatch_detail"),
+            url(r"^(?P<resource_name>%s)/(?P<molecule_structures__standard_inchi_key>[A-Z]{14}-[A-Z]{10}-[A-Z])\.(?P<format>xml|json|jsonp|yaml|ndjson|csv|tsv|arrow|parquet|sdf|mol)$" % self._meta.resource_name, self.wrap_view('dispatch_detail'), name="api_dispatch_detail"),
             url(r"^(?P<resource_name>%s)/(?P<molecule_structures__standard_inchi_key>[A-Z]{14}-[A-Z]{10}-[A-Z])%s$" % (self._meta.resource_name, trailing_slash()), self.wrap_view('dispatch_detail'), name="api_dispatch_detail"),
-            url(r"^(?P<resource_name>%s)/(?P<molecule_structures__canonical_smiles>[^jx]+)\.(?P<format>xml|json|jsonp|yaml|sdf|mol)$" % self._meta.resource_name, self.wrap_view('dispatch_detail'), name="api_dispatch_detail"),
+            url(r"^(?P<resource_name>%s)/(?P<molecule_structures__canonical_smiles>[^jx]+)\.(?P<format>xml|json|jsonp|yaml|ndjson|csv|tsv|arrow|parquet|sdf|mol)$" % self._meta.resource_name, self.wrap_view('dispatch_detail'), name="api_dispatch_detail"),
             url(r"^(?P<resource_name>%s)/(?P<molecule_structures__canonical_smiles>[^jx]+)%s$" % (self._meta.resource_name, trailing_slash()), self.wrap_view('dispatch_detail'), name="api_dispatch_detail"),
         ]
 
@@ -522,11 +568,17 @@ _SMILES_.
 
 # ----------------------------------------------------------------------------------------------------------------------
 
-    def alter_list_data_to_serialize(self, request, data):
-        bundles = data['molecules']
-        for idx, bundle in enumerate(bundles):
-            bundles[idx] = self.alter_detail_data_to_serialize(request, bundle)
-        return data
+    def get_serialization_options(self, request, data=None):
+        options = super(MoleculeResource, self).get_serialization_options(request, data)
+        sdf_tags = request.GET.get('sdf_tags') if request else None
+        if sdf_tags and self.get_format_name(request) == 'sdf':
+            options['sdf_tags'] = [tag.strip() for tag in sdf_tags.split(',') if tag.strip() in SDF_TAG_FIELDS]
+        return options
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def alter_list_bundle_to_serialize(self, request, bundle):
+        return self.alter_detail_data_to_serialize(request, bundle)
 
 # ----------------------------------------------------------------------------------------------------------------------
 
@@ -566,11 +618,8 @@ _SMILES_.
 
     def _get_cache_args(self, *args, **kwargs):
         cache_ordered_dict = super(MoleculeResource, self)._get_cache_args(*args, **kwargs)
-        smooshed = []
         filters, _ = self.build_filters(kwargs, for_cache_key=True)
-        for key, value in list(filters.items()):
-            smooshed.append("%s=%s" % (key, value))
-        cache_ordered_dict['filters'] = '|'.join(sorted(smooshed))
+        cache_ordered_dict['filters'] = self.canonical_filters(filters)
         return cache_ordered_dict
 
 # ----------------------------------------------------------------------------------------------------------------------
@@ -52,20 +52,8 @@ class MoleculeFormsResource(ChemblModelResource):
 
 # ----------------------------------------------------------------------------------------------------------------------
 
-    def alter_list_data_to_serialize(self, request, data):
-        """
-        A hook to alter list data just before it gets serialized & sent to the user.
-
-        Useful for restructuring/renaming aspects of the what's going to be
-        sent.
-
-        Should accommodate for a list of objects, generally also including
-        meta data.
-        """
-        bundles = data['molecule_forms']
-        for idx, bundle in enumerate(bundles):
-            bundles[idx] = self.alter_detail_data_to_serialize(request, bundle)
-        return data
+    def alter_list_bundle_to_serialize(self, request, bundle):
+        return self.alter_detail_data_to_serialize(request, bundle)
 
 # ----------------------------------------------------------------------------------------------------------------------
 
@@ -160,7 +148,8 @@ class MoleculeFormsResource(ChemblModelResource):
 
         for ob in obj[self._meta.collection_name]:
             bundle = self.build_bundle(obj=ob, request=request)
-            bundles.append(self.full_dehydrate(bundle, for_list=True, **kwargs))
+            bundle = self.full_dehydrate(bundle, for_list=True, **kwargs)
+            bundles.append(self.alter_list_bundle_to_serialize(request, bundle))
 
         obj[self._meta.collection_name] = bundles
         obj = self.alter_list_data_to_serialize(request, obj)
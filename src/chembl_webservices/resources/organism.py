@@ -34,9 +34,5 @@ class OrganismResource(ChemblModelResource):
 
 # ----------------------------------------------------------------------------------------------------------------------
 
-    def alter_list_data_to_serialize(self, request, data):
-
-        bundles = data['organisms']
-        for idx, bundle in enumerate(bundles):
-            bundles[idx] = self.alter_detail_data_to_serialize(request, bundle)
-        return data
+    def alter_list_bundle_to_serialize(self, request, bundle):
+        return self.alter_detail_data_to_serialize(request, bundle)
@@ -17,7 +17,15 @@ from django.core.exceptions import MultipleObjectsReturned, ObjectDoesNotExist
 from chembl_webservices.resources.molecule import MoleculeResource
 from tastypie.exceptions import InvalidSortError
 from chembl_webservices.core.utils import list_flatten
+from chembl_webservices.core.pagination import ScoredList
 from chembl_webservices.core.fpsim2_helper import get_similar_molregnos
+from chembl_webservices.core.fpsim2_helper import get_top_k_molregnos
+from chembl_webservices.core.fpsim2_helper import get_batch_similar_molregnos
+from chembl_webservices.core.fpsim2_helper import get_fpsim_engine
+from chembl_webservices.core.fpsim2_helper import load_query
+from chembl_webservices.core.fpsim2_helper import get_identifier_query
+from chembl_webservices.core.fpsim2_helper import QUERY_CACHE
+from chembl_webservices.core.fpsim2_helper import InvalidQueryError
 from tastypie.exceptions import ImmediateHttpResponse
 
 from chembl_core_model.models import CompoundMols
@@ -34,6 +42,11 @@ except AttributeError:
 from chembl_webservices.core.fields import monkeypatch_tastypie_field
 monkeypatch_tastypie_field()
 
+CHEMBL_ID = re.compile(r'^CHEMBL\d+$', re.IGNORECASE)
+
+# number of molregnos whose ChEMBL IDs are looked up at once for the hits of the batch searches
+BATCH_LOOKUP_SIZE = 10000
+
 # ----------------------------------------------------------------------------------------------------------------------
 
 
@@ -67,7 +80,117 @@ class SimilarityResource(MoleculeResource):
 # ----------------------------------------------------------------------------------------------------------------------
 
     def prepend_urls(self):
-        return []
+        return [
+            url(r"^(?P<resource_name>%s)/batch%s$" % (self._meta.resource_name, trailing_slash(),), self.wrap_view('post_batch'), name="api_post_batch"),
+            url(r"^(?P<resource_name>%s)/batch\.(?P<format>json)$" % self._meta.resource_name, self.wrap_view('post_batch'), name="api_post_batch"),
+        ]
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def clean_top_k(self, top_k):
+        max_top_k = getattr(settings, 'FPSIM2_MAX_TOP_K', 1000)
+        try:
+            cleaned = int(re.search(r'^\d+', str(top_k)).group())
+        except(ValueError, AttributeError):
+            raise BadRequest("Invalid top_k supplied: %s" % top_k)
+        if cleaned < 1 or cleaned > max_top_k:
+            raise BadRequest("top_k should be a number between 1 and %s" % max_top_k)
+        return cleaned
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def post_batch(self, request, **kwargs):
+        """
+        Searches the molecules similar to many structures at once, reading the fingerprints a single time.
+
+        Takes ``queries``, a list of SMILES or ChEMBL IDs, ``similarity`` and optionally ``top_k``, the number of hits
+        kept for each query, ``FPSIM2_MAX_TOP_K`` by default. Returns the hits of each query, most similar first, as
+        compact rows of ``fields``.
+
+        Should return a HttpResponse (200 OK).
+        """
+        self.method_check(request, allowed=['post'])
+        self.is_authenticated(request)
+        self.throttle_check(request)
+        request.format = request.format or 'json'
+
+        queries = kwargs.get('queries')
+        if isinstance(queries, str):
+            queries = queries.split()
+        if not queries or not isinstance(queries, list) or not all(isinstance(query, str) for query in queries):
+            raise BadRequest("A list of SMILES or ChEMBL IDs is required in the queries parameter.")
+        max_queries = getattr(settings, 'FPSIM2_MAX_BATCH_QUERIES', 100)
+        if len(queries) > max_queries:
+            raise BadRequest("At most %s queries can be searched at once." % max_queries)
+
+        if not kwargs.get('similarity'):
+            raise BadRequest("Similarity parameter is required.")
+        try:
+            similarity = int(re.search(r'^\d+', str(kwargs['similarity'])).group())
+        except(ValueError, AttributeError):
+            raise BadRequest("Invalid Similarity Score supplied: %s" % kwargs['similarity'])
+        if similarity < 70 or similarity > 100:
+            raise BadRequest("Invalid Similarity Score supplied: %s" % kwargs['similarity'])
+        if kwargs.get('top_k'):
+            top_k = self.clean_top_k(kwargs['top_k'])
+        else:
+            top_k = getattr(settings, 'FPSIM2_MAX_TOP_K', 1000)
+
+        objects = self.get_object_list(request)
+        query_ids = set(query.upper() for query in queries if CHEMBL_ID.match(query))
+        # the molecules of the identifiers not in the query cache are looked up at once
+        molecules = dict((chembl_id, (molregno, smiles)) for chembl_id, molregno, smiles in objects.filter(
+            chembl_id__in=[query_id for query_id in query_ids if QUERY_CACHE.get(query_id) is None]).values_list(
+            'chembl_id', 'pk', 'compoundstructures__canonical_smiles')) if query_ids else {}
+
+        get_fpsim_engine()
+        results = [{'query': query} for query in queries]
+        searched = []
+        query_fps = []
+        for result in results:
+            query = result['query']
+            try:
+                if CHEMBL_ID.match(query):
+                    query_fp = get_identifier_query(query.upper(),
+                                                    lambda query_id: molecules.get(query_id, (None, None)))
+                    if query_fp is None:
+                        result['error_message'] = "No chemical structure defined for identifier {0}".format(query)
+                        continue
+                else:
+                    query_fp = load_query(query)
+            except InvalidQueryError:
+                result['error_message'] = "Invalid SMILES: {0}".format(query)
+                continue
+            query_fps.append(query_fp)
+            searched.append(result)
+
+        # one more hit for the molecules searched by their ChEMBL ID, which are left out of their hits
+        hits = get_batch_similar_molregnos(query_fps, similarity / 100.0, top_k + 1) if query_fps else []
+
+        molregnos = list(set(int(molregno) for query_hits in hits for molregno in query_hits['mol_id']))
+        molregno_ids = dict()
+        for start in range(0, len(molregnos), BATCH_LOOKUP_SIZE):
+            molregno_ids.update(objects.filter(pk__in=molregnos[start:start + BATCH_LOOKUP_SIZE]).values_list(
+                'pk', 'chembl_id'))
+
+        for result, query_hits in zip(searched, hits):
+            query_id = result['query'].upper()
+            rows = []
+            for molregno, sim in query_hits:
+                chembl_id = molregno_ids.get(int(molregno))
+                # like the single searches, the molecule searched by its ChEMBL ID is not among its hits
+                if chembl_id is None or chembl_id == query_id:
+                    continue
+                rows.append([int(molregno), chembl_id, sim.item() * 100])
+                if len(rows) == top_k:
+                    break
+            result['hits'] = rows
+
+        self.log_throttled_access(request)
+        return self.create_response(request, {
+            'fields': ['molregno', 'molecule_chembl_id', 'similarity'],
+            'queries': results,
+        })
 
 # ----------------------------------------------------------------------------------------------------------------------
 
@@ -81,14 +204,16 @@ class SimilarityResource(MoleculeResource):
                 raise BadRequest("Structure or identifier required.")
 
             similarity = kwargs.pop('similarity')
+            top_k = kwargs.pop('top_k', None)
             if not smiles:
                 if chembl_id:
                     mol_filters = {'chembl_id': chembl_id}
                 else:
                     mol_filters = {'compoundstructures__standard_inchi_key': std_inchi_key}
-                try:
+
+                def get_molecule(identifier):
                     objects = self.apply_filters(bundle.request, mol_filters).values_list(
-                        'compoundstructures__canonical_smiles', flat=True)
+                        'pk', 'compoundstructures__canonical_smiles')
                     stringified_kwargs = ', '.join(["%s=%s" % (k, v) for k, v in list(mol_filters.items())])
                     length = len(objects)
                     if length <= 0:
@@ -97,8 +222,12 @@ class SimilarityResource(MoleculeResource):
                     elif length > 1:
                         raise MultipleObjectsReturned("More than '%s' matched '%s'." % (self._meta.object_class.__name__,
                                                                                         stringified_kwargs))
-                    smiles = objects[0]
-                    if not smiles:
+                    return objects[0]
+
+                try:
+                    # the fingerprints of the database molecules are read from the FPSim2 file and cached by identifier
+                    query = get_identifier_query(chembl_id or std_inchi_key, get_molecule)
+                    if query is None:
                         raise ObjectDoesNotExist(
                             "No chemical structure defined for identifier {0}".format(chembl_id or std_inchi_key))
                 except TypeError as e:
@@ -109,11 +238,16 @@ class SimilarityResource(MoleculeResource):
                 except ValueError:
                     raise BadRequest("Invalid resource lookup data provided (mismatched type).")
 
-            if not isinstance(smiles, str):
+            elif not isinstance(smiles, str):
                 raise BadRequest("Similarity can only handle a single chemical structure identified by SMILES, "
                                  "InChiKey or ChEMBL ID.")
+            else:
+                query = smiles
 
-            similar_molregnos = get_similar_molregnos(smiles, similarity/100.0)
+            if top_k:
+                similar_molregnos = get_top_k_molregnos(query, top_k, similarity/100.0)
+            else:
+                similar_molregnos = get_similar_molregnos(query, similarity/100.0)
 
             # Use percentage to present similarity values
             similar_molregnos = [(molregno_i, sim_i.item()*100) for molregno_i, sim_i in similar_molregnos]
@@ -184,10 +318,16 @@ class SimilarityResource(MoleculeResource):
                 raise BadRequest("Similarity parameter is required.")
             original_similarity = kwargs['similarity']
 
+            # the k most similar molecules are found scanning a bounded number of fingerprints, any threshold is safe
+            top_k = kwargs.get('top_k')
+            if top_k:
+                kwargs['top_k'] = self.clean_top_k(top_k)
+            min_similarity = 0 if top_k else 70
+
             try:
                 kwargs['similarity'] = int(re.search(r'^\d+', str(kwargs.get('similarity', "0"))).group())
                 similarity = kwargs.get('similarity', 0)
-                if similarity < 70 or similarity > 100:
+                if similarity < min_similarity or similarity > 100:
                     raise BadRequest("Invalid Similarity Score supplied: %s" % original_similarity)
             except(ValueError, AttributeError):
                 raise BadRequest("Invalid Similarity Score supplied: %s" % original_similarity)
@@ -255,13 +395,11 @@ class SimilarityResource(MoleculeResource):
 
         if (order_bits.index('similarity') == 0 if 'similarity' in order_bits else False) or \
                 (order_bits.index('-similarity') == 0 if '-similarity' in order_bits else False):
-            obj_list = self.prefetch_related(obj_list, **options)
-            for obj in obj_list:
-                sim = similarity_map[obj.molregno]
-                obj.similarity = sim
-                similarity_map[obj.molregno] = obj
-            vals = [sim for sim in list(similarity_map.values()) if type(sim) == MoleculeDictionary]
-            return list(reversed(vals)) if '-similarity' in order_bits else vals
+            matching = set(obj_list.values_list('pk', flat=True))
+            scored = [(int(molregno), sim) for molregno, sim in similarity_map.items() if molregno in matching]
+            if '-similarity' in order_bits:
+                scored.reverse()
+            return ScoredList(self.prefetch_related(obj_list, **options), scored, 'similarity')
 
         else:
 
@@ -288,10 +426,14 @@ class SimilarityResource(MoleculeResource):
                 order_by_args.append("%s%s" % (order, LOOKUP_SEP.join([self.fields[field_name].attribute] +
                                                                       order_by_bits[1:])))
 
-            obj_list = self.prefetch_related(obj_list.order_by(*order_by_args), **options)
-            for obj in obj_list:
-                obj.similarity = similarity_map[obj.molregno]
-            return obj_list
+            obj_list = obj_list.order_by(*order_by_args)
+            scored = []
+            seen = set()
+            for molregno in obj_list.values_list('pk', flat=True):
+                if molregno not in seen:
+                    seen.add(molregno)
+                    scored.append((molregno, similarity_map[molregno]))
+            return ScoredList(self.prefetch_related(obj_list, **options), scored, 'similarity')
 
 # ----------------------------------------------------------------------------------------------------------------------
 
@@ -321,9 +463,10 @@ class SimilarityResource(MoleculeResource):
             pk = kwargs.get('chembl_id', None)
 
         similarity = kwargs.get('similarity', 0)
+        top_k = kwargs.get('top_k')
 
         cache_ordered_dict['limit'] = pk
-        cache_ordered_dict['offset'] = str(similarity)
+        cache_ordered_dict['offset'] = str(similarity) if not top_k else '{0}/top_k={1}'.format(similarity, top_k)
 
         return cache_ordered_dict
 
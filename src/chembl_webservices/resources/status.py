@@ -4,6 +4,7 @@ from tastypie.utils import trailing_slash
 from django.conf.urls import url
 from chembl_webservices import __version__
 from chembl_webservices.core.resource import ChemblModelResource
+from chembl_webservices.core.resource import WS_DEBUG
 from chembl_webservices.core.meta import ChemblResourceMeta
 from chembl_webservices.core.serialization import ChEMBLApiSerializer
 
@@ -52,19 +53,26 @@ class StatusResource(ChemblModelResource):
 # ----------------------------------------------------------------------------------------------------------------------
 
     def get_detail(self, request, **kwargs):
-        return self.create_response(request,
-                                    {
-                                        'status': 'UP',
-                                        'api_version': __version__,
-                                        'chembl_db_version': Version.objects.all()[0].name,
-                                        'chembl_release_date': Version.objects.all()[0].creation_date,
-                                        'targets': TargetDictionary.objects.all().count(),
-                                        'compound_records': CompoundRecords.objects.all().count(),
-                                        'disinct_compounds': MoleculeDictionary.objects.all().count(),
-                                        'activities': Activities.objects.all().count(),
-                                        'publications': Docs.objects.all().count(),
-                                    }
-                                    )
+        status = {
+            'status': 'UP',
+            'api_version': __version__,
+            'chembl_db_version': Version.objects.all()[0].name,
+            'chembl_release_date': Version.objects.all()[0].creation_date,
+            'targets': TargetDictionary.objects.all().count(),
+            'compound_records': CompoundRecords.objects.all().count(),
+            'disinct_compounds': MoleculeDictionary.objects.all().count(),
+            'activities': Activities.objects.all().count(),
+            'publications': Docs.objects.all().count(),
+        }
+        if WS_DEBUG:
+            # per worker statistics of the in-process cache, see chembl_core_db.cache.lru
+            l1_info = getattr(getattr(self._meta.cache, 'cache', None), 'l1_info', None)
+            if l1_info:
+                status['cache_l1'] = l1_info()
+            stats = getattr(self._meta.cache, 'stats', None)
+            if stats:
+                status['cache_hit_rate'] = stats.as_dict()
+        return self.create_response(request, status)
 
 # ----------------------------------------------------------------------------------------------------------------------
 
@@ -90,7 +90,7 @@ class StructuralAlertsResource(ChemblModelResource):
 
 class ImageAwareSerializer(ChEMBLApiSerializer):
 
-    formats = ['xml', 'json', 'jsonp', 'yaml', 'png', 'svg']
+    formats = ['xml', 'json', 'jsonp', 'yaml', 'ndjson', 'csv', 'tsv', 'arrow', 'parquet', 'png', 'svg']
 
     content_types = {
         'json': 'application/json',
@@ -98,6 +98,11 @@ class ImageAwareSerializer(ChEMBLApiSerializer):
         'xml': 'application/xml',
         'yaml': 'text/yaml',
         'urlencode': 'application/x-www-form-urlencoded',
+        'ndjson': 'application/x-ndjson',
+        'csv': 'text/csv',
+        'tsv': 'text/tab-separated-values',
+        'arrow': 'application/vnd.apache.arrow.stream',
+        'parquet': 'application/vnd.apache.parquet',
         'png': 'image/png',
         'svg': 'image/svg',
     }
@@ -96,7 +96,7 @@ class BaseWebServiceTestCase(unittest.TestCase):
         if response.status_code == 200:
             if custom_format == 'json':
                 return response.json()
-            elif custom_format == 'png':
+            elif custom_format in ('png', 'arrow', 'parquet'):
                 return response.content
             return response.text
         return None
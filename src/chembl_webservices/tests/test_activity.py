@@ -1,5 +1,14 @@
+import json
+import unittest
 from chembl_webservices.tests import BaseWebServiceTestCase
 
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
 
 class ActivityTestCase(BaseWebServiceTestCase):
 
@@ -128,3 +137,59 @@ class ActivityTestCase(BaseWebServiceTestCase):
 
         for act_i in act_list_req[self.get_current_plural()]:
             self.assertIn(text_test, act_i['assay_description'].lower())
+
+    def test_cursor_pagination(self):
+        act_list_req = self.get_current_resource_list({'after': '', 'limit': 50})
+        first_page = act_list_req[self.get_current_plural()]
+        self.assertEqual(len(first_page), 50)
+        self.assertIsNotNone(act_list_req['page_meta']['next'])
+        offset_page = self.get_current_resource_list({'offset': 50, 'limit': 50})[self.get_current_plural()]
+        host = self.WS_URL[:self.WS_URL.index('/chembl/api')]
+        cursor_page = self.request_url(host + act_list_req['page_meta']['next'])[self.get_current_plural()]
+        self.assertEqual([act_i['activity_id'] for act_i in cursor_page],
+                         [act_i['activity_id'] for act_i in offset_page])
+        ids = [act_i['activity_id'] for act_i in first_page + cursor_page]
+        self.assertEqual(ids, sorted(ids))
+        self.get_resource_list(self.resource, {'after': 'not a cursor'}, expected_code=400)
+
+    def test_without_total_count(self):
+        act_list_req = self.get_current_resource_list({'total_count': 'none', 'limit': 20})
+        self.assertEqual(len(act_list_req[self.get_current_plural()]), 20)
+        self.assertIsNone(act_list_req['page_meta']['total_count'])
+        self.assertIn('total_count=none', act_list_req['page_meta']['next'])
+        self.get_resource_list(self.resource, {'total_count': 'maybe'}, expected_code=400)
+
+    def test_large_page(self):
+        # pages of at least STREAMING_MIN_OBJECTS activities are streamed
+        act_list_req = self.get_current_resource_list({'limit': 1000})
+        self.assertEqual(len(act_list_req[self.get_current_plural()]), 1000)
+        self.assertEqual(act_list_req['page_meta']['limit'], 1000)
+
+    def test_flat_formats(self):
+        act_list = self.get_current_resource_list({'limit': 20})[self.get_current_plural()]
+        ndjson = self.get_resource_list(self.resource, {'limit': 20}, custom_format='ndjson')
+        self.assertEqual([json.loads(line) for line in ndjson.splitlines()], act_list)
+        csv_lines = self.get_resource_list(self.resource, {'limit': 20, 'only': 'activity_id,standard_type'},
+                                           custom_format='csv').splitlines()
+        header = csv_lines[0].split(',')
+        self.assertEqual(sorted(header), ['activity_id', 'standard_type'])
+        id_idx = header.index('activity_id')
+        self.assertEqual([int(line.split(',')[id_idx]) for line in csv_lines[1:]],
+                         [act['activity_id'] for act in act_list])
+        tsv_lines = self.get_resource_list(self.resource, {'limit': 20}, custom_format='tsv').splitlines()
+        self.assertEqual(len(tsv_lines), 21)
+
+    @unittest.skipIf(pyarrow is None, 'pyarrow is not installed')
+    def test_columnar_formats(self):
+        act_list = self.get_current_resource_list({'limit': 20})[self.get_current_plural()]
+        arrow = self.get_resource_list(self.resource, {'limit': 20}, custom_format='arrow')
+        table = pyarrow.ipc.open_stream(arrow).read_all()
+        self.assertEqual(table.column('activity_id').to_pylist(), [act['activity_id'] for act in act_list])
+        self.assertEqual(table.column('standard_type').to_pylist(), [act['standard_type'] for act in act_list])
+        parquet = self.get_resource_list(self.resource, {'limit': 20, 'only': 'activity_id'}, custom_format='parquet')
+        table = pyarrow.parquet.read_table(pyarrow.BufferReader(parquet))
+        self.assertEqual(table.column_names, ['activity_id'])
+        self.assertEqual(table.num_rows, 20)
+        # columnar pages are limited like the other formats
+        arrow = self.get_resource_list(self.resource, {'limit': 5000, 'only': 'activity_id'}, custom_format='arrow')
+        self.assertEqual(pyarrow.ipc.open_stream(arrow).read_all().num_rows, 1000)
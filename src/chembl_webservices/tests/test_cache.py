@@ -0,0 +1,185 @@
+import time
+import queue
+import pickle
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+from django.test import SimpleTestCase
+from chembl_core_db.cache.backends import MongoDBCache as mongodb_cache
+from chembl_webservices.core.cache import ChemblCache
+from chembl_webservices.core.utils import canonical_filter
+from chembl_webservices.resources.activities import ActivityResource
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+
+@unittest.skipIf(mongomock is None, 'the cache tests require mongomock')
+class ChemblCacheTestCase(SimpleTestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(mongodb_cache.pymongo, 'MongoClient', return_value=mongomock.MongoClient())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.lock_directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.lock_directory)
+
+    def get_cache(self, **kwargs):
+        kwargs.setdefault('single_flight', {'CLASS': 'chembl_core_db.cache.locks.FileLock',
+                                            'DIRECTORY': self.lock_directory})
+        cache = ChemblCache(timeout=60, **kwargs)
+        cache.cache = mongodb_cache.MongoDBCache('test_cache', {'OPTIONS': {}})
+        return cache
+
+    def test_write_behind(self):
+        cache = self.get_cache(write_behind=True)
+        token = cache.lock('lock:page')
+        self.assertTrue(token)
+        self.assertIsNone(cache.lock('lock:page'))
+        cache.set_many({'page1': [1], 'page2': [2]}, lock=('lock:page', token))
+        cache.flush()
+        self.assertEqual(cache.get_many(['page1', 'page2']), {'page1': [1], 'page2': [2]})
+        self.assertFalse(cache._lock.locked('lock:page'))
+
+    def test_write_behind_queue_full(self):
+        cache = self.get_cache(write_behind=True)
+        token = cache.lock('lock:page')
+        full = mock.Mock(**{'put_nowait.side_effect': queue.Full})
+        with mock.patch.object(cache, '_get_queue', return_value=full):
+            with self.assertLogs('chembl_webservices.core.cache', 'WARNING'):
+                cache.set_many({'page1': [1]}, lock=('lock:page', token))
+        self.assertEqual(cache.get_many(['page1']), {'page1': [1]})
+        self.assertFalse(cache._lock.locked('lock:page'))
+
+    def test_lock_released_on_errors(self):
+        for write_behind in (True, False):
+            cache = self.get_cache(write_behind=write_behind)
+            token = cache.lock('lock:page')
+            with mock.patch.object(cache.cache, 'serialize', side_effect=pickle.PicklingError):
+                with self.assertRaises(pickle.PicklingError):
+                    cache.set_many({'page1': [1]}, lock=('lock:page', token))
+            self.assertFalse(cache._lock.locked('lock:page'))
+            token = cache.lock('lock:page')
+            self.assertTrue(token)
+            cache.unlock('lock:page', token)
+
+    def test_wait_many(self):
+        cache = self.get_cache(single_flight={'CLASS': 'chembl_core_db.cache.locks.FileLock',
+                                              'DIRECTORY': self.lock_directory, 'WAIT': 1, 'POLL_INTERVAL': 0.01})
+        token = cache.lock('lock:page')
+        cache.set_many({'page1': [1]}, write_behind=False)
+        # the leader still holds the lock, the follower gets what is already there once it gives up
+        self.assertEqual(cache.wait_many(['page1', 'page2'], 'lock:page'), {'page1': [1]})
+        cache.set_many({'page2': [2]}, write_behind=False)
+        self.assertEqual(cache.wait_many(['page1', 'page2'], 'lock:page'), {'page1': [1], 'page2': [2]})
+        cache.unlock('lock:page', token)
+        self.assertEqual(cache.wait_many(['page3'], 'lock:page'), {})
+
+    def test_stale_while_revalidate(self):
+        cache = self.get_cache(soft_timeout=60)
+        with mock.patch.object(cache, 'chembl_db_version', return_value='ChEMBL_27'):
+            data = cache.wrap({'molecule_chembl_id': 'CHEMBL25'}, 'molecule')
+            self.assertEqual(cache.unwrap(data), ({'molecule_chembl_id': 'CHEMBL25'}, False))
+            # values cached before they were wrapped get replaced
+            self.assertEqual(cache.unwrap({'molecule_chembl_id': 'CHEMBL25'}),
+                             ({'molecule_chembl_id': 'CHEMBL25'}, True))
+            with mock.patch('chembl_webservices.core.cache.time.time', return_value=data['soft_expires'] + 1):
+                self.assertTrue(cache.is_stale(data))
+        with mock.patch.object(cache, 'chembl_db_version', return_value='ChEMBL_28'):
+            self.assertTrue(cache.is_stale(data))
+
+    def test_refresh(self):
+        cache = self.get_cache(max_refresh_threads=1)
+        started = threading.Event()
+        done = threading.Event()
+
+        def recompute():
+            started.set()
+            done.wait(5)
+
+        self.assertTrue(cache.refresh('page1', recompute))
+        started.wait(5)
+        # one refresh per key, and at most max_refresh_threads per worker
+        self.assertFalse(cache.refresh('page1', recompute))
+        self.assertFalse(cache.refresh('page2', recompute))
+        self.assertTrue(cache._lock.locked('refresh:page1'))
+        started.clear()
+        done.set()
+        # the slot and the lock are released once the refresh is over
+        for i in range(100):
+            if cache.refresh('page2', recompute):
+                break
+            time.sleep(0.01)
+        self.assertTrue(started.wait(5))
+        self.assertFalse(cache._lock.locked('refresh:page1'))
+
+    def test_hit_rate(self):
+        cache = self.get_cache()
+        cache.record('molecule', True)
+        cache.record('molecule', False)
+        cache.record('molecule', True)
+        cache.record('target', False)
+        stats = cache.stats.as_dict()
+        self.assertEqual((stats['molecule']['hits'], stats['molecule']['misses']), (2, 1))
+        self.assertEqual(stats['molecule']['hit_rate'], 0.6667)
+        self.assertEqual(stats['target']['hit_rate'], 0.0)
+        cache.stats.reset()
+        self.assertEqual(cache.stats.as_dict(), {})
+
+
+class CacheKeyTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.resource = ActivityResource()
+
+    def assertSameKey(self, first, second):
+        self.assertEqual(self.resource.generate_cache_key('list', **first),
+                         self.resource.generate_cache_key('list', **second))
+
+    def assertDifferentKey(self, first, second):
+        self.assertNotEqual(self.resource.generate_cache_key('list', **first),
+                            self.resource.generate_cache_key('list', **second))
+
+    def test_canonical_filter(self):
+        self.assertEqual(canonical_filter('standard_type__exact', 'IC50'), 'standard_type="IC50"')
+        self.assertEqual(canonical_filter('standard_type', 'IC50'), 'standard_type="IC50"')
+        self.assertEqual(canonical_filter('molecule__chembl_id__in', 'CHEMBL2,CHEMBL1,CHEMBL2'),
+                         canonical_filter('molecule__chembl_id__in', ['CHEMBL1', 'CHEMBL2']))
+        self.assertEqual(canonical_filter('molecule__chembl_id__in', ['CHEMBL2,CHEMBL1']),
+                         'molecule__chembl_id__in=["CHEMBL1", "CHEMBL2"]')
+        self.assertEqual(canonical_filter('pref_name__iexact', 'aspirin'),
+                         canonical_filter('pref_name__iexact', 'ASPIRIN'))
+        # only what the query treats the same shares a key
+        self.assertNotEqual(canonical_filter('molecule__chembl_id', 'chembl25'),
+                            canonical_filter('molecule__chembl_id', 'CHEMBL25'))
+        self.assertNotEqual(canonical_filter('molecule__chembl_id__in', ['chembl25']),
+                            canonical_filter('molecule__chembl_id__in', ['CHEMBL25']))
+        self.assertNotEqual(canonical_filter('pref_name', ' aspirin'), canonical_filter('pref_name', 'aspirin'))
+        self.assertNotEqual(canonical_filter('pref_name__contains', 'a,b'),
+                            canonical_filter('pref_name__contains', ['a', 'b']))
+        self.assertNotEqual(canonical_filter('pref_name__iregex', r'\d'), canonical_filter('pref_name__iregex', r'\D'))
+
+    def test_canonical_filters(self):
+        self.assertSameKey({'standard_type': 'IC50', 'molecule_chembl_id__in': 'CHEMBL2,CHEMBL1'},
+                           {'molecule_chembl_id__in': 'CHEMBL1,CHEMBL2,CHEMBL1', 'standard_type__exact': 'IC50'})
+        self.assertSameKey({'assay_description__icontains': 'binding'}, {'assay_description__icontains': 'BINDING'})
+        self.assertDifferentKey({'standard_type': 'IC50'}, {'standard_type': 'ic50'})
+        self.assertDifferentKey({'molecule_chembl_id': 'CHEMBL25'}, {'molecule_chembl_id': 'chembl25'})
+        self.assertDifferentKey({'standard_type': 'IC50'}, {'standard_type': 'IC50', 'limit': 20})
+        self.assertSameKey({'standard_type': 'IC50', 'only': 'activity_id,standard_type'},
+                           {'standard_type': 'IC50', 'only': ['standard_type', 'activity_id']})
+
+    def test_canonical_order(self):
+        self.assertEqual(self.resource.canonical_order(['standard_value', 'standard_value', '-activity_id']),
+                         ['standard_value', '-activity_id'])
+        # an ascending primary key is the default ordering
+        self.assertEqual(self.resource.canonical_order(['activity_id']), [])
+        self.assertEqual(self.resource.canonical_order(['-activity_id']), ['-activity_id'])
+        self.assertSameKey({'order_by': ['activity_id']}, {})
+        self.assertSameKey({'order_by': ['standard_value', 'standard_value']}, {'order_by': 'standard_value'})
+        self.assertDifferentKey({'order_by': ['standard_value', 'activity_id']},
+                                {'order_by': ['activity_id', 'standard_value']})
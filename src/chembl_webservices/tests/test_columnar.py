@@ -0,0 +1,131 @@
+import io
+import unittest
+from decimal import Decimal
+from unittest import mock
+from django.test import SimpleTestCase
+from django.test import RequestFactory
+from django.db.models.query import QuerySet
+from django.urls import resolve
+from django.conf import settings
+from tastypie.bundle import Bundle
+from tastypie.exceptions import BadRequest
+from chembl_core_model.models import Activities
+from chembl_webservices.core.columnar import pyarrow
+from chembl_webservices.core.columnar import ColumnarRows
+from chembl_webservices.core.columnar import iter_arrow
+from chembl_webservices.core.columnar import iter_parquet
+from chembl_webservices.core.columnar import iter_record_batches
+from chembl_webservices.resources.activities import ActivityResource
+from chembl_webservices.resources.molecule import MoleculeResource
+
+
+class ColumnarRowsTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.resource = ActivityResource()
+        self.columns = self.resource.get_columnar_fields('activity_id,standard_value,molecule_chembl_id,'
+                                                         'target_pref_name')
+        self.objects = [Activities(activity_id=3), Activities(activity_id=1), Activities(activity_id=2)]
+        self.querysets = []
+
+    def fetch(self, rows):
+        def iterate(queryset):
+            self.querysets.append(queryset)
+            return iter(rows)
+        return mock.patch.object(QuerySet, '__iter__', autospec=True, side_effect=iterate)
+
+    def test_single_query(self):
+        paths = [path for _, path, _ in self.columns]
+        self.assertEqual(paths, ['molecule__chembl_id', 'assay__target__pref_name', 'activity_id', 'standard_value'])
+        rows = ColumnarRows(self.objects, self.columns, Activities)
+        with self.fetch([(1, 'CHEMBL1', 'Target 1', 1, Decimal('1.5')),
+                         (3, 'CHEMBL3', None, 3, None)]):
+            self.assertEqual(list(rows), [
+                ('CHEMBL3', None, 3, None),
+                ('CHEMBL1', 'Target 1', 1, Decimal('1.5')),
+                # gone from the database since the page was cached
+                (None, None, None, None),
+            ])
+        # the values of all the objects, through all the relations, come from one query
+        self.assertEqual(len(self.querysets), 1)
+        queryset = self.querysets[0]
+        self.assertEqual(queryset._fields, ('pk',) + tuple(paths))
+        sql = str(queryset.query)
+        self.assertIn('JOIN', sql)
+        self.assertIn('IN (3, 1, 2)', sql)
+
+    def test_empty_page(self):
+        with self.fetch([]):
+            self.assertEqual(list(ColumnarRows([], self.columns, Activities)), [])
+        self.assertEqual(self.querysets, [])
+
+    @unittest.skipIf(pyarrow is None, 'the columnar formats require pyarrow')
+    def test_record_batches(self):
+        rows = ColumnarRows(self.objects, self.columns, Activities)
+        with self.fetch([(3, 'CHEMBL3', 'Target', 3, Decimal('2.5')), (1, None, None, 1, 7),
+                         (2, 'CHEMBL2', None, 2, None)]):
+            batches = list(iter_record_batches(rows, rows.schema, rows.dehydrated_types, batch_size=2))
+        self.assertEqual([batch.num_rows for batch in batches], [2, 1])
+        table = pyarrow.ipc.open_stream(b''.join(iter_arrow(iter(batches), rows.schema))).read_all()
+        self.assertEqual(table.to_pydict(), {
+            'molecule_chembl_id': ['CHEMBL3', None, 'CHEMBL2'],
+            'target_pref_name': ['Target', None, None],
+            'activity_id': [3, 1, 2],
+            'standard_value': [2.5, 7.0, None],
+        })
+        parquet = pyarrow.parquet.read_table(io.BytesIO(b''.join(iter_parquet(iter(batches), rows.schema))))
+        self.assertEqual(parquet.to_pydict(), table.to_pydict())
+
+
+class FormatsTestCase(SimpleTestCase):
+    """
+    The flat and columnar formats write lists, detail objects and sets of objects as rows, not schemas.
+    """
+
+    def setUp(self):
+        self.resource = MoleculeResource()
+        self.serializer = self.resource._meta.serializer
+        self.aspirin = Bundle(data={'molecule_chembl_id': 'CHEMBL25', 'max_phase': 4,
+                                    'molecule_properties': Bundle(data={'full_mwt': Decimal('180.16')})})
+        self.other = Bundle(data={'molecule_chembl_id': 'CHEMBL1200', 'max_phase': None,
+                                  'molecule_properties': None})
+
+    def test_urls(self):
+        base = settings.SERVER_BASE_PATH.lstrip('/') + '/data/molecule'
+        for url, url_name in (('.csv', 'api_dispatch_list'), ('/search.arrow', 'api_get_search'),
+                              ('/CHEMBL25.csv', 'api_dispatch_detail'),
+                              ('/set/CHEMBL25;CHEMBL1200.parquet', 'api_get_multiple'),
+                              # refused by get_schema, see test_schema
+                              ('/schema.csv', 'api_get_schema')):
+            self.assertEqual(resolve('/' + base + url).url_name, url_name)
+
+    def test_schema(self):
+        for format_name in ('ndjson', 'csv', 'tsv', 'arrow', 'parquet'):
+            request = RequestFactory().get('/')
+            request.format = format_name
+            with self.assertRaises(BadRequest):
+                ActivityResource().get_schema(request)
+
+    def test_flat(self):
+        options = {'columns': ['molecule_chembl_id', 'max_phase', 'molecule_properties.full_mwt']}
+        self.assertEqual(self.serializer.to_csv(self.aspirin, options),
+                         'molecule_chembl_id,max_phase,molecule_properties.full_mwt\r\nCHEMBL25,4,180.16\r\n')
+        data = {'molecules': [self.aspirin, self.other], 'not_found': ['CHEMBL1']}
+        self.assertEqual(self.serializer.to_tsv(data, options),
+                         'molecule_chembl_id\tmax_phase\tmolecule_properties.full_mwt\r\n'
+                         'CHEMBL25\t4\t180.16\r\nCHEMBL1200\t\t\r\n')
+        self.assertEqual(self.serializer.to_ndjson(data),
+                         '{"max_phase": 4, "molecule_chembl_id": "CHEMBL25", '
+                         '"molecule_properties": {"full_mwt": "180.16"}}\n'
+                         '{"max_phase": null, "molecule_chembl_id": "CHEMBL1200", "molecule_properties": null}\n')
+
+    @unittest.skipIf(pyarrow is None, 'the columnar formats require pyarrow')
+    def test_columnar(self):
+        data = {'molecules': [self.aspirin, self.other], 'not_found': ['CHEMBL1']}
+        table = pyarrow.ipc.open_stream(self.serializer.to_arrow(data)).read_all()
+        self.assertEqual(table.to_pydict(), {'max_phase': [4, None], 'molecule_chembl_id': ['CHEMBL25', 'CHEMBL1200'],
+                                             'molecule_properties': [None, None],
+                                             'molecule_properties.full_mwt': ['180.16', None]})
+        table = pyarrow.parquet.read_table(io.BytesIO(self.serializer.to_parquet(self.aspirin)))
+        self.assertEqual(table.num_rows, 1)
+        self.assertEqual(table.column('molecule_chembl_id').to_pylist(), ['CHEMBL25'])
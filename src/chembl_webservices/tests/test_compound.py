@@ -164,6 +164,16 @@ class CompoundTestCase(BaseWebServiceTestCase):
             inchi_from_ctab = self.ctab2inchi(sdf_file)
             self.assertEqual(inchi_from_ctab, mol_data['molecule_structures']['standard_inchi'])
 
+    def test_sdf_set_and_tags(self):
+        sdf_file = self.request_url(self.WS_URL + '/molecule/set/CHEMBL25;CHEMBL1161014.sdf', custom_format='sdf')
+        self.assertEqual(sdf_file.count('$$$$\n'), 2)
+        self.assertIn('CHEMBL1161014', sdf_file)
+        mol_data = self.get_current_resource_by_id('CHEMBL25')
+        sdf_file = self.get_resource_list(self.resource, {'molecule_chembl_id': 'CHEMBL25',
+                                                          'sdf_tags': 'molecule_properties'}, custom_format='sdf')
+        self.assertIn('> <full_molformula>\n{0}\n'.format(mol_data['molecule_properties']['full_molformula']),
+                      sdf_file)
+
 
     def test_no_structure(self):
         no_structure_doc = self.get_current_resource_by_id('CHEMBL6961')
@@ -176,6 +186,12 @@ class CompoundTestCase(BaseWebServiceTestCase):
         req_return = self.get_current_resource_by_id('CHEMBL6963', custom_format='mol', expected_code=404)
         self.assertIsNone(req_return)
 
+        # a streamed page has already sent its status when a record without structure is reached
+        sdf_file = self.get_resource_list(self.resource, {'molecule_type': 'Protein', 'limit': 300},
+                                          custom_format='sdf')
+        self.assertEqual(sdf_file.count('$$$$\n'), 300)
+        self.assertIn('Molecule has no structure records.\n$$$$\n', sdf_file)
+
 
     def test_filtered_lists(self):
         comp_list_req_1 = self.get_current_resource_list({
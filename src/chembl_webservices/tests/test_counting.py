@@ -0,0 +1,88 @@
+import unittest
+from unittest import mock
+from django.test import SimpleTestCase
+from django.db.models.query import QuerySet
+from chembl_core_model.models import Activities
+from chembl_core_db.cache.backends import MongoDBCache as mongodb_cache
+from chembl_webservices.core import counting
+from chembl_webservices.core.cache import ChemblCache
+from chembl_webservices.resources.activities import ActivityResource
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+
+@mock.patch.object(QuerySet, 'count', return_value=12)
+@mock.patch.object(counting, 'planner_estimate', return_value=34)
+@mock.patch.object(counting, 'table_estimate', return_value=200000)
+class CountObjectsTestCase(SimpleTestCase):
+
+    def test_exact(self, table_estimate, planner_estimate, count):
+        self.assertEqual(counting.count_objects(Activities.objects.all()), (12, True))
+        self.assertEqual(counting.count_objects(Activities.objects.all(), 'exact'), (12, True))
+        self.assertEqual(counting.count_objects([1, 2, 3], 'estimate'), (3, True))
+        table_estimate.assert_not_called()
+        planner_estimate.assert_not_called()
+        with self.assertRaises(ValueError):
+            counting.count_objects(Activities.objects.all(), 'guess')
+
+    def test_auto(self, table_estimate, planner_estimate, count):
+        self.assertEqual(counting.count_objects(Activities.objects.order_by('-standard_value'), 'auto'),
+                         (200000, False))
+        # filtered and distinct lists are always counted
+        self.assertEqual(counting.count_objects(Activities.objects.filter(standard_type='IC50'), 'auto'), (12, True))
+        self.assertEqual(counting.count_objects(Activities.objects.distinct(), 'auto'), (12, True))
+        planner_estimate.assert_not_called()
+        self.assertEqual(table_estimate.call_count, 1)
+        # so are small tables and tables without statistics
+        self.assertEqual(counting.count_objects(Activities.objects.all(), 'auto', exact_threshold=200001), (12, True))
+        table_estimate.return_value = None
+        self.assertEqual(counting.count_objects(Activities.objects.all(), 'auto'), (12, True))
+
+    def test_estimate(self, table_estimate, planner_estimate, count):
+        self.assertEqual(counting.count_objects(Activities.objects.all(), 'estimate'), (200000, False))
+        self.assertEqual(counting.count_objects(Activities.objects.filter(standard_type='IC50'), 'estimate'),
+                         (34, False))
+        table_estimate.return_value = None
+        self.assertEqual(counting.count_objects(Activities.objects.all(), 'estimate'), (34, False))
+        count.assert_not_called()
+
+    def test_count_conditions(self, table_estimate, planner_estimate, count):
+        self.assertEqual(counting.count_conditions(Activities.objects.all().query.where), 0)
+        self.assertEqual(counting.count_conditions(
+            Activities.objects.filter(standard_type='IC50', standard_value__gt=10).query.where), 2)
+
+
+@unittest.skipIf(mongomock is None, 'the count cache tests require mongomock')
+@mock.patch.object(counting, 'table_estimate', return_value=200000)
+class ListCountTestCase(SimpleTestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(mongodb_cache.pymongo, 'MongoClient', return_value=mongomock.MongoClient())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        cache = ChemblCache(timeout=60)
+        cache.cache = mongodb_cache.MongoDBCache('test_cache', {'OPTIONS': {}})
+        self.resource = ActivityResource()
+        for patcher in (mock.patch.object(self.resource._meta, 'cache', cache),
+                        mock.patch.object(self.resource._meta, 'count_strategy', 'auto'),
+                        mock.patch.object(cache, 'chembl_db_version', return_value='ChEMBL_27')):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_cached_estimate(self, table_estimate):
+        objects = mock.Mock(return_value=Activities.objects.all())
+        self.assertEqual(self.resource.get_list_count('count:activity', objects), (200000, False))
+        # the count and whether it is exact are cached
+        self.assertEqual(self.resource.get_list_count('count:activity', objects), (200000, False))
+        self.assertEqual(objects.call_count, 1)
+        self.assertEqual(table_estimate.call_count, 1)
+
+    def test_exact_strategy(self, table_estimate):
+        with mock.patch.object(self.resource._meta, 'count_strategy', 'exact'), \
+                mock.patch.object(QuerySet, 'count', return_value=12):
+            self.assertEqual(self.resource.get_list_count('count:activity', lambda: Activities.objects.all()),
+                             (12, True))
+        table_estimate.assert_not_called()
@@ -0,0 +1,167 @@
+import os
+import time
+import shutil
+import tempfile
+from unittest import mock
+import numpy as np
+from django.test import SimpleTestCase
+from chembl_webservices.core import fpsim2_helper
+
+
+def synthetic_fps(count=50, words=4, seed=7):
+    """
+    Fingerprints laid out like the ones of an FPSim2 file: molregno, fingerprint words and popcount, sorted by
+    popcount.
+    """
+    rng = np.random.RandomState(seed)
+    fps = np.zeros((count, words + 2), dtype=np.uint64)
+    fps[:, 0] = rng.permutation(np.arange(1, count + 1) * 10)
+    fps[:, 1:-1] = rng.randint(0, 2 ** 62, size=(count, words), dtype=np.uint64)
+    fps[:, -1] = fpsim2_helper.popcount_rows(fps[:, 1:-1])
+    return fps[np.argsort(fps[:, -1], kind='stable')]
+
+
+class FPSim2TestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.fps = synthetic_fps()
+        self.fp_filename = os.path.join(self.directory, 'chembl.h5')
+        self.mmap_path = os.path.join(self.directory, 'chembl.npy')
+        with open(self.fp_filename, 'wb'):
+            pass
+        for name in ('SORTED_MOLREGNOS', 'MOLREGNO_ROWS'):
+            patcher = mock.patch.object(fpsim2_helper, name, None)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def set_mtime(self, path, mtime):
+        os.utime(path, (mtime, mtime))
+
+    def test_export_fps(self):
+        with mock.patch.object(fpsim2_helper, 'FPSim2Engine') as engine_class:
+            engine_class.return_value.fps = self.fps
+            self.assertTrue(fpsim2_helper.export_fps(self.fp_filename, self.mmap_path))
+            engine_class.assert_called_once_with(self.fp_filename)
+            np.testing.assert_array_equal(np.load(self.mmap_path), self.fps)
+            # a file newer than the FPSim2 file is kept, unless the export is forced
+            self.assertTrue(fpsim2_helper.is_exported(self.fp_filename, self.mmap_path))
+            self.assertFalse(fpsim2_helper.export_fps(self.fp_filename, self.mmap_path))
+            self.assertEqual(engine_class.call_count, 1)
+            engine_class.return_value.fps = self.fps[:10]
+            self.assertTrue(fpsim2_helper.export_fps(self.fp_filename, self.mmap_path, force=True))
+            self.assertEqual(len(np.load(self.mmap_path)), 10)
+            # an older one is replaced
+            self.set_mtime(self.mmap_path, os.path.getmtime(self.fp_filename) - 60)
+            self.assertFalse(fpsim2_helper.is_exported(self.fp_filename, self.mmap_path))
+            engine_class.return_value.fps = self.fps
+            self.assertTrue(fpsim2_helper.export_fps(self.fp_filename, self.mmap_path))
+            self.assertEqual(len(np.load(self.mmap_path)), len(self.fps))
+        # the temporary file of the export is gone
+        self.assertEqual(sorted(os.listdir(self.directory)), ['chembl.h5', 'chembl.npy'])
+
+    def test_mapped_engine(self):
+        np.save(self.mmap_path, self.fps)
+        with mock.patch.object(fpsim2_helper.FPSim2Engine, '__init__', return_value=None) as engine_init:
+            engine = fpsim2_helper.MappedFPSim2Engine(self.fp_filename, self.mmap_path)
+        engine_init.assert_called_once_with(self.fp_filename, in_memory_fps=False)
+        self.assertIsInstance(engine.fps, np.memmap)
+        np.testing.assert_array_equal(engine.fps, self.fps)
+        # the searches can write to the array, the file does not change
+        engine.fps[0, 0] = 0
+        self.assertEqual(engine.fps[0, 0], 0)
+        np.testing.assert_array_equal(np.load(self.mmap_path), self.fps)
+
+        fpsim2_helper.index_molregnos(engine)
+        molregno = int(self.fps[5, 0])
+        with mock.patch.object(fpsim2_helper, 'get_fpsim_engine', return_value=engine):
+            query = fpsim2_helper.get_molregno_query(molregno)
+            self.assertIsNone(fpsim2_helper.get_molregno_query(molregno + 1))
+        np.testing.assert_array_equal(query[1:], self.fps[5, 1:])
+        self.assertEqual(query[0], 0)
+
+    def test_engine_choice(self):
+        mapped = mock.Mock(fps=self.fps)
+        loaded = mock.Mock(fps=self.fps)
+        with mock.patch.object(fpsim2_helper, 'FPSIM_ENGINE', None), \
+                mock.patch.object(fpsim2_helper, 'FPSIM2_FILE_PATH', self.fp_filename), \
+                mock.patch.object(fpsim2_helper, 'FPSIM2_MMAP_PATH', self.mmap_path), \
+                mock.patch.object(fpsim2_helper, 'MappedFPSim2Engine', return_value=mapped), \
+                mock.patch.object(fpsim2_helper, 'FPSim2Engine', return_value=loaded), \
+                mock.patch('sys.stdout'), mock.patch('sys.stderr'):
+            # the fingerprints are loaded into the process while the file is not exported
+            self.assertIs(fpsim2_helper.get_fpsim_engine(), loaded)
+            fpsim2_helper.FPSIM_ENGINE = None
+            np.save(self.mmap_path, self.fps)
+            self.assertIs(fpsim2_helper.get_fpsim_engine(), mapped)
+            fpsim2_helper.MappedFPSim2Engine.assert_called_once_with(self.fp_filename, self.mmap_path)
+
+
+class SearchWorkersTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        for name in ('FPSIM2_N_WORKERS', 'SEARCH_SLOTS'):
+            patcher = mock.patch.object(fpsim2_helper, name, getattr(fpsim2_helper, name))
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        fpsim2_helper.configure_parallel_search(4, 3, self.directory)
+
+    def test_configure(self):
+        self.assertEqual(fpsim2_helper.FPSIM2_N_WORKERS, 4)
+        self.assertEqual(fpsim2_helper.SEARCH_SLOTS.size, 3)
+        fpsim2_helper.configure_parallel_search(1, 3, self.directory)
+        self.assertIsNone(fpsim2_helper.SEARCH_SLOTS)
+        with fpsim2_helper.search_workers(4) as workers:
+            self.assertEqual(workers, 1)
+        fpsim2_helper.configure_parallel_search(0, 0, self.directory)
+        self.assertEqual(fpsim2_helper.FPSIM2_N_WORKERS, 1)
+        self.assertIsNone(fpsim2_helper.SEARCH_SLOTS)
+
+    def test_shared_slots(self):
+        with fpsim2_helper.search_workers(3) as first:
+            self.assertEqual(first, 3)
+            with fpsim2_helper.search_workers(4) as second:
+                self.assertEqual(second, 2)
+                # the searches never wait, they run on their own thread when all the shared ones are taken
+                with self.assertLogs('chembl_webservices.core.fpsim2_helper', 'INFO'):
+                    with fpsim2_helper.search_workers(4) as third:
+                        self.assertEqual(third, 1)
+            with fpsim2_helper.search_workers(4) as fourth:
+                self.assertEqual(fourth, 2)
+        with fpsim2_helper.search_workers(4) as fifth:
+            self.assertEqual(fifth, 4)
+        with fpsim2_helper.search_workers(1) as single:
+            self.assertEqual(single, 1)
+
+    def test_released_on_errors(self):
+        with self.assertRaises(RuntimeError):
+            with fpsim2_helper.search_workers(4):
+                raise RuntimeError
+        with fpsim2_helper.search_workers(4) as workers:
+            self.assertEqual(workers, 4)
+
+    def test_other_processes(self):
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if not pid:
+            # a search of another worker, killed before it gives its slots back
+            try:
+                slots = fpsim2_helper.SEARCH_SLOTS.acquire(2)
+                os.write(write_fd, str(len(slots)).encode())
+                time.sleep(60)
+            finally:
+                os._exit(0)
+        try:
+            self.assertEqual(os.read(read_fd, 1), b'2')
+            with fpsim2_helper.search_workers(4) as workers:
+                self.assertEqual(workers, 2)
+        finally:
+            os.kill(pid, 9)
+            os.waitpid(pid, 0)
+            os.close(read_fd)
+            os.close(write_fd)
+        with fpsim2_helper.search_workers(4) as workers:
+            self.assertEqual(workers, 4)
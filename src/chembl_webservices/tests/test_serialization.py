@@ -0,0 +1,100 @@
+import datetime
+from decimal import Decimal
+from django.test import SimpleTestCase
+from tastypie.bundle import Bundle
+from tastypie.serializers import Serializer
+from chembl_webservices.core.serialization import StreamedCollection
+from chembl_webservices.resources.molecule import MoleculeResource
+
+
+class SerializationTestCase(SimpleTestCase):
+    """
+    The streamed XML and the JSON encoded with the plans of the resources are the same bytes tastypie writes.
+    """
+
+    def setUp(self):
+        self.resource = MoleculeResource()
+        self.serializer = self.resource._meta.serializer
+        self.options = {'json_plan': self.resource.get_json_plan()}
+        self.aspirin = Bundle(data={
+            'molecule_chembl_id': 'CHEMBL25',
+            'pref_name': 'ASPIRIN',
+            'max_phase': 4,
+            'oral': True,
+            'topical': False,
+            'usan_stem': None,
+            'score': 1.5,
+            'molecule_properties': Bundle(data={
+                'full_mwt': Decimal('180.16'),
+                'alogp': Decimal('1.31'),
+                'cx_logd': None,
+                'hba': 3,
+                'full_molformula': 'C9H8O4',
+            }),
+            'molecule_hierarchy': None,
+            'molecule_synonyms': [
+                Bundle(data={'molecule_synonym': 'Acetylsalicylic acid', 'syn_type': 'OTHER'}),
+                Bundle(data={'molecule_synonym': 'Aspirina ácido', 'syn_type': 'TRADE_NAME'}),
+            ],
+            'cross_references': [],
+        })
+        self.other = Bundle(data={
+            'molecule_chembl_id': 'CHEMBL1200',
+            'pref_name': 'Müller – β-blocker 中文',
+            # values of another type than the field's are converted like tastypie does
+            'max_phase': Decimal('3'),
+            'first_approval': '1990',
+            'oral': None,
+            'score': float('nan'),
+            'molecule_properties': Bundle(data={'full_mwt': 432.5, 'alogp': Decimal('-0.10'), 'hba': None}),
+            'molecule_synonyms': [],
+            # not a field of the resource
+            'extra': {'updated': datetime.datetime(2020, 10, 18, 10, 0), 'values': (1, Decimal('2.5'), None)},
+        })
+        self.page_meta = {'limit': 20, 'offset': 0, 'next': None, 'previous': None, 'total_count': 2}
+
+    def get_page(self, streamed=False):
+        objects = [self.aspirin, self.other]
+        if streamed:
+            objects = StreamedCollection(objects, lambda bundle: bundle)
+            objects.prime()
+        return {'page_meta': dict(self.page_meta), 'molecules': objects}
+
+    def test_json(self):
+        for data in (self.aspirin, self.other, self.get_page()):
+            expected = Serializer.to_json(self.serializer, data, {})
+            self.assertEqual(self.serializer.to_json(data, self.options), expected)
+            self.assertEqual(self.serializer.to_json(data), expected)
+
+    def test_streamed_json(self):
+        expected = Serializer.to_json(self.serializer, self.get_page(), {})
+        for options in (self.options, {}):
+            self.assertEqual(''.join(self.serializer.iter_json(self.get_page(streamed=True), options)), expected)
+        empty = {'page_meta': dict(self.page_meta, total_count=0), 'molecules': StreamedCollection([], None)}
+        self.assertEqual(''.join(self.serializer.iter_json(empty, self.options)),
+                         Serializer.to_json(self.serializer, dict(empty, molecules=[]), {}))
+
+    def test_xml(self):
+        for data in (self.aspirin, self.other, self.get_page()):
+            self.assertEqual(self.serializer.to_xml(data, {}), Serializer.to_xml(self.serializer, data, {}))
+
+    def test_streamed_xml(self):
+        expected = Serializer.to_xml(self.serializer, self.get_page(), {})
+        self.assertEqual(b''.join(self.serializer.iter_xml(self.get_page(streamed=True), {})), expected)
+        empty = {'page_meta': dict(self.page_meta, total_count=0), 'molecules': StreamedCollection([], None)}
+        self.assertEqual(b''.join(self.serializer.iter_xml(empty, {})),
+                         Serializer.to_xml(self.serializer, dict(empty, molecules=[]), {}))
+
+    def test_xml_root(self):
+        serializer_class = type(self.serializer)
+
+        class RootSerializer(serializer_class):
+            def to_etree(self, data, options=None, name=None, depth=0):
+                if depth == 0 and isinstance(data, dict):
+                    name = name or 'chembl'
+                return super(RootSerializer, self).to_etree(data, options, name, depth)
+
+        serializer = RootSerializer()
+        xml = b''.join(serializer.iter_xml(self.get_page(streamed=True), {}))
+        self.assertEqual(xml, Serializer.to_xml(serializer, self.get_page(), {}))
+        self.assertIn(b'<chembl>', xml)
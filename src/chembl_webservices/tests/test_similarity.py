@@ -0,0 +1,73 @@
+import requests
+import urllib.parse
+
+from chembl_webservices.tests import BaseWebServiceTestCase
+
+
+class SimilarityTestCase(BaseWebServiceTestCase):
+
+    ASPIRIN = 'CC(=O)Oc1ccccc1C(=O)O'
+
+    def get_top_k_molecules(self, smiles, similarity, top_k):
+        req_url = self.WS_URL + '/similarity/{0}/{1}.json?top_k={2}&limit={2}'.format(
+            urllib.parse.quote(smiles), similarity, top_k)
+        return self.request_url(req_url)['molecules']
+
+    def test_top_k(self):
+        req_url = self.WS_URL + '/similarity/{0}/70.json?limit=1000'.format(urllib.parse.quote(self.ASPIRIN))
+        all_hits = self.request_url(req_url)['molecules']
+        all_similarities = sorted([float(mol['similarity']) for mol in all_hits], reverse=True)
+
+        for top_k in (1, 10, 25):
+            top_hits = self.get_top_k_molecules(self.ASPIRIN, 70, top_k)
+            similarities = [float(mol['similarity']) for mol in top_hits]
+            # most similar first, and the same scores as the first hits of the threshold search
+            self.assertEqual(similarities, sorted(similarities, reverse=True))
+            self.assertEqual(similarities, all_similarities[:top_k])
+            # only the hits tied with the k-th similarity may differ, they are chosen by molregno
+            kth = similarities[-1]
+            self.assertEqual(set(mol['molecule_chembl_id'] for mol in top_hits if float(mol['similarity']) > kth),
+                             set(mol['molecule_chembl_id'] for mol in all_hits if float(mol['similarity']) > kth))
+            self.assertEqual(top_hits, self.get_top_k_molecules(self.ASPIRIN, 70, top_k))
+
+        # the threshold still applies, fewer than top_k molecules are returned when fewer reach it
+        top_hits = self.get_top_k_molecules(self.ASPIRIN, 95, 1000)
+        self.assertEqual(len(top_hits), len([sim for sim in all_similarities if sim >= 95]))
+        # any threshold is accepted with top_k
+        self.assertEqual(len(self.get_top_k_molecules(self.ASPIRIN, 0, 50)), 50)
+        self.request_url(self.WS_URL + '/similarity/{0}/40.json'.format(urllib.parse.quote(self.ASPIRIN)),
+                         expected_code=400)
+
+    def post_batch(self, data, expected_code=200):
+        response = requests.post(self.WS_URL + '/similarity/batch.json', json=data, timeout=self.TIMEOUT)
+        self.assertEqual(response.status_code, expected_code)
+        return response.json() if expected_code == 200 else None
+
+    def test_batch(self):
+        batch = self.post_batch({'queries': [self.ASPIRIN, 'CHEMBL25', 'not_a_smiles', 'CHEMBL6961'],
+                                 'similarity': 70, 'top_k': 10})
+        self.assertEqual(batch['fields'], ['molregno', 'molecule_chembl_id', 'similarity'])
+        aspirin, chembl25, invalid, no_structure = batch['queries']
+        top_hits = self.get_top_k_molecules(self.ASPIRIN, 70, 10)
+        # the same similarities as the single top_k search
+        self.assertEqual([round(row[2], 4) for row in aspirin['hits']],
+                         [round(float(mol['similarity']), 4) for mol in top_hits])
+        self.assertLessEqual(len(chembl25['hits']), 10)
+        self.assertNotIn('CHEMBL25', [row[1] for row in chembl25['hits']])
+        self.assertEqual(invalid['error_message'], 'Invalid SMILES: not_a_smiles')
+        self.assertIn('error_message', no_structure)
+
+        self.post_batch({'queries': [self.ASPIRIN]}, expected_code=400)
+        self.post_batch({'queries': [self.ASPIRIN], 'similarity': 40}, expected_code=400)
+        self.post_batch({'queries': [self.ASPIRIN] * 1001, 'similarity': 70}, expected_code=400)
+
+    def test_identifier_query(self):
+        smiles = self.get_resource_by_id('molecule', 'CHEMBL25')['molecule_structures']['canonical_smiles']
+        req_url = self.WS_URL + '/similarity/{0}/70.json?limit=1000'
+        by_id = self.request_url(req_url.format('CHEMBL25'))['molecules']
+        by_smiles = self.request_url(req_url.format(urllib.parse.quote(smiles)))['molecules']
+        # the fingerprint read from the FPSim2 file finds the same molecules as the one of the SMILES, the molecule
+        # searched by its identifier is left out of its hits
+        self.assertEqual(dict((mol['molecule_chembl_id'], mol['similarity']) for mol in by_id),
+                         dict((mol['molecule_chembl_id'], mol['similarity']) for mol in by_smiles
+                              if mol['molecule_chembl_id'] != 'CHEMBL25'))
@@ -0,0 +1,46 @@
+import io
+import tempfile
+import unittest
+from django.conf import settings
+from django.core.management import call_command
+from django.test import Client
+from chembl_webservices.core.meta import ChemblResourceMeta
+from chembl_webservices.management.commands.warm_chembl_cache import parse_url
+
+
+class WarmCacheTestCase(unittest.TestCase):
+
+    DETAIL_URL = settings.SERVER_BASE_PATH + '/data/molecule/CHEMBL25.json'
+    LIST_URL = settings.SERVER_BASE_PATH + '/data/molecule.json?max_phase=4&limit=5'
+
+    def test_parse_url(self):
+        self.assertEqual(parse_url(self.DETAIL_URL), self.DETAIL_URL)
+        self.assertEqual(parse_url('http://localhost:8000' + self.LIST_URL + '\n'), self.LIST_URL)
+        self.assertEqual(parse_url('127.0.0.1 - - [18/Oct/2020:10:00:00 +0000] "GET {0} HTTP/1.1" 200 1024'
+                                   .format(self.LIST_URL)), self.LIST_URL)
+        self.assertEqual(parse_url('{{"url": "{0}", "status": 200}}'.format(self.DETAIL_URL)), self.DETAIL_URL)
+        self.assertEqual(parse_url('{{"request": "GET {0} HTTP/1.1"}}'.format(self.DETAIL_URL)), self.DETAIL_URL)
+        self.assertIsNone(parse_url('127.0.0.1 - - "POST {0} HTTP/1.1" 200'.format(self.DETAIL_URL)))
+        self.assertIsNone(parse_url('/admin/'))
+        self.assertIsNone(parse_url('# ' + self.DETAIL_URL))
+
+    def test_warm_molecule(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.log') as access_log:
+            for url in (self.DETAIL_URL, self.LIST_URL, self.DETAIL_URL):
+                access_log.write('127.0.0.1 - - [18/Oct/2020:10:00:00 +0000] "GET {0} HTTP/1.1" 200 1024\n'
+                                 .format(url))
+            access_log.flush()
+            out = io.StringIO()
+            call_command('warm_chembl_cache', access_log.name, threads=2, stdout=out)
+        report = out.getvalue()
+        self.assertIn('Replayed 2 requests', report)
+        for endpoint in ('molecule:api_dispatch_detail', 'molecule:api_dispatch_list'):
+            self.assertRegex(report, r'{0} +1 .* 200:1\n'.format(endpoint))
+
+        # the test client is served from the cache the command filled
+        stats = ChemblResourceMeta.cache.stats
+        hits = stats.as_dict().get('molecule', {}).get('hits', 0)
+        client = Client()
+        for url in (self.DETAIL_URL, self.LIST_URL):
+            self.assertEqual(client.get(url).status_code, 200)
+        self.assertEqual(stats.as_dict()['molecule']['hits'], hits + 2)
@@ -174,6 +174,28 @@ elif not FPSIM2_FILE_CHECKED:
 
 import chembl_webservices.core.fpsim2_helper as fpsim2_helper
 fpsim2_helper.FPSIM2_FILE_PATH = FPSIM2_FILE_PATH
+# the fingerprints are mapped in memory from this file, shared by all the workers. It is written from the FPSim2 file
+# by the export_fpsim2_fps command, on deployment, and can live on a read-only volume afterwards. Without it each
+# worker loads a private copy of the fingerprints
+FPSIM2_MMAP_PATH = os.environ.get('FPSIM2_MMAP_PATH') or None
+fpsim2_helper.FPSIM2_MMAP_PATH = FPSIM2_MMAP_PATH
+
+# Threads of a single similarity search, and the threads shared by the concurrent searches of all the workers on top
+# of their own one. The shared threads are lock files in FPSIM2_SEARCH_SLOTS_DIRECTORY, a directory of the temporary
+# directory by default
+FPSIM2_N_WORKERS = int(os.environ.get('FPSIM2_N_WORKERS', 1))
+FPSIM2_SHARED_WORKERS = int(os.environ.get('FPSIM2_SHARED_WORKERS', os.cpu_count() or 1))
+FPSIM2_SEARCH_SLOTS_DIRECTORY = os.environ.get('FPSIM2_SEARCH_SLOTS_DIRECTORY') or None
+fpsim2_helper.configure_parallel_search(FPSIM2_N_WORKERS, FPSIM2_SHARED_WORKERS, FPSIM2_SEARCH_SLOTS_DIRECTORY)
+
+# Largest number of nearest neighbours the similarity resource returns with the top_k parameter
+FPSIM2_MAX_TOP_K = int(os.environ.get('FPSIM2_MAX_TOP_K', 1000))
+
+# Largest number of structures of a single POST to similarity/batch, each of them keeps at most FPSIM2_MAX_TOP_K hits
+FPSIM2_MAX_BATCH_QUERIES = int(os.environ.get('FPSIM2_MAX_BATCH_QUERIES', 100))
+
+# Number of query fingerprints, by SMILES or by identifier, each worker keeps. 0 disables the cache
+fpsim2_helper.QUERY_CACHE.size = int(os.environ.get('FPSIM2_QUERY_CACHE_SIZE', 10000))
 
 LOAD_FPSIM2_FILE = int(os.environ.get('LOAD_FPSIM2_FILE', 0))
 
@@ -350,7 +372,8 @@ CACHES = {
         'OPTIONS': {
             'HOST': os.environ.get('MONGO_CACHE_HOSTS').split(' '),
             'RSNAME': os.environ.get('MONGO_CACHE_RSNAME'),
-            'MAX_ENTRIES': 100000000000,
+            'MAX_ENTRIES': int(os.environ.get('MONGO_CACHE_MAX_ENTRIES', 20000000)),
+            'CULL_FREQUENCY': 10,
             'AUTH_DATABASE': os.environ.get('MONGO_CACHE_AUTH_DATABASE'),
             'DATABASE': os.environ.get('MONGO_CACHE_DATABASE'),
             'USER': os.environ.get('MONGO_CACHE_USER'),
@@ -361,7 +384,22 @@ CACHES = {
             'MAX_TIME_MS': 1000,
             'COMPRESSION_LEVEL': 6,
             'COMPRESSION': True,
+            # zlib, lz4 (requires lz4) or zstd (requires zstandard), legacy base64 entries are still readable
+            'CODEC': os.environ.get('MONGO_CACHE_CODEC', 'zlib'),
+            'BINARY': True,
             'READ_PREFERENCE': ReadPreference.SECONDARY_PREFERRED,
+            # one collection per ChEMBL release, previous releases are dropped with the clear_chembl_cache command.
+            # Each worker reads the release once, when it first uses the cache, workers are restarted on a new release
+            'NAMESPACE_FUNCTION': 'chembl_webservices.core.cache.chembl_release_namespace',
+            # misses of a new release are looked up in the previous one, and served stale, for this many seconds
+            'NAMESPACE_FALLBACK_WINDOW': int(os.environ.get('MONGO_CACHE_FALLBACK_WINDOW', 3 * 24 * 3600)),
+            # In-process LRU of the decompressed pickles in front of Mongo, one per gunicorn worker
+            'L1': {
+                'CLASS': 'chembl_core_db.cache.lru.LRUCache',
+                'MAX_BYTES': int(os.environ.get('CACHE_L1_MAX_BYTES', 128 * 1024 * 1024)),
+                'MAX_ITEM_BYTES': int(os.environ.get('CACHE_L1_MAX_ITEM_BYTES', 8 * 1024 * 1024)),
+                'TIMEOUT': int(os.environ.get('CACHE_L1_TIMEOUT', 600)),
+            },
             'INDEXES': [
                 {
                     'NAME': 'resource_search',
@@ -383,3 +421,32 @@ CACHES = {
 }
 
 CACHE_MIDDLEWARE_SECONDS = 3000000
+
+# List pages are written to the cache by a background thread of each worker after the response is built
+CACHE_WRITE_BEHIND = int(os.environ.get('CACHE_WRITE_BEHIND', 1))
+
+# Concurrent misses of the same list are computed by a single worker, the others wait for its result
+CACHE_SINGLE_FLIGHT = {
+    # chembl_core_db.cache.locks.FileLock coalesces only the workers of a host
+    'CLASS': os.environ.get('CACHE_LOCK_CLASS', 'chembl_core_db.cache.locks.MongoLock'),
+    'TIMEOUT': 120,
+    'WAIT': 30,
+    'POLL_INTERVAL': 0.1,
+}
+
+# Cached values older than this (in seconds) or computed from a previous ChEMBL release are served stale while they
+# are refreshed in the background, 0 disables the age check
+CACHE_SOFT_TIMEOUT = int(os.environ.get('CACHE_SOFT_TIMEOUT', 0)) or None
+
+# Total count of the list pages: 'exact' (default), 'estimate' (PostgreSQL planner statistics) or 'auto', which only
+# estimates unfiltered lists of tables over EXACT_COUNT_THRESHOLD rows and counts every other list exactly. Estimated
+# counts are flagged with page_meta.total_count_is_estimate and the X-Total-Count-Is-Estimate header
+COUNT_STRATEGY = os.environ.get('COUNT_STRATEGY', 'exact')
+EXACT_COUNT_THRESHOLD = int(os.environ.get('EXACT_COUNT_THRESHOLD', 100000))
+
+# List pages of at least this many objects are streamed (JSON, XML, SDF), 0 disables streaming. Streamed responses
+# are not stored by the cache middleware
+STREAMING_MIN_OBJECTS = int(os.environ.get('STREAMING_MIN_OBJECTS', 200))
+
+# Responses in these formats are gzip compressed for the clients sending Accept-Encoding: gzip
+GZIP_FORMATS = ('sdf',)